@@ -0,0 +1,163 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Directory holding the vector index, chunks and segments
+VECTOR_DB_DIR = os.getenv("VECTOR_DB_DIR", "vector_db")
+
+# Shards the index is partitioned into, each with its own files under
+# VECTOR_DB_DIR/shards/ and its own locks. New documents are placed by a hash of
+# their ID; searches across documents query the shards in parallel on
+# SHARD_POOL_SIZE threads and merge their results.
+INDEX_SHARDS = int(os.getenv("INDEX_SHARDS", "4"))
+SHARD_POOL_SIZE = int(os.getenv("SHARD_POOL_SIZE", str(INDEX_SHARDS)))
+
+# Number of appended segments that triggers a background compaction (per shard)
+COMPACT_SEGMENTS = int(os.getenv("COMPACT_SEGMENTS", "32"))
+
+# Fraction of deleted (tombstoned) vectors that triggers a compaction purging them
+COMPACT_TOMBSTONE_RATIO = float(os.getenv("COMPACT_TOMBSTONE_RATIO", "0.2"))
+
+# Sentence-transformers model used for chunk and query embeddings
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+# Embedding runtime: sentence_transformers (PyTorch), onnx or onnx_int8 (ONNX Runtime).
+# ONNX backends export the model to EMBEDDING_ONNX_DIR on first use.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence_transformers")
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", os.path.join("models", EMBEDDING_MODEL.replace("/", "--") + "-onnx"))
+# Inference threads (0 keeps the runtime's default) and inputs per forward pass
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+# Check ONNX embeddings against sentence-transformers at startup: the lowest cosine
+# similarity on reference sentences must be at least 1 - EMBEDDING_CHECK_TOLERANCE.
+# The comparison runs once per exported model, and is recorded next to it.
+EMBEDDING_CHECK = os.getenv("EMBEDDING_CHECK", "true").lower() == "true"
+EMBEDDING_CHECK_TOLERANCE = float(os.getenv("EMBEDDING_CHECK_TOLERANCE", "0.02"))
+
+# Reuse embeddings of chunk texts seen before, keyed by text and model
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+
+# Vector index backend: flat, sq8, ivf_flat, ivf_pq or hnsw
+INDEX_BACKEND = os.getenv("INDEX_BACKEND", "flat")
+
+# IVF settings
+IVF_NLIST = int(os.getenv("IVF_NLIST", "1024"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+# FAISS needs roughly 39 training points per centroid
+IVF_TRAIN_MIN = int(os.getenv("IVF_TRAIN_MIN", str(IVF_NLIST * 39)))
+
+# Product quantization settings (PQ_M must divide the embedding dimension)
+PQ_M = int(os.getenv("PQ_M", "48"))
+PQ_NBITS = int(os.getenv("PQ_NBITS", "8"))
+
+# Vectors needed to train the sq8 (int8 scalar quantizer) value ranges
+SQ_TRAIN_MIN = int(os.getenv("SQ_TRAIN_MIN", "1000"))
+
+# Quantized backends (sq8, ivf_pq) fetch RERANK_FACTOR times more candidates and
+# re-rank them exactly against float vectors memory-mapped from disk
+RERANK_FLOAT = os.getenv("RERANK_FLOAT", "true").lower() == "true"
+RERANK_FACTOR = int(os.getenv("RERANK_FACTOR", "4"))
+
+# HNSW settings
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+# Largest ef_search a query may request; each search allocates candidate heaps of that size
+HNSW_EF_SEARCH_MAX = max(int(os.getenv("HNSW_EF_SEARCH_MAX", "1024")), HNSW_EF_SEARCH)
+
+# Hybrid retrieval: BM25 over an inverted index alongside vector search, merged
+# with reciprocal-rank fusion. Each ranker contributes HYBRID_CANDIDATES results.
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Context assembly for answers: CONTEXT_CANDIDATES retrieved chunks are re-ranked
+# (mmr, cross_encoder or none), near-duplicates dropped, and the best packed into
+# the prompt up to CONTEXT_TOKEN_BUDGET tokens and CONTEXT_MAX_CHUNKS chunks.
+# Tokens are estimated at CONTEXT_CHARS_PER_TOKEN characters each.
+CONTEXT_RERANKER = os.getenv("CONTEXT_RERANKER", "mmr")
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "20"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+CONTEXT_MAX_CHUNKS = int(os.getenv("CONTEXT_MAX_CHUNKS", "8"))
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+# MMR trade-off between relevance to the query (1.0) and novelty against the chunks already chosen (0.0)
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# A chunk sharing at least this fraction of its word 3-grams with a chosen chunk is a duplicate
+CONTEXT_DEDUP_OVERLAP = float(os.getenv("CONTEXT_DEDUP_OVERLAP", "0.8"))
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+# Worker pools that keep blocking work off the event loop. PDF parsing can use
+# a thread or process pool; embedding and index search run on threads because
+# the model and index live in this process.
+PARSE_POOL_KIND = os.getenv("PARSE_POOL_KIND", "process")
+PARSE_POOL_SIZE = int(os.getenv("PARSE_POOL_SIZE", str(os.cpu_count() or 1)))
+EMBED_POOL_SIZE = int(os.getenv("EMBED_POOL_SIZE", "1"))
+QUERY_POOL_SIZE = int(os.getenv("QUERY_POOL_SIZE", "4"))
+# Tasks each pool accepts at once; further callers wait for a free slot
+POOL_MAX_PENDING = int(os.getenv("POOL_MAX_PENDING", "32"))
+
+# Multi-process serving, e.g. uvicorn --workers N. The first process to lock
+# VECTOR_DB_DIR/writer.lock becomes the writer: it alone ingests, deletes and
+# compacts. The others are readers that memory-map the index generations it
+# writes, sharing them through the page cache, and check its manifest for a new
+# version every RELOAD_INTERVAL_MS.
+MULTI_PROCESS = os.getenv("MULTI_PROCESS", "false").lower() == "true"
+RELOAD_INTERVAL_MS = int(os.getenv("RELOAD_INTERVAL_MS", "500"))
+# How often the writer picks up uploads and deletions made through reader processes
+INGEST_POLL_INTERVAL_MS = int(os.getenv("INGEST_POLL_INTERVAL_MS", "1000"))
+
+# Document metadata database, opened through an async connection pool in WAL
+# mode so reads never wait for the ingestion worker's writes. Connections beyond
+# DB_POOL_SIZE + DB_MAX_OVERFLOW wait up to DB_POOL_TIMEOUT seconds; a write
+# waits up to DB_BUSY_TIMEOUT seconds for another process's write to finish.
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./documents.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "30"))
+
+# Chunking: page texts are split on sentence boundaries into chunks of at most
+# CHUNK_MAX_TOKENS tokens of the embedding model's tokenizer (capped at what the
+# model reads), so no chunk is truncated when it is embedded. A chunk repeats
+# whole sentences from up to CHUNK_OVERLAP_TOKENS tokens at the end of the previous one.
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+
+# Ingestion queue: uploads are stored here until a background worker has indexed them
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+# Block size used to stream uploads to UPLOAD_DIR
+UPLOAD_BLOCK_SIZE = int(os.getenv("UPLOAD_BLOCK_SIZE", str(1024 * 1024)))
+# Pages extracted per parse call. Up to INGEST_PARSE_AHEAD batches are parsed in
+# parallel on the parse pool while the current one is embedded.
+INGEST_BATCH_PAGES = int(os.getenv("INGEST_BATCH_PAGES", "16"))
+INGEST_PARSE_AHEAD = int(os.getenv("INGEST_PARSE_AHEAD", str(PARSE_POOL_SIZE)))
+# Documents ingested at once, so small files parse while a large one is embedded
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Chunks embedded and committed together (rounded up to whole pages);
+# progress is recorded after each batch
+INGEST_BATCH_CHUNKS = int(os.getenv("INGEST_BATCH_CHUNKS", "256"))
+
+# Query micro-batching: concurrent queries arriving within the window (or up to
+# the max batch size) are embedded and searched together. A window of 0 disables it.
+QUERY_BATCH_WINDOW_MS = float(os.getenv("QUERY_BATCH_WINDOW_MS", "2"))
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "32"))
+
+# Answer cache for /query: exact normalized matches plus semantic matches above
+# the cosine similarity threshold, for queries that retrieve the same chunks
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+ANSWER_CACHE_MAX_MB = int(os.getenv("ANSWER_CACHE_MAX_MB", "64"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+# Metrics and tracing: /metrics serves stage latency histograms and index and
+# queue gauges for Prometheus. Every request and ingestion gets a trace ID
+# (X-Trace-Id, taken from the request if given); a TRACE_SAMPLE_RATE fraction of
+# them, and every request that brings its own ID, also record a span per stage,
+# and the last TRACE_BUFFER_SIZE of those are served by /api/traces.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
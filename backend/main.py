@@ -1,6 +1,11 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+import asyncio
 import os
+import re
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -10,10 +15,101 @@ load_dotenv()
 if not os.getenv("GEMINI_API_KEY"):
     raise ValueError("GEMINI_API_KEY environment variable is not set")
 
+# Import routers and services. Importing them is cheap: the embedding model,
+# index and Gemini client are created by the service container's warm-up.
+from backend.routes.endpoints import router as api_router
+from backend.services.container import services
+from backend.services.workers import shutdown_pools
+from backend.services.ingestion_queue import start_ingestion_worker, stop_ingestion_worker
+from backend.services.vector_store import claim_role
+from backend.services import metrics
+from backend.models.database import engine
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Verify required environment variables
+    required_env_vars = ["GEMINI_API_KEY"]
+    missing_vars = [var for var in required_env_vars if not os.getenv(var)]
+    if missing_vars:
+        raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
+    
+    # Warm up in the background so the worker starts serving health checks at
+    # once; /health/ready reports when it can take traffic
+    warm_up_task = asyncio.create_task(services.warm_up())
+    
+    # Start background ingestion, resuming documents left over from a previous run.
+    # With MULTI_PROCESS, only the writer process ingests.
+    if claim_role() == "writer":
+        await start_ingestion_worker()
+    
+    yield
+    
+    await stop_ingestion_worker()
+    warm_up_task.cancel()
+    
+    # Let running parse/embed/query tasks finish and stop the worker pools
+    shutdown_pools()
+    
+    # Close the pooled database connections
+    await engine.dispose()
+
+# Trace IDs accepted from clients
+TRACE_ID_PATTERN = re.compile(r'[0-9A-Za-z_-]{1,64}')
+
+def route_template(scope) -> str:
+    """The path template of the route a request matched, e.g. /api/jobs/{job_id}"""
+    route = scope.get("route")
+    if not hasattr(route, "path_regex"):
+        return "unmatched"
+    # Routes of an included router may have matched the path without its prefix
+    path = scope["path"]
+    for i, char in enumerate(path):
+        if char == "/" and route.path_regex.match(path[i:]):
+            return path[:i] + route.path
+    return route.path
+
+class TraceMiddleware:
+    """
+    Runs each HTTP request in a trace, identified by the request's X-Trace-Id
+    header or a new ID, and returns the ID in the response's X-Trace-Id header.
+    Requests that bring their own ID are always sampled. Latency is recorded
+    per route template until the response body is sent, streams included.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        given = dict(scope["headers"]).get(b"x-trace-id", b"").decode("latin-1")
+        trace_id = given if TRACE_ID_PATTERN.fullmatch(given) else None
+        status = 500
+        
+        with metrics.trace("http", trace_id, True if trace_id else None) as trace:
+            async def send_with_trace_id(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", trace.id.encode())]
+                await send(message)
+            
+            start = time.perf_counter()
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            finally:
+                # Route templates rather than paths keep the label set small
+                route = route_template(scope)
+                trace.name = f"{scope['method']} {route}"
+                metrics.HTTP_SECONDS.observe(time.perf_counter() - start, scope["method"], route, str(status))
+
 # Initialize FastAPI app
 app = FastAPI(
     title="RAG API",
-    description="PDF RAG Pipeline with Gemini and Vector Search"
+    description="PDF RAG Pipeline with Gemini and Vector Search",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -25,19 +121,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Import and include routers
-from backend.routes.endpoints import router as api_router
-app.include_router(api_router, prefix="/api")
+app.add_middleware(TraceMiddleware)
 
-# Startup event
-@app.on_event("startup")
-async def startup_event():
-    # Verify required environment variables
-    required_env_vars = ["GEMINI_API_KEY"]
-    missing_vars = [var for var in required_env_vars if not os.getenv(var)]
-    if missing_vars:
-        raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
+app.include_router(api_router, prefix="/api")
 
 @app.get("/")
 async def root():
-    return {"message": "RAG API is running", "status": "healthy"} 
\ No newline at end of file
+    return {"message": "RAG API is running", "status": "healthy"}
+
+@app.get("/health/live")
+async def liveness():
+    """The process is up and serving requests"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """
+    Whether the model and index are loaded, with the startup time of each step.
+    Returns 503 while warming up or if warm-up failed.
+    """
+    status = services.status()
+    return JSONResponse(status, status_code=200 if status["status"] == "ready" else 503)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Stage latencies, request latencies and index and queue gauges of this process, for Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,18 +1,40 @@
-from sqlalchemy import Column, Integer, String, DateTime, create_engine
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from datetime import datetime
-import os
+from backend import config
 
-# Create SQLite database engine
-DATABASE_URL = "sqlite:///./documents.db"
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Create the async SQLite database engine. Requests and the ingestion worker
+# borrow connections from the pool instead of blocking the event loop.
+DATABASE_URL = config.DATABASE_URL
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=config.DB_POOL_SIZE,
+    max_overflow=config.DB_MAX_OVERFLOW,
+    pool_timeout=config.DB_POOL_TIMEOUT,
+    connect_args={"timeout": config.DB_BUSY_TIMEOUT},
+)
+# Loaded attributes stay readable after a commit, so nothing is lazily reloaded
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+@event.listens_for(engine.sync_engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside a writer; NORMAL sync is durable in WAL mode
+    # except for the last transactions before a power loss
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
 
 Base = declarative_base()
 
 class Document(Base):
     __tablename__ = "documents"
+    # Keyset pagination of /documents walks this index
+    __table_args__ = (Index("ix_documents_upload_date_id", "upload_date", "id"),)
 
     id = Column(String, primary_key=True)
     filename = Column(String, nullable=False)
@@ -20,15 +42,111 @@ class Document(Base):
     total_pages = Column(Integer, nullable=False)
     total_chunks = Column(Integer, nullable=False)
     file_size = Column(Integer, nullable=False)  # in bytes
-    status = Column(String, default="processed")  # processed, failed, processing
+    file_hash = Column(String, nullable=True, index=True)  # SHA-256 of the PDF, for duplicate uploads
+    status = Column(String, default="processed")  # queued, processing, processed, failed, deleting
+    job_id = Column(String, ForeignKey("ingestion_jobs.id"), nullable=True, index=True)
+    file_path = Column(String, nullable=True)  # stored upload, removed once ingested
+    pages_processed = Column(Integer, nullable=False, default=0)
+    chunks_embedded = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String, primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Primary key of the single document_totals row
+TOTALS_ID = 1
+
+class DocumentTotals(Base):
+    """
+    Totals over the documents table in a single row, kept up to date by
+    triggers on every insert, update and delete, so statistics and page counts
+    never scan the table
+    """
+    __tablename__ = "document_totals"
+
+    id = Column(Integer, primary_key=True)
+    total_documents = Column(Integer, nullable=False, default=0)
+    total_pages = Column(Integer, nullable=False, default=0)
+    total_chunks = Column(Integer, nullable=False, default=0)
+    total_size = Column(Integer, nullable=False, default=0)
+
+TOTALS_TRIGGERS = {
+    "documents_totals_insert": f"""
+        AFTER INSERT ON documents BEGIN
+            UPDATE document_totals SET
+                total_documents = total_documents + 1,
+                total_pages = total_pages + NEW.total_pages,
+                total_chunks = total_chunks + NEW.total_chunks,
+                total_size = total_size + NEW.file_size
+            WHERE id = {TOTALS_ID};
+        END""",
+    "documents_totals_update": f"""
+        AFTER UPDATE OF total_pages, total_chunks, file_size ON documents BEGIN
+            UPDATE document_totals SET
+                total_pages = total_pages + NEW.total_pages - OLD.total_pages,
+                total_chunks = total_chunks + NEW.total_chunks - OLD.total_chunks,
+                total_size = total_size + NEW.file_size - OLD.file_size
+            WHERE id = {TOTALS_ID};
+        END""",
+    "documents_totals_delete": f"""
+        AFTER DELETE ON documents BEGIN
+            UPDATE document_totals SET
+                total_documents = total_documents - 1,
+                total_pages = total_pages - OLD.total_pages,
+                total_chunks = total_chunks - OLD.total_chunks,
+                total_size = total_size - OLD.file_size
+            WHERE id = {TOTALS_ID};
+        END""",
+}
+
+def add_missing_columns(connection):
+    """Add columns introduced after a table was created (create_all only creates new tables)"""
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            default = f" DEFAULT {column.default.arg!r}" if column.default is not None and not callable(column.default.arg) else ""
+            connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}"))
+
+def add_missing_indexes(connection):
+    """Create indexes introduced after a table was created"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+def create_totals_triggers(connection):
+    """
+    Seed the document totals from the documents table, once, and install the
+    triggers that keep them current. Runs in the same transaction, so no
+    document is counted twice or missed.
+    """
+    connection.execute(text(
+        "INSERT OR IGNORE INTO document_totals (id, total_documents, total_pages, total_chunks, total_size) "
+        "SELECT :id, count(*), coalesce(sum(total_pages), 0), coalesce(sum(total_chunks), 0), coalesce(sum(file_size), 0) "
+        "FROM documents"
+    ), {"id": TOTALS_ID})
+    for name, body in TOTALS_TRIGGERS.items():
+        connection.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}"))
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Create tables. Schema changes run once at import through a short-lived
+# synchronous connection, before the async pool is used.
+migration_engine = create_engine(make_url(DATABASE_URL).set(drivername="sqlite"))
+with migration_engine.begin() as connection:
+    Base.metadata.create_all(bind=connection)
+    add_missing_columns(connection)
+    add_missing_indexes(connection)
+    create_totals_triggers(connection)
+migration_engine.dispose()
 
 # Dependency to get database session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
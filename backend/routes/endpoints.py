@@ -1,169 +1,495 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from pydantic import BaseModel
-from typing import List
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request, Query
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import List, Optional, Tuple, Dict
+from datetime import datetime
+import asyncio
 import os
-import tempfile
-from google import genai
+import json
+import time
+import base64
 from google.genai import types
-from backend.services.document_ingestion import process_pdf
 from backend.services.rag_pipeline import query_documents
-from backend.models.database import get_db, engine, Base
-from sqlalchemy.orm import Session
-from backend.schemas.document import Document, DocumentList, DocumentStats
-from sqlalchemy import func
-from backend.models.database import Document as DBDocument
-import fitz  # PyMuPDF
-import shutil
-from pathlib import Path
-
-# Configure Genai client
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+from backend.services.context_assembly import format_chunk, format_pages
+from backend.services.vector_store import claim_role
+from backend.services.workers import run_blocking
+from backend.services.ingestion_queue import enqueue, remove_document
+from backend.services.answer_cache import answer_cache
+from backend.services.container import services
+from backend.services import metrics
+from backend import config
+from backend.utils.pdf_text import count_pages
+from backend.models.database import get_db, TOTALS_ID
+from sqlalchemy.ext.asyncio import AsyncSession
+from backend.schemas.document import Document, DocumentList, DocumentStats, JobStatus
+from sqlalchemy import select, tuple_
+from backend.models.database import Document as DBDocument, IngestionJob, DocumentTotals
+import uuid
+import hashlib
 
 router = APIRouter()
 
 class QueryRequest(BaseModel):
     query: str
+    nprobe: Optional[int] = Field(None, ge=1, le=config.IVF_NLIST)  # IVF lists to probe, overrides IVF_NPROBE
+    ef_search: Optional[int] = Field(None, ge=1, le=config.HNSW_EF_SEARCH_MAX)  # HNSW search depth, overrides HNSW_EF_SEARCH
 
 class QueryResponse(BaseModel):
     answer: str
     sources: List[str]
 
+NO_CONTEXT_ANSWER = "I don't have enough context to answer your question from the available documents."
+
+GENERATION_CONFIG = types.GenerateContentConfig(
+    max_output_tokens=1000,
+    temperature=0.3
+)
+
+def build_prompt(query: str, results: List[Tuple[str, Dict]]) -> str:
+    """Format the retrieved chunks and the question into a Gemini prompt"""
+    # Format context for Gemini
+    context = "\n\n".join([format_chunk(text, meta) for text, meta in results])
+    
+    return f"""Based on the following context from the available PDF documents, please answer the question.
+If you cannot answer based on the provided context, please say so.
+
+Context:
+{context}
+
+Question: {query}
+
+Answer:"""
+
+def format_sources(results: List[Tuple[str, Dict]]) -> List[str]:
+    return [f"Document: {meta['document_id']}, {format_pages(meta)}" for _, meta in results]
+
+def sse_event(event: str, data: Dict) -> str:
+    """Encode one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class FileResult(BaseModel):
+    filename: str
+    status: str  # queued, duplicate or failed
+    document_id: Optional[str] = None  # the queued document, or the existing one for a duplicate
+    error: Optional[str] = None
+
 class UploadResponse(BaseModel):
     message: str
+    job_id: Optional[str] = None  # None when no file was queued
     documents: List[Document]
+    files: List[FileResult]  # one per uploaded file, in upload order
+
+def copy_upload(source, file_path: str) -> str:
+    """Copy an upload to file_path UPLOAD_BLOCK_SIZE bytes at a time and return its SHA-256"""
+    file_hash = hashlib.sha256()
+    with open(file_path, 'wb') as stored_file:
+        while True:
+            block = source.read(config.UPLOAD_BLOCK_SIZE)
+            if not block:
+                break
+            file_hash.update(block)
+            stored_file.write(block)
+    return file_hash.hexdigest()
 
-def validate_pdf_pages(file_path: str, max_pages: int = 1000) -> bool:
-    """Validate that PDF has no more than max_pages"""
+async def store_upload(file: UploadFile, file_path: str) -> str:
+    """Store an upload until the ingestion worker has indexed it, off the event loop"""
+    await file.seek(0)
+    return await run_in_threadpool(copy_upload, file.file, file_path)
+
+async def stage_upload(file: UploadFile) -> Dict:
+    """
+    Store one upload under a new document ID, hashing it on the way.
+    Returns a dict with the document id, filename, file_path and file_hash, or
+    with error set when the file was rejected
+    """
+    staged = {"id": str(uuid.uuid4()), "filename": file.filename}
+    if not file.filename.endswith('.pdf'):
+        staged["error"] = "Only PDF files are allowed"
+        return staged
+    
+    staged["file_path"] = os.path.join(config.UPLOAD_DIR, f"{staged['id']}.pdf")
     try:
-        doc = fitz.open(file_path)
-        page_count = len(doc)
-        doc.close()
-        return page_count <= max_pages
+        staged["file_hash"] = await store_upload(file, staged["file_path"])
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error validating PDF: {str(e)}")
+        staged["error"] = f"Error storing upload: {str(e)}"
+    return staged
 
-@router.post("/upload", response_model=UploadResponse)
+async def validate_upload(staged: Dict) -> None:
+    """
+    Read the page count of a stored upload on the parse pool, setting
+    page_count, or error if it cannot be opened or has too many pages.
+    The count is kept for ingestion, which does not open the file to count again.
+    """
+    try:
+        staged["page_count"] = await run_blocking("parse", count_pages, staged["file_path"])
+    except Exception as e:
+        staged["error"] = f"Error validating PDF: {str(e)}"
+        return
+    if staged["page_count"] > 1000:
+        staged["error"] = f"PDF file '{staged['filename']}' exceeds maximum page limit of 1000 pages"
+
+def remove_stored(staged: List[Dict]) -> None:
+    for upload in staged:
+        file_path = upload.get("file_path")
+        if file_path and os.path.exists(file_path):
+            os.unlink(file_path)
+
+@router.post("/upload", response_model=UploadResponse, status_code=202)
 async def upload_pdf(
     files: List[UploadFile] = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    """Upload and process multiple PDF files (up to 20)"""
+    """
+    Upload multiple PDF files (up to 20) and queue them for background ingestion.
+    Returns immediately with a job ID; progress is reported by GET /jobs/{job_id}.
+    Files are stored, hashed and validated concurrently, the PDFs opened on the
+    parse pool in parallel. Each file succeeds or fails on its own, and the
+    response reports the outcome of every file. Files identical to an already
+    uploaded PDF are not processed again; the existing document is returned instead.
+    """
     if len(files) > 20:
         raise HTTPException(status_code=400, detail="Maximum 20 PDF files allowed per upload")
     
-    if not all(file.filename.endswith('.pdf') for file in files):
-        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    os.makedirs(config.UPLOAD_DIR, exist_ok=True)
+    job = IngestionJob(id=str(uuid.uuid4()))
     
-    processed_documents = []
-    temp_files = []
+    # Stream every upload to disk in fixed-size blocks, hashing it on the way
+    staged = list(await asyncio.gather(*(stage_upload(file) for file in files)))
+    stored = [upload for upload in staged if "error" not in upload]
     
     try:
-        for file in files:
-            # Save uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-                content = await file.read()
-                temp_file.write(content)
-                temp_path = temp_file.name
-                temp_files.append(temp_path)
-            
-            # Validate page count before processing
-            if not validate_pdf_pages(temp_path):
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"PDF file '{file.filename}' exceeds maximum page limit of 1000 pages"
-                )
-            
-            # Process the PDF
-            result, document = await process_pdf(temp_path, file.filename, db)
-            processed_documents.append(Document.from_orm(document))
+        # Skip files that were already uploaded, unless their ingestion failed
+        # or they are being deleted, looking every hash up in one query
+        existing = {}
+        hashes = {upload["file_hash"] for upload in stored}
+        if hashes:
+            for document in (await db.scalars(select(DBDocument).where(
+                DBDocument.file_hash.in_(hashes),
+                DBDocument.status.notin_(("failed", "deleting"))
+            ))).all():
+                existing.setdefault(document.file_hash, document)
         
-        return UploadResponse(
-            message=f"Successfully processed {len(processed_documents)} PDF files",
-            documents=processed_documents
-        )
-    
-    except HTTPException as he:
-        # Clean up on validation error
-        for temp_path in temp_files:
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
-        raise he
+        # The first copy of each new file is validated; later copies share its outcome
+        first_copies = {}
+        for upload in stored:
+            if upload["file_hash"] in existing:
+                upload["duplicate_of"] = existing[upload["file_hash"]]
+            elif upload["file_hash"] in first_copies:
+                upload["copy_of"] = first_copies[upload["file_hash"]]
+            else:
+                first_copies[upload["file_hash"]] = upload
+        
+        # Validate page counts before queueing, in parallel
+        await asyncio.gather(*(validate_upload(upload) for upload in first_copies.values()))
+        
+        queued_documents = []
+        for upload in first_copies.values():
+            if "error" in upload:
+                continue
+            queued_documents.append(DBDocument(
+                id=upload["id"],
+                filename=upload["filename"],
+                total_pages=upload["page_count"],
+                total_chunks=0,
+                file_size=os.path.getsize(upload["file_path"]),
+                file_hash=upload["file_hash"],
+                status="queued",
+                job_id=job.id,
+                file_path=upload["file_path"]
+            ))
+        
+        if queued_documents:
+            db.add(job)
+            db.add_all(queued_documents)
+            await db.commit()
     
     except Exception as e:
-        # Clean up on processing error
-        for temp_path in temp_files:
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+        # Nothing was queued, remove the stored files
+        remove_stored(staged)
         raise HTTPException(status_code=500, detail=str(e))
     
-    finally:
-        # Clean up temporary files
-        for temp_path in temp_files:
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+    # Only the queued files are kept
+    queued_ids = {document.id for document in queued_documents}
+    remove_stored([upload for upload in staged if upload["id"] not in queued_ids])
+    enqueue([document.id for document in queued_documents], metrics.current_trace())
+    
+    results = []
+    for upload in staged:
+        original = upload.get("copy_of", upload)
+        if "duplicate_of" in upload:
+            results.append(FileResult(filename=upload["filename"], status="duplicate", document_id=upload["duplicate_of"].id))
+        elif "error" in original:
+            results.append(FileResult(filename=upload["filename"], status="failed", error=original["error"]))
+        elif original is not upload:
+            results.append(FileResult(filename=upload["filename"], status="duplicate", document_id=original["id"]))
+        else:
+            results.append(FileResult(filename=upload["filename"], status="queued", document_id=upload["id"]))
+    
+    failed = [result for result in results if result.status == "failed"]
+    if len(failed) == len(results):
+        raise HTTPException(status_code=400, detail="; ".join(f"{result.filename}: {result.error}" for result in failed))
+    
+    existing_documents = list({upload["duplicate_of"].id: upload["duplicate_of"] for upload in stored if "duplicate_of" in upload}.values())
+    duplicates = sum(result.status == "duplicate" for result in results)
+    
+    message = f"Queued {len(queued_documents)} PDF files for processing"
+    if duplicates:
+        message += f", {duplicates} already uploaded"
+    if failed:
+        message += f", {len(failed)} failed"
+    
+    return UploadResponse(
+        message=message,
+        job_id=job.id if queued_documents else None,
+        documents=[Document.from_orm(document) for document in queued_documents + existing_documents],
+        files=results
+    )
+
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(
+    job_id: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """Report the ingestion progress of an upload job"""
+    job = await db.get(IngestionJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    documents = (await db.scalars(select(DBDocument).where(DBDocument.job_id == job_id))).all()
+    statuses = {document.status for document in documents}
+    if statuses <= {"queued"}:
+        status = "queued"
+    elif statuses & {"queued", "processing"}:
+        status = "processing"
+    elif statuses == {"failed"}:
+        status = "failed"
+    else:
+        status = "completed"
+    
+    return JobStatus(
+        id=job.id,
+        created_at=job.created_at,
+        status=status,
+        total_pages=sum(document.total_pages for document in documents),
+        pages_processed=sum(document.pages_processed for document in documents),
+        chunks_embedded=sum(document.chunks_embedded for document in documents),
+        documents=documents
+    )
 
 @router.post("/query", response_model=QueryResponse)
 async def query(
     request: QueryRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Query across all documents"""
     try:
         # Get relevant documents from all available documents
-        results = await query_documents(request.query)
+        results, query_embedding = await query_documents(
+            request.query, nprobe=request.nprobe, ef_search=request.ef_search, return_embedding=True
+        )
         
         if not results:
-            return QueryResponse(
-                answer="I don't have enough context to answer your question from the available documents.",
-                sources=[]
-            )
+            return QueryResponse(answer=NO_CONTEXT_ANSWER, sources=[])
         
-        # Format context for Gemini
-        context = "\n\n".join([
-            f"[Document: {meta['document_id']}, Page {meta['page_number']}]\n{text}" 
-            for text, meta in results
-        ])
+        sources = format_sources(results)
+        chunk_ids = tuple(meta['chunk_id'] for _, meta in results)
+        
+        # Reuse an answer generated from the same chunks for the same or a similar question
+        if config.ANSWER_CACHE_ENABLED:
+            cached = answer_cache.lookup(request.query, query_embedding, chunk_ids)
+            if cached is not None:
+                answer, cached_sources = cached
+                return QueryResponse(answer=answer, sources=cached_sources)
         
         # Generate prompt
-        prompt = f"""Based on the following context from the available PDF documents, please answer the question.
-If you cannot answer based on the provided context, please say so.
-
-Context:
-{context}
-
-Question: {request.query}
-
-Answer:"""
+        with metrics.stage("prompt_build"):
+            prompt = build_prompt(request.query, results)
         
         try:
-            # Generate response using the models API
-            response = client.models.generate_content(
-                model="gemini-2.0-flash",
-                contents=[prompt],
-                config=types.GenerateContentConfig(
-                    max_output_tokens=1000,
-                    temperature=0.3
+            # Generate response using the async models API
+            with metrics.stage("llm"):
+                response = await services.genai_client.aio.models.generate_content(
+                    model="gemini-2.0-flash",
+                    contents=[prompt],
+                    config=GENERATION_CONFIG
+                )
+            
+            if config.ANSWER_CACHE_ENABLED:
+                answer_cache.store(
+                    request.query, query_embedding, chunk_ids,
+                    {meta['document_id'] for _, meta in results}, response.text, sources
                 )
-            )
             
             # Return response with sources
-            return QueryResponse(
-                answer=response.text,
-                sources=[f"Document: {meta['document_id']}, Page {meta['page_number']}" for _, meta in results]
-            )
+            return QueryResponse(answer=response.text, sources=sources)
         except Exception as e:
+            metrics.LLM_ERRORS.inc()
             raise HTTPException(status_code=500, detail=str(e))
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/query/stream")
+async def query_stream(
+    request: QueryRequest,
+    http_request: Request
+):
+    """
+    Query across all documents, streaming the answer as server-sent events:
+    a `sources` event once retrieval is done, `token` events as the answer is
+    generated, then `done` (or `error`). Generation stops when the client disconnects.
+    """
+    try:
+        results, query_embedding = await query_documents(
+            request.query, nprobe=request.nprobe, ef_search=request.ef_search, return_embedding=True
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    sources = format_sources(results)
+    chunk_ids = tuple(meta['chunk_id'] for _, meta in results)
+    
+    async def events():
+        yield sse_event("sources", {"sources": sources})
+        
+        if not results:
+            yield sse_event("token", {"text": NO_CONTEXT_ANSWER})
+            yield sse_event("done", {})
+            return
+        
+        if config.ANSWER_CACHE_ENABLED:
+            cached = answer_cache.lookup(request.query, query_embedding, chunk_ids)
+            if cached is not None:
+                yield sse_event("token", {"text": cached[0]})
+                yield sse_event("done", {})
+                return
+        
+        with metrics.stage("prompt_build"):
+            prompt = build_prompt(request.query, results)
+        
+        stream = None
+        parts = []
+        start = time.perf_counter()
+        try:
+            stream = await services.genai_client.aio.models.generate_content_stream(
+                model="gemini-2.0-flash",
+                contents=[prompt],
+                config=GENERATION_CONFIG
+            )
+            async for chunk in stream:
+                if await http_request.is_disconnected():
+                    # Abandoned by the client, stop generating
+                    return
+                if chunk.text:
+                    if not parts:
+                        metrics.observe_stage("llm_first_token", time.perf_counter() - start, start)
+                    parts.append(chunk.text)
+                    yield sse_event("token", {"text": chunk.text})
+            metrics.observe_stage("llm", time.perf_counter() - start, start)
+        except Exception as e:
+            metrics.LLM_ERRORS.inc()
+            yield sse_event("error", {"detail": str(e)})
+            return
+        finally:
+            # Close the upstream stream on completion, error, disconnect or cancellation
+            if stream is not None and hasattr(stream, "aclose"):
+                await stream.aclose()
+        
+        if config.ANSWER_CACHE_ENABLED:
+            answer_cache.store(
+                request.query, query_embedding, chunk_ids,
+                {meta['document_id'] for _, meta in results}, "".join(parts), sources
+            )
+        yield sse_event("done", {})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """Hit-rate and size metrics of the answer cache"""
+    return answer_cache.stats()
+
+@router.get("/traces")
+async def recent_traces(
+    limit: int = Query(20, ge=1, le=1000),
+    name: Optional[str] = Query(None, description="Only traces of this kind, e.g. ingest or POST /api/query")
+):
+    """The most recent sampled traces of this process, newest first, with a span per stage"""
+    return metrics.traces(limit, name)
+
+def encode_cursor(document: DBDocument) -> str:
+    """Opaque cursor pointing just after document in upload order"""
+    key = json.dumps([document.upload_date.isoformat(), document.id])
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        upload_date, document_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(upload_date), document_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/documents", response_model=DocumentList)
 async def list_documents(
-    skip: int = 0,
-    limit: int = 10,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=1000),
+    skip: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db)
 ):
-    """List all processed documents with pagination"""
-    total = db.query(DBDocument).count()
-    documents = db.query(DBDocument).offset(skip).limit(limit).all()
-    return DocumentList(total=total, documents=documents)
\ No newline at end of file
+    """
+    List documents in upload order with keyset pagination: pass the returned
+    next_cursor as cursor to get the next page. Each page seeks straight to its
+    first document through an index, however deep it is. skip is still accepted
+    for offset paging, which reads every skipped row.
+    """
+    statement = select(DBDocument).order_by(DBDocument.upload_date, DBDocument.id)
+    if cursor is not None:
+        statement = statement.where(tuple_(DBDocument.upload_date, DBDocument.id) > tuple_(*decode_cursor(cursor)))
+    elif skip:
+        statement = statement.offset(skip)
+    
+    # Fetch one extra row to learn whether another page follows
+    documents = (await db.scalars(statement.limit(limit + 1))).all()
+    next_cursor = encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+    
+    totals = await db.get(DocumentTotals, TOTALS_ID)
+    return DocumentList(total=totals.total_documents, documents=documents[:limit], next_cursor=next_cursor)
+
+@router.get("/documents/stats", response_model=DocumentStats)
+async def document_stats(
+    db: AsyncSession = Depends(get_db)
+):
+    """Document, page and chunk counts and total upload size, read from maintained totals"""
+    totals = await db.get(DocumentTotals, TOTALS_ID)
+    return DocumentStats(
+        total_documents=totals.total_documents,
+        total_pages=totals.total_pages,
+        total_chunks=totals.total_chunks,
+        total_size=totals.total_size
+    )
+
+@router.delete("/documents/{document_id}", status_code=204)
+async def delete_document(
+    document_id: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """Delete a document, its stored upload and its indexed chunks"""
+    db_document = await db.get(DBDocument, document_id)
+    if db_document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if db_document.status == "processing":
+        raise HTTPException(status_code=409, detail="Document is being ingested, retry once it has finished")
+    
+    if claim_role() == "reader":
+        # Only the writer process changes the index; it applies the deletion
+        # within INGEST_POLL_INTERVAL_MS
+        db_document.status = "deleting"
+        await db.commit()
+        return
+    
+    await remove_document(db, db_document)
@@ -15,6 +15,11 @@ class DocumentCreate(DocumentBase):
 class Document(DocumentBase):
     id: str
     upload_date: datetime
+    job_id: Optional[str] = None
+    file_hash: Optional[str] = None
+    pages_processed: int = 0
+    chunks_embedded: int = 0
+    error: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -22,9 +27,19 @@ class Document(DocumentBase):
 class DocumentList(BaseModel):
     total: int
     documents: List[Document]
+    next_cursor: Optional[str] = None  # pass as cursor to fetch the next page; None on the last page
 
 class DocumentStats(BaseModel):
     total_documents: int
     total_pages: int
     total_chunks: int
-    total_size: int  # in bytes
\ No newline at end of file
+    total_size: int  # in bytes
+
+class JobStatus(BaseModel):
+    id: str
+    created_at: datetime
+    status: str  # queued, processing, completed, failed
+    total_pages: int
+    pages_processed: int
+    chunks_embedded: int
+    documents: List[Document]
@@ -0,0 +1,141 @@
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from backend import config
+
+@dataclass
+class CacheEntry:
+    key: str
+    embedding: np.ndarray
+    chunk_ids: Tuple[str, ...]
+    document_ids: Set[str]
+    answer: str
+    sources: List[str]
+    created_at: float
+    size: int
+
+def normalize_query(query: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation"""
+    return re.sub(r'\s+', ' ', query).strip().rstrip('?.! ').lower()
+
+class AnswerCache:
+    """
+    Two-level cache of generated answers.
+
+    Level 1 matches the normalized query text exactly. Level 2 matches a new
+    query whose embedding has cosine similarity of at least `threshold` with a
+    cached query. Both levels only hit when retrieval returned exactly the same
+    chunks as when the answer was cached, so answers never outlive a change in
+    the context they were generated from. Entries are evicted least recently
+    used first, after `ttl_seconds`, or when the cache grows past `max_entries`
+    or `max_bytes`.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float, threshold: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.by_chunks: Dict[Tuple[str, ...], Set[str]] = {}
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def lookup(self, query: str, embedding: np.ndarray, chunk_ids: Tuple[str, ...]) -> Optional[Tuple[str, List[str]]]:
+        """Return the cached (answer, sources) for the query and retrieved chunks, if any"""
+        key = normalize_query(query)
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._fresh(entry, now) and entry.chunk_ids == chunk_ids:
+                self.entries.move_to_end(key)
+                self.counters["exact_hits"] += 1
+                return entry.answer, entry.sources
+
+            # Only entries built from the same chunks are candidates for a semantic hit
+            best, best_score = None, self.threshold
+            for candidate_key in self.by_chunks.get(chunk_ids, ()):
+                candidate = self.entries[candidate_key]
+                if not self._fresh(candidate, now):
+                    continue
+                score = float(np.dot(candidate.embedding, embedding))
+                if score >= best_score:
+                    best, best_score = candidate, score
+
+            if best is not None:
+                self.entries.move_to_end(best.key)
+                self.counters["semantic_hits"] += 1
+                return best.answer, best.sources
+
+            self.counters["misses"] += 1
+            return None
+
+    def store(self, query: str, embedding: np.ndarray, chunk_ids: Tuple[str, ...], document_ids: Set[str], answer: str, sources: List[str]) -> None:
+        key = normalize_query(query)
+        size = (
+            embedding.nbytes + sys.getsizeof(key) + sys.getsizeof(answer)
+            + sum(sys.getsizeof(source) for source in sources) + 64 * len(chunk_ids) + 256
+        )
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = CacheEntry(key, embedding, chunk_ids, set(document_ids), answer, sources, time.monotonic(), size)
+            self.by_chunks.setdefault(chunk_ids, set()).add(key)
+            self.size += size
+
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+                self.counters["evictions"] += 1
+
+    def invalidate_documents(self, document_ids: Set[str]) -> None:
+        """Drop every answer generated from chunks of the given documents"""
+        with self.lock:
+            stale = [key for key, entry in self.entries.items() if entry.document_ids & document_ids]
+            for key in stale:
+                self._remove(key)
+            self.counters["invalidations"] += len(stale)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.by_chunks.clear()
+            self.size = 0
+
+    def stats(self) -> Dict:
+        with self.lock:
+            hits = self.counters["exact_hits"] + self.counters["semantic_hits"]
+            lookups = hits + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.size,
+            }
+
+    def _fresh(self, entry: CacheEntry, now: float) -> bool:
+        return now - entry.created_at <= self.ttl_seconds
+
+    def _remove(self, key: str) -> None:
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+        keys = self.by_chunks.get(entry.chunk_ids)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_chunks[entry.chunk_ids]
+
+# Shared cache for the /query endpoint
+answer_cache = AnswerCache(
+    max_entries=config.ANSWER_CACHE_MAX_ENTRIES,
+    max_bytes=config.ANSWER_CACHE_MAX_MB * 1024 * 1024,
+    ttl_seconds=config.ANSWER_CACHE_TTL_SECONDS,
+    threshold=config.ANSWER_CACHE_SIMILARITY
+)
@@ -0,0 +1,289 @@
+import os
+import mmap
+import threading
+import uuid
+from array import array
+from typing import List, Dict, Tuple
+import numpy as np
+
+# Files making up a chunk store directory
+TEXT_FILE = "text.bin"          # UTF-8 chunk texts, concatenated
+OFFSETS_FILE = "offsets.bin"    # int64 end offset of each chunk in text.bin
+PAGES_FILE = "pages.bin"        # int32 page number of each chunk
+DOCS_FILE = "docs.bin"          # int32 index of each chunk's document in DOC_IDS_FILE
+DOC_IDS_FILE = "doc_ids.txt"    # interned document IDs, one per line
+IDS_FILE = "ids.bin"            # 16-byte UUID of each chunk, stable across compactions
+SPANS_FILE = "spans.bin"        # int32 start offset, end page and end offset of each chunk in its pages' text
+
+# Values in SPANS_FILE per chunk
+SPAN_FIELDS = 3
+
+class ChunkStore:
+    """
+    Append-only on-disk store for chunk texts and their metadata.
+
+    Texts live in a single blob that is memory-mapped, so only the chunks a
+    search returns are ever read into Python strings. Metadata is held in
+    compact columnar arrays (page number, interned document index, chunk UUID
+    and the chunk's character span in its pages), using 44 bytes per chunk
+    instead of a dict.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets = array('q')
+        self.pages = array('i')
+        self.docs = array('i')
+        self.ids = bytearray()
+        self.spans = array('i')
+        self.doc_ids: List[str] = []
+        self.doc_index: Dict[str, int] = {}
+        self._mm = None
+        self._mapped_size = 0
+        self._map_lock = threading.Lock()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def open(self, count: int = None) -> None:
+        """
+        Load the columns and map the text blob.
+        Args:
+            count: Number of committed chunks. Anything written past it, e.g. by
+                an append interrupted by a crash, is truncated away.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        for name in (TEXT_FILE, OFFSETS_FILE, PAGES_FILE, DOCS_FILE, DOC_IDS_FILE, IDS_FILE, SPANS_FILE):
+            open(self._file(name), 'ab').close()
+
+        if count is None:
+            count = os.path.getsize(self._file(OFFSETS_FILE)) // self.offsets.itemsize
+
+        for column, name in ((self.offsets, OFFSETS_FILE), (self.pages, PAGES_FILE), (self.docs, DOCS_FILE)):
+            del column[:]
+            with open(self._file(name), 'rb') as f:
+                column.fromfile(f, count)
+            os.truncate(self._file(name), count * column.itemsize)
+        os.truncate(self._file(TEXT_FILE), self.offsets[-1] if count else 0)
+
+        with open(self._file(IDS_FILE), 'rb') as f:
+            self.ids = bytearray(f.read(count * 16))
+        if len(self.ids) < count * 16:
+            # Stores written before chunk IDs were kept get fresh ones
+            missing = b''.join(uuid.uuid4().bytes for _ in range(count - len(self.ids) // 16))
+            with open(self._file(IDS_FILE), 'ab') as f:
+                f.write(missing)
+            self.ids.extend(missing)
+        os.truncate(self._file(IDS_FILE), count * 16)
+
+        self.spans = array('i')
+        with open(self._file(SPANS_FILE), 'rb') as f:
+            self.spans.frombytes(f.read(count * SPAN_FIELDS * self.spans.itemsize))
+        known = len(self.spans) // SPAN_FIELDS
+        if known < count:
+            # Chunks stored before spans were kept end on their first page, at
+            # unknown offsets (-1)
+            missing = array('i')
+            for i in range(known, count):
+                missing.extend((-1, self.pages[i], -1))
+            del self.spans[known * SPAN_FIELDS:]
+            with open(self._file(SPANS_FILE), 'r+b') as f:
+                f.truncate(known * SPAN_FIELDS * self.spans.itemsize)
+                f.seek(0, os.SEEK_END)
+                missing.tofile(f)
+            self.spans.extend(missing)
+        os.truncate(self._file(SPANS_FILE), count * SPAN_FIELDS * self.spans.itemsize)
+
+        with open(self._file(DOC_IDS_FILE), 'r') as f:
+            self.doc_ids = f.read().splitlines()
+        self.doc_index = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+
+        self._remap()
+
+    def follow(self, count: int) -> None:
+        """
+        Load the chunks another process has appended, up to count, its committed
+        chunk count. Unlike open, files are never created or truncated: they
+        belong to the writer.
+        """
+        start = len(self.offsets)
+        if count <= start:
+            return
+
+        new_columns = []
+        for column, name in ((self.offsets, OFFSETS_FILE), (self.pages, PAGES_FILE), (self.docs, DOCS_FILE)):
+            new = array(column.typecode)
+            with open(self._file(name), 'rb') as f:
+                f.seek(start * column.itemsize)
+                new.fromfile(f, count - start)
+            new_columns.append((column, new))
+        with open(self._file(IDS_FILE), 'rb') as f:
+            f.seek(start * 16)
+            new_ids = f.read((count - start) * 16)
+        new_spans = array('i')
+        with open(self._file(SPANS_FILE), 'rb') as f:
+            f.seek(start * SPAN_FIELDS * new_spans.itemsize)
+            new_spans.fromfile(f, (count - start) * SPAN_FIELDS)
+        if max(new_columns[2][1]) >= len(self.doc_ids):
+            with open(self._file(DOC_IDS_FILE), 'r') as f:
+                doc_ids = f.read().splitlines()
+            self.doc_index = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+            self.doc_ids = doc_ids
+
+        for column, new in new_columns:
+            column.extend(new)
+        self.ids.extend(new_ids)
+        self.spans.extend(new_spans)
+        self._remap()
+
+    def close(self) -> None:
+        with self._map_lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+                self._mapped_size = 0
+
+    def _remap(self) -> None:
+        """Map the text blob again after it has grown past the current mapping"""
+        with self._map_lock:
+            size = os.path.getsize(self._file(TEXT_FILE))
+            if size == self._mapped_size:
+                return
+            # The previous mapping is not closed here: readers on other threads may
+            # still hold it, and it is released once the last reference goes away
+            if size:
+                with open(self._file(TEXT_FILE), 'rb') as f:
+                    self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._mm = None
+            self._mapped_size = size
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def _intern(self, doc_id: str, new_ids: List[str]) -> int:
+        if doc_id not in self.doc_index:
+            self.doc_index[doc_id] = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+            new_ids.append(doc_id)
+        return self.doc_index[doc_id]
+
+    def append(self, texts: List[str], metadatas: List[Dict], ids: List[str] = None) -> None:
+        """
+        Append chunks and their metadata, flushing every file to disk.
+        ids are the chunks' UUID strings; new UUIDs are generated when omitted.
+        """
+        blobs = [text.encode('utf-8') for text in texts]
+        end = self.offsets[-1] if len(self.offsets) else 0
+        new_ids: List[str] = []
+
+        offsets = array('q')
+        for blob in blobs:
+            end += len(blob)
+            offsets.append(end)
+        pages = array('i', (meta.get('page_number', 0) for meta in metadatas))
+        docs = array('i', (self._intern(meta.get('document_id'), new_ids) for meta in metadatas))
+        spans = array('i')
+        for meta, page in zip(metadatas, pages):
+            spans.extend((meta.get('start_char', -1), meta.get('end_page', page), meta.get('end_char', -1)))
+        if ids is None:
+            id_bytes = b''.join(uuid.uuid4().bytes for _ in texts)
+        else:
+            id_bytes = b''.join(uuid.UUID(chunk_id).bytes for chunk_id in ids)
+
+        with open(self._file(DOC_IDS_FILE), 'a') as f:
+            f.writelines(doc_id + '\n' for doc_id in new_ids)
+            os.fsync(f.fileno())
+        with open(self._file(TEXT_FILE), 'ab') as f:
+            f.write(b''.join(blobs))
+            os.fsync(f.fileno())
+        for column, new, name in ((self.offsets, offsets, OFFSETS_FILE), (self.pages, pages, PAGES_FILE), (self.docs, docs, DOCS_FILE)):
+            with open(self._file(name), 'ab') as f:
+                new.tofile(f)
+                os.fsync(f.fileno())
+            column.extend(new)
+        with open(self._file(IDS_FILE), 'ab') as f:
+            f.write(id_bytes)
+            os.fsync(f.fileno())
+        self.ids.extend(id_bytes)
+        with open(self._file(SPANS_FILE), 'ab') as f:
+            spans.tofile(f)
+            os.fsync(f.fileno())
+        self.spans.extend(spans)
+        # Map the new texts before any search can return them: a search holding
+        # this store may read them after a compaction has removed its files
+        self._remap()
+
+    def text(self, i: int) -> str:
+        start = self.offsets[i - 1] if i else 0
+        end = self.offsets[i]
+        if end > self._mapped_size:
+            self._remap()
+        mm = self._mm
+        return mm[start:end].decode('utf-8')
+
+    def chunk_id(self, i: int) -> str:
+        return str(uuid.UUID(bytes=bytes(self.ids[i * 16:(i + 1) * 16])))
+
+    def end_page(self, i: int) -> int:
+        return self.spans[i * SPAN_FIELDS + 1]
+
+    def metadata(self, i: int) -> Dict:
+        start_char, end_page, end_char = self.spans[i * SPAN_FIELDS:(i + 1) * SPAN_FIELDS]
+        return {
+            "page_number": self.pages[i],
+            "document_id": self.doc_ids[self.docs[i]],
+            "chunk_id": self.chunk_id(i),
+            "start_char": start_char,
+            "end_page": end_page,
+            "end_char": end_char,
+        }
+
+    def get(self, i: int) -> Tuple[str, Dict]:
+        return self.text(i), self.metadata(i)
+
+    def document_runs(self) -> List[Tuple[str, int, int]]:
+        """Return (document_id, start, end) for every contiguous run of chunks"""
+        if not len(self.docs):
+            return []
+        docs = np.frombuffer(self.docs, dtype=np.int32)
+        starts = np.concatenate(([0], np.flatnonzero(docs[1:] != docs[:-1]) + 1))
+        ends = np.append(starts[1:], len(docs))
+        return [(self.doc_ids[docs[start]], int(start), int(end)) for start, end in zip(starts, ends)]
+
+    def copy_to(self, path: str, keep: np.ndarray) -> "ChunkStore":
+        """
+        Write the chunks selected by the boolean mask keep to a new store at path,
+        in their current order, and return it opened
+        """
+        kept = np.flatnonzero(keep)
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)
+        starts = np.concatenate(([0], offsets[:-1]))[kept]
+        ends = offsets[kept]
+        self._remap()
+
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, TEXT_FILE), 'wb') as f:
+            for start, end in zip(starts, ends):
+                if end > start:
+                    f.write(self._mm[start:end])
+            os.fsync(f.fileno())
+
+        columns = (
+            (np.cumsum(ends - starts, dtype=np.int64), OFFSETS_FILE),
+            (np.frombuffer(self.pages, dtype=np.int32)[kept], PAGES_FILE),
+            (np.frombuffer(self.docs, dtype=np.int32)[kept], DOCS_FILE),
+            (np.frombuffer(self.ids, dtype=np.uint8).reshape(-1, 16)[kept], IDS_FILE),
+            (np.frombuffer(self.spans, dtype=np.int32).reshape(-1, SPAN_FIELDS)[kept], SPANS_FILE),
+        )
+        for column, name in columns:
+            with open(os.path.join(path, name), 'wb') as f:
+                f.write(column.tobytes())
+                os.fsync(f.fileno())
+        with open(os.path.join(path, DOC_IDS_FILE), 'w') as f:
+            f.writelines(doc_id + '\n' for doc_id in self.doc_ids)
+            os.fsync(f.fileno())
+
+        store = ChunkStore(path)
+        store.open(len(kept))
+        return store
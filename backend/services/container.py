@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from typing import Dict
+from backend import config
+from . import vector_store, context_assembly
+from .workers import run_blocking
+
+class ServiceContainer:
+    """
+    The app's shared, expensive resources: the Gemini client and the vector
+    store (embedding model and index).
+
+    Nothing is created on import. Each resource is created on first use, and
+    warm_up creates them all ahead of the first request from the lifespan
+    hook, recording how long each step took. Readiness is reported by status
+    so traffic is only routed to a worker once it is warm.
+    """
+
+    def __init__(self):
+        self.state = "cold"  # cold, warming, ready or failed
+        self.error = None
+        self.timings: Dict[str, float] = {}
+        self._genai_client = None
+        self._lock = threading.Lock()
+
+    @property
+    def genai_client(self):
+        """Gemini client shared by every route and pipeline"""
+        if self._genai_client is None:
+            with self._lock:
+                if self._genai_client is None:
+                    start = time.perf_counter()
+                    from google import genai
+                    self._genai_client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+                    self.timings["genai_client"] = time.perf_counter() - start
+        return self._genai_client
+
+    def use_genai_client(self, client) -> None:
+        """Answer with client instead of Gemini, e.g. a local stand-in for benchmarks"""
+        with self._lock:
+            self._genai_client = client
+
+    def _warm_vector_store(self) -> None:
+        vector_store.initialize(self.timings)
+
+        # The first inference allocates buffers and is much slower than the rest
+        start = time.perf_counter()
+        vector_store.embed_texts(["warm up"])
+        self.timings["embedding_warm_up"] = time.perf_counter() - start
+
+        if config.CONTEXT_RERANKER == "cross_encoder":
+            start = time.perf_counter()
+            context_assembly.get_cross_encoder()
+            self.timings["cross_encoder"] = time.perf_counter() - start
+
+    async def warm_up(self) -> None:
+        """Create every resource now rather than on the first request"""
+        self.state = "warming"
+        start = time.perf_counter()
+        try:
+            self.genai_client
+            await run_blocking("embed", self._warm_vector_store)
+            self.state = "ready"
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+        self.timings["total"] = time.perf_counter() - start
+
+    def status(self) -> Dict:
+        return {
+            "status": self.state,
+            "role": vector_store.claim_role(),
+            "error": self.error,
+            "startup_seconds": {step: round(seconds, 3) for step, seconds in self.timings.items()},
+        }
+
+# Shared by the whole app
+services = ServiceContainer()
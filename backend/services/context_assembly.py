@@ -0,0 +1,140 @@
+import math
+import threading
+from typing import List, Tuple, Dict, Set, Optional
+import numpy as np
+from backend import config
+from . import metrics
+from .workers import run_blocking
+
+CONTEXT_RERANKERS = ("mmr", "cross_encoder", "none")
+
+# Cross-encoder scoring (query, chunk) pairs, loaded on first use
+cross_encoder = None
+cross_encoder_lock = threading.Lock()
+
+def format_pages(meta: Dict) -> str:
+    """The pages a chunk covers, e.g. "Page 3", or "Pages 3-7" for a chunk running over page breaks"""
+    end_page = meta.get('end_page') or meta['page_number']
+    if end_page != meta['page_number']:
+        return f"Pages {meta['page_number']}-{end_page}"
+    return f"Page {meta['page_number']}"
+
+def format_chunk(text: str, meta: Dict) -> str:
+    """A chunk as it appears in the prompt context"""
+    return f"[Document: {meta['document_id']}, {format_pages(meta)}]\n{text}"
+
+def estimate_tokens(text: str) -> int:
+    """Approximate LLM token count, at CONTEXT_CHARS_PER_TOKEN characters per token"""
+    return math.ceil(len(text) / config.CONTEXT_CHARS_PER_TOKEN)
+
+def shingles(text: str) -> Set[Tuple[str, ...]]:
+    """Word 3-grams of a text, lowercased"""
+    words = text.lower().split()
+    if len(words) < 3:
+        return {tuple(words)}
+    return {tuple(words[i:i + 3]) for i in range(len(words) - 2)}
+
+def is_duplicate(candidate: Set, chosen: List[Set]) -> bool:
+    """
+    Whether a chunk overlaps a chosen one by at least CONTEXT_DEDUP_OVERLAP of
+    the smaller chunk's 3-grams, e.g. a re-upload or the overlapping tail of a
+    neighbouring chunk
+    """
+    for other in chosen:
+        smaller = min(len(candidate), len(other))
+        if smaller and len(candidate & other) / smaller >= config.CONTEXT_DEDUP_OVERLAP:
+            return True
+    return False
+
+def get_cross_encoder():
+    global cross_encoder
+    if cross_encoder is None:
+        with cross_encoder_lock:
+            if cross_encoder is None:
+                from sentence_transformers import CrossEncoder
+                cross_encoder = CrossEncoder(config.CROSS_ENCODER_MODEL, device="cpu")
+    return cross_encoder
+
+def mmr_order(query_embedding: np.ndarray, embeddings: np.ndarray) -> List[int]:
+    """
+    Order candidates by maximal marginal relevance: each pick maximizes
+    lambda * similarity to the query - (1 - lambda) * its highest similarity
+    to a chunk already picked, so near-identical chunks sink to the end
+    """
+    relevance = embeddings @ query_embedding
+    similarity = embeddings @ embeddings.T
+    redundancy = np.full(len(embeddings), -np.inf)
+    remaining = np.ones(len(embeddings), dtype=bool)
+
+    order = []
+    for _ in range(len(embeddings)):
+        penalty = np.where(np.isinf(redundancy), 0.0, redundancy)
+        scores = config.CONTEXT_MMR_LAMBDA * relevance - (1 - config.CONTEXT_MMR_LAMBDA) * penalty
+        scores[~remaining] = -np.inf
+        best = int(np.argmax(scores))
+        order.append(best)
+        remaining[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return order
+
+def rerank(query: str, query_embedding: np.ndarray, texts: List[str], vectors: np.ndarray) -> List[int]:
+    """Return candidate indexes ordered by the configured CONTEXT_RERANKER"""
+    if config.CONTEXT_RERANKER == "cross_encoder":
+        scores = get_cross_encoder().predict([(query, text) for text in texts])
+        return np.argsort(-np.asarray(scores), kind='stable').tolist()
+    if config.CONTEXT_RERANKER == "mmr":
+        return mmr_order(query_embedding, vectors)
+    if config.CONTEXT_RERANKER == "none":
+        return list(range(len(texts)))
+    raise ValueError(f"Unknown context reranker '{config.CONTEXT_RERANKER}', expected one of {', '.join(CONTEXT_RERANKERS)}")
+
+def assemble_context_sync(query: str, query_embedding: np.ndarray, candidates: List[Tuple[str, Dict]], vectors: np.ndarray, max_chunks: int = None) -> List[Tuple[str, Dict]]:
+    """
+    Blocking implementation of assemble_context. Chunks are taken in re-ranked
+    order, skipping duplicates of chunks already taken and chunks too long for
+    the tokens left, until CONTEXT_TOKEN_BUDGET or max_chunks is reached.
+    """
+    if not candidates:
+        return []
+    max_chunks = max_chunks or config.CONTEXT_MAX_CHUNKS
+    budget = config.CONTEXT_TOKEN_BUDGET
+
+    order = rerank(query, query_embedding, [text for text, _ in candidates], vectors)
+    chosen = []
+    chosen_shingles = []
+    used = 0
+    for i in order:
+        text, meta = candidates[i]
+        tokens = estimate_tokens(format_chunk(text, meta))
+        if used + tokens > budget:
+            continue
+        candidate_shingles = shingles(text)
+        if is_duplicate(candidate_shingles, chosen_shingles):
+            continue
+
+        chosen.append((text, meta))
+        chosen_shingles.append(candidate_shingles)
+        used += tokens
+        if len(chosen) >= max_chunks:
+            break
+
+    # A single chunk longer than the whole budget is cut to fit rather than dropped
+    if not chosen:
+        text, meta = candidates[order[0]]
+        header_tokens = estimate_tokens(format_chunk("", meta))
+        chosen.append((text[:int(max(budget - header_tokens, 0) * config.CONTEXT_CHARS_PER_TOKEN)], meta))
+
+    return chosen
+
+async def assemble_context(query: str, query_embedding: np.ndarray, candidates: List[Tuple[str, Dict]], vectors: np.ndarray, max_chunks: Optional[int] = None) -> List[Tuple[str, Dict]]:
+    """
+    Choose the retrieved chunks that go into the prompt, run on the query pool.
+    Args:
+        query: The question
+        query_embedding: Its normalized embedding
+        candidates: Retrieved (text, metadata) tuples, best first
+        vectors: The stored vector of each candidate, for MMR
+        max_chunks: Optional limit on the number of chunks, CONTEXT_MAX_CHUNKS by default
+    Returns the chosen (text, metadata) tuples, most relevant first
+    """
+    return await run_blocking("query", metrics.timed("context_assembly", assemble_context_sync), query, query_embedding, candidates, vectors, max_chunks)
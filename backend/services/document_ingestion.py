@@ -1,110 +1,153 @@
-import fitz
+import asyncio
 import uuid
-import os
-from typing import List, Dict, Tuple
-from .vector_store import add_documents
-from sqlalchemy.orm import Session
+from collections import deque
+from typing import List, Dict, Tuple, AsyncIterator
+from backend import config
+from . import vector_store
+from . import metrics
+from .vector_store import add_documents, indexed_progress, ensure_ready
+from .workers import run_blocking
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..models.database import Document as DBDocument
+from ..utils.pdf_text import extract_page_range_timed
+from ..utils.chunker import Chunker, Chunk
 
-def chunk_text(text: str, max_chunk_size: int = 500) -> List[str]:
-    """Split text into chunks of approximately max_chunk_size characters"""
-    # Split into sentences
-    sentences = text.replace('\n', ' ').split('.')
-    sentences = [s.strip() + '.' for s in sentences if s.strip()]
-    
-    chunks = []
-    current_chunk = []
-    current_size = 0
-    
-    for sentence in sentences:
-        sentence_size = len(sentence.split())
-        if current_size + sentence_size > max_chunk_size:
-            if current_chunk:  # Only append if there's content
-                chunks.append(' '.join(current_chunk))
-            current_chunk = [sentence]
-            current_size = sentence_size
-        else:
-            current_chunk.append(sentence)
-            current_size += sentence_size
+def create_chunker() -> Chunker:
+    """
+    A chunker counting the embedding model's tokens, with chunks of at most
+    CHUNK_MAX_TOKENS that also leave room for the special tokens the model adds
+    """
+    embedder = vector_store.embedder
+    special_tokens = embedder.tokenizer.num_special_tokens_to_add(False) if embedder.tokenizer is not None else 2
+    max_tokens = min(config.CHUNK_MAX_TOKENS, embedder.max_seq_length - special_tokens)
+    return Chunker(embedder.tokenizer, max(max_tokens, 1), config.CHUNK_OVERLAP_TOKENS)
+
+async def iter_page_batches(file_path: str, first_page: int, page_count: int) -> AsyncIterator[List[Tuple[int, str]]]:
+    """
+    Yield the page texts of a PDF INGEST_BATCH_PAGES pages at a time, starting
+    at the 0-based first_page. Up to INGEST_PARSE_AHEAD batches are parsed in
+    parallel on the parse pool while the caller processes the current one, so
+    a large PDF is parsed on several cores; batches are yielded in page order.
+    """
+    starts = iter(range(first_page, page_count, config.INGEST_BATCH_PAGES))
+    pending = deque()
     
-    # Add the last chunk if it exists
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
+    def parse_next() -> None:
+        start = next(starts, None)
+        if start is not None:
+            pending.append(asyncio.ensure_future(run_blocking("parse", extract_page_range_timed, file_path, start, start + config.INGEST_BATCH_PAGES)))
     
-    return chunks
+    try:
+        for _ in range(max(config.INGEST_PARSE_AHEAD, 1)):
+            parse_next()
+        while pending:
+            page_texts, seconds = await pending.popleft()
+            # Timed in the parse worker, so time spent queued for it is left out
+            metrics.observe_stage("pdf_extract", seconds)
+            
+            # Keep the parse pool busy with the following batches
+            parse_next()
+            
+            yield page_texts
+    finally:
+        for future in pending:
+            future.cancel()
 
-async def process_pdf(file_path: str, original_filename: str, db: Session) -> Tuple[str, DBDocument]:
+async def process_pdf(db_document: DBDocument, db: AsyncSession) -> DBDocument:
     """
-    Process a PDF file:
-    1. Extract text from PDF
-    2. Split into chunks
-    3. Add to vector store
-    4. Store metadata in database
+    Ingest a queued PDF document, streaming it so memory is bounded by the batch sizes:
+    1. Extract text INGEST_BATCH_PAGES pages at a time
+    2. Split pages into chunks sized in model tokens, which may run over page
+       breaks, until INGEST_BATCH_CHUNKS are collected
+    3. Add each chunk batch to the vector store, where it is searchable at once
+    4. Record progress (pages parsed, chunks embedded) in the database
+    Pages already in the vector store from an interrupted run are skipped.
+    If ingestion fails, the chunks committed so far are removed from the vector
+    store, as a failed document is never resumed.
+    The page count was read when the upload was validated, so the PDF is not
+    opened again just to count its pages.
     """
-    # Generate unique ID for the document
-    doc_id = str(uuid.uuid4())
+    doc_id = db_document.id
     
-    try:
-        # Open the PDF
-        doc = fitz.open(file_path)
+    async def flush(batch_chunks: List[str], batch_metadatas: List[Dict], last_page: int) -> None:
+        # Add to vector store
+        if batch_chunks:
+            await add_documents(batch_chunks, batch_metadatas, [str(uuid.uuid4()) for _ in batch_chunks])
         
-        all_chunks = []
-        all_metadatas = []
-        all_ids = []
+        # Record progress
+        db_document.pages_processed = last_page
+        db_document.chunks_embedded += len(batch_chunks)
+        await db.commit()
+    
+    try:
+        db_document.status = "processing"
+        await db.commit()
         
-        # Process each page
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            text = page.get_text()
-            
-            if not text.strip():
-                continue
-            
-            # Split text into chunks
-            chunks = chunk_text(text)
-            
-            # Create metadata and IDs for each chunk
-            chunk_ids = [str(uuid.uuid4()) for _ in chunks]
-            chunk_metadatas = [{"page_number": page_num + 1, "document_id": doc_id} for _ in chunks]
-            
-            # Add to collections
-            all_chunks.extend(chunks)
-            all_metadatas.extend(chunk_metadatas)
-            all_ids.extend(chunk_ids)
+        page_count = db_document.total_pages
         
-        # Get file size
-        file_size = os.path.getsize(file_path)
+        # Resume after the last chunk batch that reached the vector store.
+        # Batches end on page boundaries, so no page is ever partly indexed.
+        await ensure_ready()
+        last_page, chunk_count = indexed_progress(doc_id)
         
-        # Create database entry
-        db_document = DBDocument(
-            id=doc_id,
-            filename=original_filename,
-            total_pages=len(doc),
-            total_chunks=len(all_chunks),
-            file_size=file_size,
-            status="processing"
-        )
+        db_document.pages_processed = last_page
+        db_document.chunks_embedded = chunk_count
+        await db.commit()
         
-        # Add to database
-        db.add(db_document)
-        db.commit()
+        batch_chunks = []
+        batch_metadatas = []
+        page_number = last_page
+        chunker = create_chunker()
         
-        # Close the document
-        doc.close()
+        def collect(chunks: List[Chunk]) -> None:
+            # Create metadata for each chunk, with the span of page text it covers
+            batch_chunks.extend(chunk.text for chunk in chunks)
+            batch_metadatas.extend({
+                "page_number": chunk.page_number,
+                "document_id": doc_id,
+                "start_char": chunk.start_char,
+                "end_page": chunk.end_page,
+                "end_char": chunk.end_char,
+            } for chunk in chunks)
         
-        # Add to vector store if we have chunks
-        if all_chunks:
-            await add_documents(all_chunks, all_metadatas, all_ids)
+        async for page_texts in iter_page_batches(db_document.file_path, last_page, page_count):
+            if page_texts:
+                page_number = page_texts[-1][0]
+            
+            # Split text into chunks; the end of the last page is held back
+            # until the next pages show where its chunk ends
+            collect(await run_blocking("embed", metrics.timed("chunking", chunker.feed), page_texts))
             
-            # Update status to processed
-            db_document.status = "processed"
-            db.commit()
+            if len(batch_chunks) >= config.INGEST_BATCH_CHUNKS:
+                # Close the held-back chunk, so the batch ends on a page boundary
+                collect(await run_blocking("embed", metrics.timed("chunking", chunker.finish)))
+                await flush(batch_chunks, batch_metadatas, page_number)
+                batch_chunks = []
+                batch_metadatas = []
+        
+        collect(await run_blocking("embed", metrics.timed("chunking", chunker.finish)))
+        await flush(batch_chunks, batch_metadatas, page_number)
         
-        return "success", db_document
+        # Update status to processed
+        db_document.pages_processed = page_count
+        db_document.total_chunks = db_document.chunks_embedded
+        db_document.status = "processed"
+        await db.commit()
+        
+        return db_document
         
     except Exception as e:
-        # Update status to failed if document was created
-        if 'db_document' in locals():
-            db_document.status = "failed"
-            db.commit()
-        raise e
\ No newline at end of file
+        # Earlier batches are already searchable; remove them rather than leave
+        # a partial document in answers and sources
+        try:
+            await vector_store.delete_document(doc_id)
+            db_document.pages_processed = 0
+            db_document.chunks_embedded = 0
+        except Exception:
+            pass  # Recording the failure matters more; the chunks go with the document
+        
+        # Update status to failed
+        db_document.status = "failed"
+        db_document.error = str(e)
+        await db.commit()
+        raise e
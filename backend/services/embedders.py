@@ -0,0 +1,278 @@
+import os
+import json
+from abc import ABC, abstractmethod
+from typing import List
+import numpy as np
+from backend import config
+
+EMBEDDING_BACKENDS = ("sentence_transformers", "onnx", "onnx_int8")
+
+# Files written by export_onnx into EMBEDDING_ONNX_DIR
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model_int8.onnx"
+ONNX_CONFIG_FILE = "embedder.json"
+# Lowest similarity of each exported model file to sentence-transformers, found by check_onnx
+ONNX_CHECK_FILE = "check.json"
+
+# Sentences of varied length embedded by both backends to check they agree
+REFERENCE_TEXTS = [
+    "What is the maximum operating temperature?",
+    "Part number AB-1234 replaces the discontinued AB-1200 assembly.",
+    "The quarterly report shows revenue growth of 12% driven by subscription sales in Europe and Asia.",
+    " ".join(["Long passages are truncated to the model's maximum sequence length."] * 40),
+]
+
+class Embedder(ABC):
+    """
+    Encodes texts into (unnormalized) float32 vectors.
+    name identifies the model and runtime, e.g. for caching embeddings.
+    tokenizer is the model's tokenizers.Tokenizer without truncation, for sizing
+    chunks in model tokens (None if the model has no fast tokenizer), and
+    max_seq_length the tokens the model reads, special tokens included.
+    """
+    name: str
+    dimension: int
+    tokenizer = None
+    max_seq_length: int
+
+    @abstractmethod
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Embed texts into an array of shape (len(texts), dimension)"""
+
+class SentenceTransformerEmbedder(Embedder):
+    """sentence-transformers on PyTorch, the reference implementation"""
+
+    def __init__(self, model_name: str, threads: int = 0, batch_size: int = 32):
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.name = model_name
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.max_seq_length = self.model.max_seq_length
+        self.batch_size = batch_size
+
+        backend_tokenizer = getattr(self.model.tokenizer, "backend_tokenizer", None)
+        if backend_tokenizer is not None:
+            from tokenizers import Tokenizer
+            self.tokenizer = untruncated(Tokenizer.from_str(backend_tokenizer.to_str()))
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        # sentence-transformers already sorts each call's inputs by length
+        return np.asarray(self.model.encode(texts, batch_size=self.batch_size), dtype=np.float32)
+
+class OnnxEmbedder(Embedder):
+    """
+    The same transformer exported to ONNX and run with ONNX Runtime, optionally
+    with int8 dynamically quantized weights. Inputs are sorted by token length
+    before batching, so each batch is padded only to its own longest input.
+    """
+
+    def __init__(self, model_name: str, onnx_dir: str, quantized: bool = False, threads: int = 0, batch_size: int = 32):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise RuntimeError("The onnx embedding backends need the onnxruntime and tokenizers packages")
+
+        if not os.path.exists(os.path.join(onnx_dir, ONNX_CONFIG_FILE)):
+            export_onnx(model_name, onnx_dir)
+        with open(os.path.join(onnx_dir, ONNX_CONFIG_FILE), 'r') as f:
+            settings = json.load(f)
+
+        self.model_file = ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        model_path = os.path.join(onnx_dir, self.model_file)
+        if quantized and not os.path.exists(model_path):
+            quantize_onnx(onnx_dir)
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.output_name = self.session.get_outputs()[0].name
+
+        self.tokenizer = untruncated(Tokenizer.from_file(os.path.join(onnx_dir, "tokenizer.json")))
+        # Inputs are truncated as sentence-transformers does; the shared tokenizer is not
+        self.input_tokenizer = Tokenizer.from_file(os.path.join(onnx_dir, "tokenizer.json"))
+        self.input_tokenizer.enable_truncation(settings["max_seq_length"])
+        self.input_tokenizer.no_padding()
+        self.max_seq_length = settings["max_seq_length"]
+
+        self.name = f"{model_name}:onnx_int8" if quantized else f"{model_name}:onnx"
+        self.dimension = settings["dimension"]
+        self.pooling = settings["pooling"]
+        self.batch_size = batch_size
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        encodings = self.input_tokenizer.encode_batch(texts)
+        lengths = np.array([len(encoding.ids) for encoding in encodings])
+        order = np.argsort(-lengths, kind="stable")
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            width = max(int(lengths[batch].max()), 1)
+            input_ids = np.zeros((len(batch), width), dtype=np.int64)
+            attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+            token_type_ids = np.zeros((len(batch), width), dtype=np.int64)
+            for row, i in enumerate(batch):
+                encoding = encodings[i]
+                input_ids[row, :lengths[i]] = encoding.ids
+                attention_mask[row, :lengths[i]] = encoding.attention_mask
+                token_type_ids[row, :lengths[i]] = encoding.type_ids
+
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": token_type_ids}
+            hidden = self.session.run([self.output_name], {name: value for name, value in feeds.items() if name in self.input_names})[0]
+            embeddings[batch] = pool(hidden, attention_mask, self.pooling)
+
+        return embeddings
+
+def untruncated(tokenizer):
+    """A tokenizer with truncation and padding turned off, so it counts every token"""
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+def pool(hidden: np.ndarray, attention_mask: np.ndarray, mode: str) -> np.ndarray:
+    """Pool token embeddings into one vector per input, as sentence-transformers does"""
+    if mode == "cls":
+        return hidden[:, 0]
+    mask = attention_mask[:, :, np.newaxis].astype(hidden.dtype)
+    if mode == "max":
+        return np.where(mask > 0, hidden, -1e9).max(axis=1)
+    if mode == "mean":
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    raise ValueError(f"Unsupported pooling mode '{mode}'")
+
+def export_onnx(model_name: str, onnx_dir: str) -> None:
+    """
+    Export a sentence-transformers model's transformer to ONNX, with its
+    tokenizer and pooling settings. Needs PyTorch, so it runs once per model.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0]
+    pooling = model[1]
+    os.makedirs(onnx_dir, exist_ok=True)
+    forget_checks(onnx_dir, ONNX_MODEL_FILE, ONNX_INT8_MODEL_FILE)
+    transformer.tokenizer.save_pretrained(onnx_dir)
+
+    sample = transformer.tokenizer(["Export sample sentence."], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    torch.onnx.export(
+        transformer.auto_model.eval(),
+        tuple(sample[name] for name in input_names),
+        os.path.join(onnx_dir, ONNX_MODEL_FILE),
+        input_names=input_names,
+        output_names=["last_hidden_state"],
+        dynamic_axes={name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]},
+        opset_version=14,
+    )
+
+    # Written last: its presence marks a complete export
+    with open(os.path.join(onnx_dir, ONNX_CONFIG_FILE), 'w') as f:
+        json.dump({
+            "model": model_name,
+            "dimension": model.get_sentence_embedding_dimension(),
+            "max_seq_length": model.max_seq_length,
+            "pooling": pooling.get_pooling_mode_str(),
+        }, f)
+
+def quantize_onnx(onnx_dir: str) -> None:
+    """Write an int8 dynamically quantized copy of the exported model"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    forget_checks(onnx_dir, ONNX_INT8_MODEL_FILE)
+    tmp_path = os.path.join(onnx_dir, ONNX_INT8_MODEL_FILE + ".tmp")
+    quantize_dynamic(os.path.join(onnx_dir, ONNX_MODEL_FILE), tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, os.path.join(onnx_dir, ONNX_INT8_MODEL_FILE))
+
+def lowest_similarity(embedder: Embedder, reference: Embedder, texts: List[str]) -> float:
+    """Lowest cosine similarity between the embeddings of texts from embedder and reference"""
+    a = embedder.encode(texts)
+    b = reference.encode(texts)
+    similarity = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return float(similarity.min())
+
+def require_similarity(lowest: float, tolerance: float, name: str, reference_name: str) -> float:
+    """Return lowest, raising if it is below 1 - tolerance"""
+    if lowest < 1 - tolerance:
+        raise RuntimeError(
+            f"Embeddings from {name} differ from {reference_name}: "
+            f"cosine similarity {lowest:.4f} is below {1 - tolerance:.4f}"
+        )
+    return lowest
+
+def check_equivalence(embedder: Embedder, reference: Embedder, texts: List[str], tolerance: float) -> float:
+    """
+    Compare an embedder with the reference on texts.
+    Returns the lowest cosine similarity between their embeddings, and raises
+    if it is below 1 - tolerance.
+    """
+    return require_similarity(lowest_similarity(embedder, reference, texts), tolerance, embedder.name, reference.name)
+
+def read_checks(onnx_dir: str) -> dict:
+    path = os.path.join(onnx_dir, ONNX_CHECK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def write_checks(onnx_dir: str, checks: dict) -> None:
+    tmp_path = os.path.join(onnx_dir, ONNX_CHECK_FILE + ".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(checks, f)
+    os.replace(tmp_path, os.path.join(onnx_dir, ONNX_CHECK_FILE))
+
+def forget_checks(onnx_dir: str, *model_files: str) -> None:
+    """Drop the recorded checks of model files about to be rewritten"""
+    checks = read_checks(onnx_dir)
+    if any(model_file in checks for model_file in model_files):
+        write_checks(onnx_dir, {name: lowest for name, lowest in checks.items() if name not in model_files})
+
+def check_onnx(embedder: "OnnxEmbedder", model_name: str, onnx_dir: str, tolerance: float) -> float:
+    """
+    Check an ONNX embedder against sentence-transformers. The comparison runs
+    once per exported or quantized model file, and its result is recorded next
+    to the file, so later processes check the recorded similarity without
+    loading PyTorch.
+    """
+    checks = read_checks(onnx_dir)
+    lowest = checks.get(embedder.model_file)
+    if lowest is None:
+        reference = SentenceTransformerEmbedder(model_name, config.EMBEDDING_THREADS, config.EMBEDDING_BATCH_SIZE)
+        lowest = lowest_similarity(embedder, reference, REFERENCE_TEXTS)
+        write_checks(onnx_dir, {**read_checks(onnx_dir), embedder.model_file: lowest})
+    return require_similarity(lowest, tolerance, embedder.name, model_name)
+
+def create_embedder(backend: str, model_name: str) -> Embedder:
+    """
+    Create the embedder for a backend
+    Args:
+        backend: One of EMBEDDING_BACKENDS
+        model_name: sentence-transformers model name
+    ONNX embedders are checked against sentence-transformers first when
+    EMBEDDING_CHECK is enabled, so a bad export never reaches the index. The
+    comparison itself runs once per model file (see check_onnx).
+    """
+    if backend == "sentence_transformers":
+        return SentenceTransformerEmbedder(model_name, config.EMBEDDING_THREADS, config.EMBEDDING_BATCH_SIZE)
+
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {', '.join(EMBEDDING_BACKENDS)}")
+
+    embedder = OnnxEmbedder(
+        model_name,
+        config.EMBEDDING_ONNX_DIR,
+        quantized=backend == "onnx_int8",
+        threads=config.EMBEDDING_THREADS,
+        batch_size=config.EMBEDDING_BATCH_SIZE,
+    )
+    if config.EMBEDDING_CHECK:
+        check_onnx(embedder, model_name, config.EMBEDDING_ONNX_DIR, config.EMBEDDING_CHECK_TOLERANCE)
+    return embedder
@@ -0,0 +1,56 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List
+import numpy as np
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed store of chunk embeddings.
+
+    Vectors are keyed by a SHA-256 of the model name and the chunk text, so
+    re-uploaded documents, revisions sharing pages and identical chunks across
+    documents are only ever encoded once, and share one stored vector.
+    """
+
+    def __init__(self, path: str, model_name: str):
+        self.path = path
+        self.model_name = model_name
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+        return self.connection
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).digest()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Return the cached vectors for the keys that are present"""
+        found = {}
+        with self.lock:
+            connection = self._connect()
+            # Stay well below SQLite's bound parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, vectors: Dict[bytes, np.ndarray]) -> None:
+        with self.lock:
+            connection = self._connect()
+            connection.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.ascontiguousarray(vector, dtype=np.float32).tobytes()) for key, vector in vectors.items()]
+            )
+            connection.commit()
@@ -0,0 +1,83 @@
+import os
+import numpy as np
+
+# Full-precision copy of every vector, stored next to the chunk store files
+FLOAT_VECTORS_FILE = "vectors.f32"
+
+class FloatVectors:
+    """
+    Append-only float32 matrix of the vectors at each index position.
+
+    The file is memory-mapped, so it costs no heap memory: quantized indexes
+    keep only their codes in RAM and re-rank their top candidates exactly by
+    reading just those rows from here.
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.count = 0
+        self._view = np.empty((0, dim), dtype=np.float32)
+
+    def _file(self) -> str:
+        return os.path.join(self.path, FLOAT_VECTORS_FILE)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def open(self, count: int) -> None:
+        """
+        Map the file, truncating vectors past the first count, e.g. from an
+        append interrupted by a crash
+        """
+        os.makedirs(self.path, exist_ok=True)
+        open(self._file(), 'ab').close()
+
+        row_size = self.dim * 4
+        stored = os.path.getsize(self._file()) // row_size
+        self.count = min(stored, count)
+        os.truncate(self._file(), self.count * row_size)
+        self._remap()
+
+    def follow(self, count: int) -> None:
+        """Map the vectors another process has appended, up to count, leaving the file as it is"""
+        if count > self.count:
+            self.count = count
+            self._remap()
+
+    def _remap(self) -> None:
+        # The previous view is left to readers still holding it
+        if self.count:
+            self._view = np.memmap(self._file(), dtype=np.float32, mode='r', shape=(self.count, self.dim))
+        else:
+            self._view = np.empty((0, self.dim), dtype=np.float32)
+
+    def append(self, vectors: np.ndarray) -> None:
+        """Append vectors, flushing them to disk"""
+        with open(self._file(), 'ab') as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            os.fsync(f.fileno())
+        self.count += len(vectors)
+        self._remap()
+
+    def rows(self, positions: np.ndarray) -> np.ndarray:
+        """Read the vectors at positions"""
+        view = self._view
+        return np.asarray(view[positions])
+
+    def copy_to(self, path: str, keep: np.ndarray) -> "FloatVectors":
+        """
+        Write the vectors selected by the boolean mask keep to a new file at path,
+        renumbered like ChunkStore.copy_to, and return it opened
+        """
+        os.makedirs(path, exist_ok=True)
+        kept = np.flatnonzero(keep)
+        with open(os.path.join(path, FLOAT_VECTORS_FILE), 'wb') as f:
+            # Copy in blocks so the whole matrix is never resident at once
+            for i in range(0, len(kept), 65536):
+                f.write(np.ascontiguousarray(self._view[kept[i:i + 65536]]).tobytes())
+            os.fsync(f.fileno())
+
+        copy = FloatVectors(path, self.dim)
+        copy.open(len(kept))
+        return copy
@@ -0,0 +1,218 @@
+from typing import Optional
+import numpy as np
+import faiss
+from backend import config
+
+INDEX_BACKENDS = ("flat", "sq8", "ivf_flat", "ivf_pq", "hnsw")
+
+def create_index(backend: str, dim: int) -> faiss.Index:
+    """
+    Create an empty inner product index for the given backend
+    Args:
+        backend: One of INDEX_BACKENDS
+        dim: Embedding dimension
+    """
+    if backend == "flat":
+        return faiss.IndexFlatIP(dim)
+
+    if backend == "sq8":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+
+    if backend == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, config.HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = config.HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = config.HNSW_EF_SEARCH
+        return index
+
+    if backend == "ivf_flat":
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, config.IVF_NLIST, faiss.METRIC_INNER_PRODUCT)
+    elif backend == "ivf_pq":
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, config.IVF_NLIST, config.PQ_M, config.PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+    else:
+        raise ValueError(f"Unknown index backend '{backend}', expected one of {', '.join(INDEX_BACKENDS)}")
+
+    index.nprobe = config.IVF_NPROBE
+    return index
+
+class DeltaIndex:
+    """
+    Index generation that is no longer modified, plus the vectors appended
+    since in a small in-memory delta.
+
+    Added vectors go to an exact flat delta whose ids continue after the base's;
+    searches query both and merge the results. Reader processes wrap the
+    generation they memory-map from disk, which cannot grow, so the base is
+    shared with every other process through the page cache. The writer wraps
+    HNSW and IVF indexes, whose inserts are too slow to make searches wait on,
+    and the next compaction folds the delta into the base.
+    """
+
+    def __init__(self, base: faiss.Index, dim: int):
+        self.base = base
+        self.d = dim
+        self.delta = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal + self.delta.ntotal
+
+    def add(self, vectors: np.ndarray) -> None:
+        ids = np.arange(self.ntotal, self.ntotal + len(vectors), dtype=np.int64)
+        self.delta.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), ids)
+
+    def search(self, x: np.ndarray, k: int, params: Optional[faiss.SearchParameters] = None):
+        # An empty base, e.g. a mapped flat index, crashes FAISS when searched with a selector
+        if self.base.ntotal:
+            scores, ids = self.base.search(x, k, params=params)
+        else:
+            scores = np.full((len(x), k), -np.finfo(np.float32).max, dtype=np.float32)
+            ids = np.full((len(x), k), -1, dtype=np.int64)
+        if not self.delta.ntotal:
+            return scores, ids
+
+        # The delta is flat, so it only takes the selector; IndexIDMap applies it to the global ids
+        delta_params = faiss.SearchParameters(sel=params.sel) if params is not None and params.sel is not None else None
+        delta_scores, delta_ids = self.delta.search(x, k, params=delta_params)
+
+        # Missing results score -FLT_MAX, so they sort after every real one
+        scores = np.hstack((scores, delta_scores))
+        ids = np.hstack((ids, delta_ids))
+        top = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(scores, top, axis=1), np.take_along_axis(ids, top, axis=1)
+
+    def delta_vectors(self) -> np.ndarray:
+        """Zero-copy (delta.ntotal, d) view of the vectors appended to the base, in id order"""
+        return flat_vectors(faiss.downcast_index(self.delta.index))
+
+def index_backend(index: faiss.Index) -> str:
+    """Return the backend name an existing index was built with"""
+    if isinstance(index, DeltaIndex):
+        index = index.base
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq8"
+    return "flat"
+
+def needs_training(backend: str) -> bool:
+    """
+    IVF backends must learn their centroids, and sq8 its per-dimension value
+    ranges, before vectors can be added
+    """
+    return backend in ("sq8", "ivf_flat", "ivf_pq")
+
+def training_min(backend: str) -> int:
+    """
+    Number of vectors needed before an index for backend is trained. k-means
+    needs at least as many points as centroids: IVF_NLIST for the coarse
+    quantizer, and 2**PQ_NBITS per sub-quantizer for IVF-PQ.
+    """
+    if backend == "sq8":
+        return config.SQ_TRAIN_MIN
+    if backend == "ivf_pq":
+        return max(config.IVF_TRAIN_MIN, config.IVF_NLIST, 2 ** config.PQ_NBITS)
+    return max(config.IVF_TRAIN_MIN, config.IVF_NLIST)
+
+def is_quantized(index: faiss.Index) -> bool:
+    """Whether the index stores lossy codes instead of the float vectors"""
+    if isinstance(index, DeltaIndex):
+        index = index.base
+    return isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFPQ))
+
+def adds_in_place(index: faiss.Index) -> bool:
+    """
+    Whether adding vectors to the index only copies or encodes them, cheap enough
+    to do while searches wait. Flat and sq8 indexes (and the flat delta of a
+    DeltaIndex) do; HNSW links each new vector into its graph, and IVF assigns
+    it to a list by searching the centroids.
+    """
+    return isinstance(index, (DeltaIndex, faiss.IndexFlat, faiss.IndexScalarQuantizer))
+
+def flat_vectors(index: faiss.Index) -> np.ndarray:
+    """Zero-copy (ntotal, d) view of the vectors stored in a flat index"""
+    return faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+
+def all_vectors(index: faiss.Index) -> np.ndarray:
+    """
+    Return every vector stored in an index, in id order. Exact for flat, HNSW
+    and IVF-Flat indexes; sq8 and IVF-PQ return the decoded approximations.
+    """
+    if isinstance(index, DeltaIndex):
+        return np.vstack((all_vectors(index.base), index.delta_vectors()))
+    if isinstance(index, faiss.IndexFlat):
+        return flat_vectors(index)
+    if isinstance(index, faiss.IndexHNSWFlat):
+        return flat_vectors(faiss.downcast_index(index.storage))
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+        try:
+            return index.reconstruct_n(0, index.ntotal)
+        finally:
+            index.set_direct_map_type(faiss.DirectMap.NoMap)
+    return index.reconstruct_n(0, index.ntotal)
+
+def rebuild_without(index: faiss.Index, keep: np.ndarray) -> faiss.Index:
+    """
+    Build a copy of index holding only the vectors selected by the boolean mask
+    keep, renumbered contiguously. IVF and sq8 indexes reuse their training.
+    """
+    vectors = np.ascontiguousarray(all_vectors(index)[keep], dtype=np.float32)
+    if isinstance(index, DeltaIndex):
+        index = index.base
+
+    if isinstance(index, (faiss.IndexFlat, faiss.IndexIVF, faiss.IndexScalarQuantizer)):
+        rebuilt = faiss.clone_index(index)
+        rebuilt.reset()
+    else:
+        rebuilt = create_index(index_backend(index), index.d)
+
+    if len(vectors):
+        rebuilt.add(vectors)
+    return rebuilt
+
+def build_index(backend: str, vectors: np.ndarray) -> faiss.Index:
+    """
+    Build a populated index for backend from vectors, training it first when required.
+    Training uses a random sample of at most 256 points per centroid.
+    """
+    index = create_index(backend, vectors.shape[1])
+
+    if needs_training(backend):
+        sample_size = min(len(vectors), config.IVF_NLIST * 256)
+        if sample_size < len(vectors):
+            sample = vectors[np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)]
+        else:
+            sample = vectors
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+
+    index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    return index
+
+def search_params(index: faiss.Index, selector: Optional[faiss.IDSelector] = None, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> Optional[faiss.SearchParameters]:
+    """
+    Build per-query search parameters carrying the recall knobs that apply to the index
+    Args:
+        index: Index being searched
+        selector: Optional ID selector restricting the candidates
+        nprobe: Number of IVF lists to visit (IVF backends only)
+        ef_search: HNSW candidate list size (HNSW only)
+    """
+    if isinstance(index, DeltaIndex):
+        index = index.base
+
+    # Passing the selector as a keyword keeps it referenced by the parameters object
+    kwargs = {"sel": selector} if selector is not None else {}
+
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=nprobe or index.nprobe, **kwargs)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or index.hnsw.efSearch, **kwargs)
+    if kwargs:
+        return faiss.SearchParameters(**kwargs)
+    return None
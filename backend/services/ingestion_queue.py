@@ -0,0 +1,136 @@
+import asyncio
+import os
+from typing import List, Set, Dict, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from backend import config
+from ..models.database import SessionLocal, Document as DBDocument
+from .document_ingestion import process_pdf
+from .vector_store import delete_document as delete_document_vectors
+from .answer_cache import answer_cache
+from . import metrics
+
+# Document IDs waiting for ingestion. The database is the durable copy of the
+# queue: documents stay "queued" or "processing" until ingested, and are
+# re-enqueued when the worker starts.
+queue: asyncio.Queue = None
+queued: Set[str] = set()
+# (trace ID, sampled) of the upload each queued document came from, so its
+# ingestion continues the upload's trace
+origins: Dict[str, Tuple[str, bool]] = {}
+# INGEST_WORKERS tasks, each ingesting one document at a time
+worker_tasks: List[asyncio.Task] = []
+
+# Multi-process mode: the worker runs in the writer process only, and picks up
+# documents queued or marked "deleting" by reader processes from the database
+poll_task: asyncio.Task = None
+
+metrics.Gauge("rag_ingestion_queue_depth", "Documents queued or being ingested by this process", lambda: len(queued))
+
+def enqueue(document_ids: List[str], trace: metrics.Trace = None) -> None:
+    """
+    Queue stored documents for background ingestion. Reader processes have no
+    queue; the writer finds their documents in the database instead.
+    Args:
+        document_ids: IDs of the stored documents
+        trace: Optional trace of the upload, continued by each ingestion
+    """
+    if queue is None:
+        return
+    for document_id in document_ids:
+        if document_id not in queued:
+            queued.add(document_id)
+            if trace is not None:
+                origins[document_id] = (trace.id, trace.sampled)
+            queue.put_nowait(document_id)
+
+async def remove_document(db: AsyncSession, db_document: DBDocument) -> None:
+    """Delete a document's stored upload, database row and indexed chunks"""
+    document_id = db_document.id
+    if db_document.file_path and os.path.exists(db_document.file_path):
+        os.unlink(db_document.file_path)
+    await db.delete(db_document)
+    await db.commit()
+    
+    # Searches stop returning the chunks immediately; they are purged from disk
+    # by a later compaction
+    await delete_document_vectors(document_id)
+    answer_cache.invalidate_documents({document_id})
+
+async def ingest(document_id: str) -> None:
+    """Ingest one queued document and remove its stored upload"""
+    async with SessionLocal() as db:
+        db_document = await db.get(DBDocument, document_id)
+        if db_document is None or db_document.status not in ("queued", "processing"):
+            return
+        
+        trace_id, sampled = origins.pop(document_id, (None, None))
+        try:
+            with metrics.trace("ingest", trace_id, sampled, {"document_id": document_id, "filename": db_document.filename}):
+                await process_pdf(db_document, db)
+        except Exception:
+            pass  # process_pdf records the failure on the document
+        
+        # Answers generated from earlier chunks of this document are stale
+        answer_cache.invalidate_documents({document_id})
+        
+        if db_document.file_path and os.path.exists(db_document.file_path):
+            os.unlink(db_document.file_path)
+        db_document.file_path = None
+        await db.commit()
+
+async def ingestion_worker() -> None:
+    """Process queued documents one at a time, for as long as the app runs"""
+    while True:
+        document_id = await queue.get()
+        try:
+            await ingest(document_id)
+        finally:
+            queued.discard(document_id)
+            origins.pop(document_id, None)
+            queue.task_done()
+
+async def poll_database() -> None:
+    """Apply uploads and deletions made through reader processes, every INGEST_POLL_INTERVAL_MS"""
+    while True:
+        await asyncio.sleep(config.INGEST_POLL_INTERVAL_MS / 1000)
+        async with SessionLocal() as db:
+            try:
+                enqueue((await db.scalars(select(DBDocument.id).where(
+                    DBDocument.status == "queued"
+                ).order_by(DBDocument.upload_date))).all())
+                
+                for db_document in (await db.scalars(select(DBDocument).where(DBDocument.status == "deleting"))).all():
+                    await remove_document(db, db_document)
+            except Exception:
+                pass  # Retried on the next poll
+
+async def start_ingestion_worker() -> None:
+    """Start the workers, resuming documents left queued or half-ingested by a previous run"""
+    global queue, worker_tasks, poll_task
+    
+    queue = asyncio.Queue()
+    
+    async with SessionLocal() as db:
+        pending = await db.scalars(select(DBDocument.id).where(
+            DBDocument.status.in_(("queued", "processing"))
+        ).order_by(DBDocument.upload_date))
+        enqueue(pending.all())
+    
+    worker_tasks = [asyncio.create_task(ingestion_worker()) for _ in range(max(config.INGEST_WORKERS, 1))]
+    if config.MULTI_PROCESS:
+        poll_task = asyncio.create_task(poll_database())
+
+async def stop_ingestion_worker() -> None:
+    """
+    Cancel the workers. A document interrupted mid-ingestion stays "processing"
+    and resumes from its last completed page batch on the next start.
+    """
+    for task in (poll_task, *worker_tasks):
+        if task is None:
+            continue
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,358 @@
+import os
+import re
+import math
+import struct
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Dict, Tuple, Callable, Optional
+import numpy as np
+
+# Append-only log of postings blocks, stored next to the chunk store files
+LEXICAL_FILE = "lexical.bin"
+
+# Block header: first chunk position, number of chunks, payload size
+BLOCK_HEADER = struct.Struct('<qqq')
+
+# Words too common to help BM25 rank anything; skipping them keeps posting lists short
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have how i if in into is it its of on or
+that the their there these this to was were what when where which who why will with
+""".split())
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokens. Identifiers such as part numbers ("AB-1234", "v2.3")
+    are kept whole and also split into their parts, so either form matches.
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        parts = re.split(r"[-./]", token)
+        if len(parts) > 1:
+            tokens.append(token)
+        tokens.extend(part for part in parts if part not in STOPWORDS)
+    return tokens
+
+def varint_sizes(values: np.ndarray) -> np.ndarray:
+    """Bytes taken by the LEB128 encoding of each non-negative integer"""
+    values = values.astype(np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    for bits in (7, 14, 21, 28, 35, 42, 49, 56, 63):
+        sizes += values >= (1 << bits)
+    return sizes
+
+def encode_varints(values: np.ndarray) -> bytes:
+    """LEB128-encode non-negative integers, vectorised"""
+    values = values.astype(np.uint64)
+    sizes = varint_sizes(values)
+    owner = np.repeat(np.arange(len(values)), sizes)
+    byte_index = np.arange(len(owner)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    out = (values[owner] >> (7 * byte_index).astype(np.uint64)) & 0x7f
+    out |= (byte_index < sizes[owner] - 1).astype(np.uint64) << 7
+    return out.astype(np.uint8).tobytes()
+
+def decode_varints(data) -> np.ndarray:
+    """Decode a LEB128 stream written by encode_varints, vectorised"""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if not len(raw):
+        return np.empty(0, dtype=np.int64)
+    ends = np.flatnonzero(raw < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 7 * (np.arange(len(raw)) - np.repeat(starts, ends - starts + 1))
+    values = (raw & 0x7f).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.add.reduceat(values, starts).astype(np.int64)
+
+def encode_postings(positions: np.ndarray, frequencies: np.ndarray, previous: int = 0) -> bytes:
+    """Encode (position delta, term frequency) pairs, positions relative to previous"""
+    deltas = np.diff(positions, prepend=previous)
+    return encode_varints(np.column_stack((deltas, frequencies)).ravel())
+
+def encode_posting_lists(lists: List[Tuple[np.ndarray, np.ndarray]], previous: np.ndarray) -> List[bytes]:
+    """
+    Encode many posting lists at once, each as encode_postings would with its
+    own previous position. The lists are encoded as one array, so a block of
+    thousands of terms costs a few numpy calls rather than a few per term.
+    """
+    if not lists:
+        return []
+    counts = np.array([len(positions) for positions, _ in lists], dtype=np.int64)
+    positions = np.concatenate([positions for positions, _ in lists]).astype(np.int64)
+    frequencies = np.concatenate([frequencies for _, frequencies in lists]).astype(np.int64)
+
+    # Deltas within each list, the first of each relative to its previous position
+    deltas = np.diff(positions, prepend=0)
+    firsts = (np.cumsum(counts) - counts)[counts > 0]
+    deltas[firsts] = positions[firsts] - np.asarray(previous, dtype=np.int64)[counts > 0]
+    values = np.column_stack((deltas, frequencies)).ravel()
+
+    data = encode_varints(values)
+    ends = np.concatenate(([0], np.cumsum(varint_sizes(values))))[2 * np.cumsum(counts)].tolist()
+    return [data[start:end] for start, end in zip([0] + ends[:-1], ends)]
+
+def decode_postings(data) -> Tuple[np.ndarray, np.ndarray]:
+    values = decode_varints(data)
+    return np.cumsum(values[0::2]), values[1::2]
+
+@dataclass
+class PostingsBlock:
+    """Postings of one appended batch of chunks, encoded and ready to merge"""
+    start: int
+    lengths: np.ndarray
+    postings: Dict[str, Tuple[np.ndarray, np.ndarray]]
+
+class LexicalIndex:
+    """
+    Inverted index for BM25 over the chunk store, aligned with its positions.
+
+    Each term maps to a posting list of (chunk position, term frequency) pairs,
+    delta- and varint-compressed in memory and on disk. Chunk lengths and
+    document frequencies are kept up to date as chunks are appended, so a query
+    only decodes the posting lists of its own terms. Appends (apply) and
+    searches must not run concurrently; encode, the costly part of an append,
+    may run alongside searches.
+    """
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, bytearray] = {}
+        self.last_position: Dict[str, int] = {}
+        self.doc_freq: Dict[str, int] = {}
+        self.lengths = np.zeros(1024, dtype=np.int32)
+        self.count = 0
+        self.total_length = 0
+        # (inode, byte offset) of the log read so far by follow
+        self._followed = None
+
+    def _file(self) -> str:
+        return os.path.join(self.path, LEXICAL_FILE)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def open(self, count: int) -> None:
+        """
+        Replay the postings log. Blocks past the first count chunks, e.g. from an
+        append interrupted by a crash, are truncated away, and a log of several
+        blocks is rewritten as one so the next start only reads a single block.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        open(self._file(), 'ab').close()
+
+        blocks = 0
+        valid_size = 0
+        with open(self._file(), 'rb') as f:
+            while True:
+                header = f.read(BLOCK_HEADER.size)
+                if len(header) < BLOCK_HEADER.size:
+                    break
+                start, n_chunks, payload_size = BLOCK_HEADER.unpack(header)
+                payload = f.read(payload_size)
+                if len(payload) < payload_size or start != self.count or start + n_chunks > count:
+                    break
+                self.apply(self._read_block(start, n_chunks, payload))
+                valid_size = f.tell()
+                blocks += 1
+        os.truncate(self._file(), valid_size)
+
+        if blocks > 1:
+            self.rewrite()
+
+    def follow(self, count: int) -> Optional[List[PostingsBlock]]:
+        """
+        Read the blocks another process has appended to the postings log since
+        the last call, up to count chunks, without modifying the file. The blocks
+        must be applied before the next call.
+        Returns None if the log has been rewritten in the meantime (by open in a
+        restarted writer); a new LexicalIndex has to follow it from the start.
+        """
+        if count <= self.count:
+            return []
+
+        blocks = []
+        with open(self._file(), 'rb') as f:
+            inode = os.fstat(f.fileno()).st_ino
+            if self._followed is not None and self._followed[0] != inode:
+                return None
+            offset = self._followed[1] if self._followed is not None else 0
+            f.seek(offset)
+
+            end = self.count
+            while end < count:
+                header = f.read(BLOCK_HEADER.size)
+                if len(header) < BLOCK_HEADER.size:
+                    break
+                start, n_chunks, payload_size = BLOCK_HEADER.unpack(header)
+                payload = f.read(payload_size)
+                if len(payload) < payload_size or start != end or start + n_chunks > count:
+                    break
+                blocks.append(self._read_block(start, n_chunks, payload))
+                end += n_chunks
+                offset = f.tell()
+
+        self._followed = (inode, offset)
+        return blocks
+
+    def prepare(self, texts: List[str], start: int) -> PostingsBlock:
+        """Tokenize chunks that will be appended at positions start.. onwards"""
+        lengths = np.empty(len(texts), dtype=np.int32)
+        positions: Dict[str, List[int]] = {}
+        frequencies: Dict[str, List[int]] = {}
+        for offset, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[offset] = sum(counts.values())
+            for term, frequency in counts.items():
+                positions.setdefault(term, []).append(start + offset)
+                frequencies.setdefault(term, []).append(frequency)
+
+        postings = {
+            term: (np.array(positions[term], dtype=np.int64), np.array(frequencies[term], dtype=np.int64))
+            for term in positions
+        }
+        return PostingsBlock(start, lengths, postings)
+
+    def write(self, block: PostingsBlock) -> None:
+        """Append a block to the postings log, flushing it to disk"""
+        terms = list(block.postings)
+        streams = encode_posting_lists([block.postings[term] for term in terms], np.zeros(len(terms), dtype=np.int64))
+        with open(self._file(), 'ab') as f:
+            self._write_block(f, block.start, block.lengths, dict(zip(terms, streams)))
+            os.fsync(f.fileno())
+
+    def encode(self, blocks: List[PostingsBlock]) -> List[Dict[str, bytes]]:
+        """
+        Encode the posting lists of blocks that will be applied next, in order,
+        as continuations of this index's lists. Only reads state that apply
+        changes, so the index's writer can run it while searches continue.
+        """
+        last_position: Dict[str, int] = {}
+        encoded = []
+        for block in blocks:
+            terms = list(block.postings)
+            previous = np.array([last_position.get(term, self.last_position.get(term, 0)) for term in terms], dtype=np.int64)
+            encoded.append(dict(zip(terms, encode_posting_lists([block.postings[term] for term in terms], previous))))
+            last_position.update((term, int(positions[-1])) for term, (positions, _) in block.postings.items())
+        return encoded
+
+    def apply(self, block: PostingsBlock, streams: Optional[Dict[str, bytes]] = None) -> None:
+        """
+        Merge a written block into the in-memory index, making it searchable
+        Args:
+            block: The block, as written
+            streams: Its posting lists from encode, encoded here when omitted
+        """
+        if streams is None:
+            streams = self.encode([block])[0]
+        n_chunks = len(block.lengths)
+        if self.count + n_chunks > len(self.lengths):
+            grown = np.zeros(max(2 * len(self.lengths), self.count + n_chunks), dtype=np.int32)
+            grown[:self.count] = self.lengths[:self.count]
+            self.lengths = grown
+        self.lengths[self.count:self.count + n_chunks] = block.lengths
+        self.count += n_chunks
+        self.total_length += int(block.lengths.sum())
+
+        for term, (positions, frequencies) in block.postings.items():
+            self.postings.setdefault(term, bytearray()).extend(streams[term])
+            self.last_position[term] = int(positions[-1])
+            self.doc_freq[term] = self.doc_freq.get(term, 0) + len(positions)
+
+    def search(self, tokens: List[str], k: int, select: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the top-k (scores, positions) by BM25
+        Args:
+            tokens: Query tokens, from tokenize
+            k: Number of results
+            select: Optional function mapping candidate positions to a boolean
+                mask of the ones that may be returned
+        """
+        empty = np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        if not self.count:
+            return empty
+
+        average_length = self.total_length / self.count
+        all_positions = []
+        all_scores = []
+        for term in set(tokens):
+            stream = self.postings.get(term)
+            if stream is None:
+                continue
+            positions, frequencies = decode_postings(stream)
+            df = self.doc_freq[term]
+            idf = math.log(1 + (self.count - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[positions] / average_length)
+            all_positions.append(positions)
+            all_scores.append(idf * frequencies * (self.k1 + 1) / (frequencies + norm))
+        if not all_positions:
+            return empty
+
+        positions, inverse = np.unique(np.concatenate(all_positions), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype(np.float32)
+        if select is not None:
+            selected = select(positions)
+            positions, scores = positions[selected], scores[selected]
+
+        if k < len(positions):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(positions))
+        top = top[np.argsort(-scores[top])]
+        return scores[top], positions[top]
+
+    def copy_to(self, path: str, keep: np.ndarray) -> "LexicalIndex":
+        """
+        Write the postings of the chunks selected by the boolean mask keep to a new
+        index at path, renumbered like ChunkStore.copy_to, and return it
+        """
+        renumber = np.cumsum(keep) - 1
+        copy = LexicalIndex(path, self.k1, self.b)
+        postings = {}
+        for term, stream in self.postings.items():
+            positions, frequencies = decode_postings(stream)
+            kept = keep[positions]
+            if kept.any():
+                postings[term] = (renumber[positions[kept]], frequencies[kept])
+        copy.apply(PostingsBlock(0, self.lengths[:self.count][keep], postings))
+
+        os.makedirs(path, exist_ok=True)
+        copy.rewrite()
+        return copy
+
+    def rewrite(self) -> None:
+        """Atomically replace the postings log with a single block of the whole index"""
+        tmp_path = self._file() + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            self._write_block(f, 0, self.lengths[:self.count], self.postings)
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._file())
+
+    def _write_block(self, f, start: int, lengths: np.ndarray, streams: Dict) -> None:
+        terms = list(streams)
+        term_blob = '\n'.join(terms).encode('utf-8')
+        payload = b''.join((
+            lengths.astype(np.int32).tobytes(),
+            struct.pack('<qq', len(terms), len(term_blob)),
+            term_blob,
+            np.array([len(streams[term]) for term in terms], dtype=np.int64).tobytes(),
+            *(bytes(streams[term]) for term in terms),
+        ))
+        f.write(BLOCK_HEADER.pack(start, len(lengths), len(payload)))
+        f.write(payload)
+
+    def _read_block(self, start: int, n_chunks: int, payload: bytes) -> PostingsBlock:
+        lengths = np.frombuffer(payload, dtype=np.int32, count=n_chunks)
+        offset = lengths.nbytes
+        n_terms, blob_size = struct.unpack_from('<qq', payload, offset)
+        offset += 16
+        terms = payload[offset:offset + blob_size].decode('utf-8').split('\n') if n_terms else []
+        offset += blob_size
+        sizes = np.frombuffer(payload, dtype=np.int64, count=n_terms, offset=offset)
+        offset += sizes.nbytes
+
+        postings = {}
+        for term, size in zip(terms, sizes):
+            postings[term] = decode_postings(payload[offset:offset + size])
+            offset += size
+        return PostingsBlock(start, lengths, postings)
@@ -0,0 +1,240 @@
+import bisect
+import contextvars
+import functools
+import random
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from backend import config
+
+# Latency buckets in seconds, from 1 ms to a minute
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Every metric created, in the order /metrics lists them
+registry: List["Metric"] = []
+
+def escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric(ABC):
+    """A named metric in the Prometheus text exposition format"""
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """The sample lines of the metric, without HELP and TYPE"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f"{self.name}{format_labels(self.labels, key)} {format_value(value)}" for key, value in values]
+
+class Gauge(Metric):
+    """
+    A value read when metrics are collected, from a function returning either
+    a number or a dict of label value tuples to numbers
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, read: Callable, labels: Tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self.read = read
+
+    def samples(self) -> List[str]:
+        value = self.read()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{format_labels(self.labels, key)} {format_value(number)}" for key, number in sorted(value.items())]
+
+class Histogram(Metric):
+    """
+    Counts observations into cumulative buckets. An observation costs a binary
+    search and a short lock, so histograms record every call.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+        # Per label value tuple: [count per bucket (the last for +Inf), sum]
+        self.series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *label_values) -> None:
+        slot = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][slot] += 1
+            series[1] += value
+
+    def totals(self) -> Dict[Tuple, Tuple[int, float]]:
+        """(count, sum) of the observations of each label value tuple"""
+        with self.lock:
+            return {key: (sum(counts), total) for key, (counts, total) in self.series.items()}
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self.series.items())
+        lines = []
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bound_label = 'le="' + format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, bound_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+# Stage latencies of the ingestion and query paths
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Time spent in each stage of ingestion and querying",
+    ("stage",),
+)
+HTTP_SECONDS = Histogram(
+    "rag_http_request_duration_seconds",
+    "HTTP request latency until the response is sent, by route",
+    ("method", "route", "status"),
+)
+LLM_ERRORS = Counter("rag_llm_errors_total", "Failed answer generation calls")
+TRACES_SAMPLED = Counter("rag_traces_sampled_total", "Traces recorded with their stage spans")
+
+class Trace:
+    """
+    A request or ingestion, identified by a trace ID. Sampled traces also keep
+    a span per stage they went through: (stage, seconds from the trace start, duration).
+    """
+
+    def __init__(self, name: str, trace_id: str, sampled: bool, attributes: Dict = None):
+        self.name = name
+        self.id = trace_id
+        self.sampled = sampled
+        self.attributes = attributes or {}
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.spans: List[Tuple[str, float, float]] = []
+
+    def record(self, stage: str, start: float, seconds: float) -> None:
+        self.spans.append((stage, start - self.start, seconds))
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "spans": [{"stage": stage, "offset": offset, "duration": seconds} for stage, offset, seconds in self.spans],
+        }
+
+# Traces the running task or thread works for: its own, or every trace of a
+# query batch served together. Pool threads inherit them through run_blocking.
+current_traces: contextvars.ContextVar[Tuple[Trace, ...]] = contextvars.ContextVar("current_traces", default=())
+
+# The last TRACE_BUFFER_SIZE sampled traces, newest last
+recent_traces: deque = deque(maxlen=config.TRACE_BUFFER_SIZE)
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+@contextmanager
+def trace(name: str, trace_id: str = None, sampled: bool = None, attributes: Dict = None):
+    """
+    Trace the enclosed block, making the trace current for this task and the
+    work it hands to pools. Unless sampled is given, a TRACE_SAMPLE_RATE
+    fraction of traces record stage spans; sampled traces are kept among the
+    recent traces once the block ends.
+    """
+    if sampled is None:
+        sampled = random.random() < config.TRACE_SAMPLE_RATE
+    current = Trace(name, trace_id or new_trace_id(), sampled, attributes)
+    token = current_traces.set((current,))
+    try:
+        yield current
+    finally:
+        current_traces.reset(token)
+        current.duration = time.perf_counter() - current.start
+        if current.sampled:
+            TRACES_SAMPLED.inc()
+            recent_traces.append(current)
+
+def current_trace() -> Optional[Trace]:
+    """The trace of the running request or ingestion, None outside one"""
+    traces = current_traces.get()
+    return traces[0] if len(traces) == 1 else None
+
+def observe_stage(stage: str, seconds: float, start: float = None) -> None:
+    """Record a stage that took seconds, ending now unless start is given"""
+    STAGE_SECONDS.observe(seconds, stage)
+    traces = current_traces.get()
+    if traces:
+        start = start if start is not None else time.perf_counter() - seconds
+        for trace in traces:
+            if trace.sampled:
+                trace.record(stage, start, seconds)
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as a stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start, start)
+
+def timed(name: str, fn: Callable) -> Callable:
+    """fn, timed as a stage where it runs, e.g. on a pool thread rather than while awaiting it"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def traces(limit: int = 20, name: str = None) -> List[Dict]:
+    """The most recent sampled traces, newest first"""
+    found = [trace for trace in reversed(recent_traces) if name is None or trace.name == name]
+    return [trace.to_dict() for trace in found[:limit]]
@@ -0,0 +1,65 @@
+import asyncio
+from typing import Callable, List, Tuple, Any, Set
+from .workers import run_blocking
+from . import metrics
+
+class QueryBatcher:
+    """
+    Coalesces concurrent calls into a single batched call.
+
+    Each submit() waits up to window_ms for other callers to arrive, or until
+    max_batch calls are pending. The batch function then runs once on the
+    given worker pool with every pending argument tuple, and must return one
+    result per tuple, in order. Results are fanned back out to the callers.
+    The stages of a batch are traced for every caller in it.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Tuple]], List[Any]], pool: str, window_ms: float, max_batch: int):
+        self.batch_fn = batch_fn
+        self.pool = pool
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.pending: List[Tuple[Tuple, asyncio.Future, Tuple]] = []
+        self.timer: asyncio.TimerHandle = None
+        self.running: Set[asyncio.Task] = set()
+
+    async def submit(self, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((args, future, metrics.current_traces.get()))
+
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+
+        return await future
+
+    def flush(self) -> None:
+        """Start running everything pending as one batch"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self.run(batch))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def run(self, batch: List[Tuple[Tuple, asyncio.Future, Tuple]]) -> None:
+        # The batch task has its own copy of the context, inherited from whichever
+        # caller started it; its stages belong to all the callers' traces
+        metrics.current_traces.set(tuple(trace for _, _, traces in batch for trace in traces))
+        try:
+            results = await run_blocking(self.pool, self.batch_fn, [args for args, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Callers that were cancelled while waiting simply miss their result
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,51 @@
+import threading
+from contextlib import contextmanager
+
+class ReadWriteLock:
+    """
+    A lock held by any number of readers or by one writer.
+
+    Writers are preferred: once a writer is waiting, new readers wait behind
+    it, so a steady stream of searches cannot starve an update. Readers then
+    wait only for the writer's own critical section, which should be kept to
+    publishing work prepared beforehand. Not reentrant.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        """Hold the lock shared with other readers"""
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        """Hold the lock exclusively"""
+        with self._condition:
+            self._writers_waiting += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
@@ -0,0 +1,132 @@
+"""
+Append-only on-disk layout of the vector store, one directory per shard.
+
+    <VECTOR_DB_DIR>/
+        writer.lock                    # held by the writer process in multi-process mode
+        embeddings.sqlite              # embedding cache shared by all shards
+        shards/<shard>/
+            manifest.json              # commit point: base generation, live segments, chunk count, dimension
+            base-<gen>.faiss           # compacted index
+            segments/<name>.npy        # embeddings added since the last compaction
+            chunks[-<gen>]/            # append-only chunk store (see chunk_store.py)
+
+Every file is written to a temporary path and renamed into place, and the
+manifest is only rewritten after the files it references exist, so a crash
+never leaves a half-written index behind. Every commit bumps the manifest's
+version, which reader processes poll to follow the writer.
+"""
+import os
+import json
+import shutil
+from typing import List, Dict, Optional
+import numpy as np
+import faiss
+
+MANIFEST_FILE = "manifest.json"
+SEGMENTS_DIR = "segments"
+
+def empty_manifest() -> Dict:
+    return {
+        "version": 0,
+        "base": None,
+        "segments": [],
+        "next_segment": 1,
+        "chunks": 0,
+        "chunks_dir": "chunks",
+        "deleted_documents": [],
+        "dim": None,
+    }
+
+def _fsync_replace(tmp_path: str, path: str) -> None:
+    """Flush tmp_path to disk and atomically rename it over path"""
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def atomic_write_json(path: str, data) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    _fsync_replace(tmp_path, path)
+
+def atomic_write_array(path: str, array: np.ndarray) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    _fsync_replace(tmp_path, path)
+
+def atomic_write_index(path: str, index: faiss.Index) -> None:
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    _fsync_replace(tmp_path, path)
+
+def read_manifest(db_dir: str) -> Optional[Dict]:
+    """Return the manifest, or None when the directory has not been initialised"""
+    path = os.path.join(db_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+def write_manifest(db_dir: str, manifest: Dict) -> None:
+    """Commit the manifest, bumping its version"""
+    manifest["version"] = manifest.get("version", 0) + 1
+    atomic_write_json(os.path.join(db_dir, MANIFEST_FILE), manifest)
+
+def write_segment(db_dir: str, name: str, embeddings: np.ndarray) -> None:
+    """Write one segment holding only the newly added vectors"""
+    segments_dir = os.path.join(db_dir, SEGMENTS_DIR)
+    os.makedirs(segments_dir, exist_ok=True)
+    atomic_write_array(os.path.join(segments_dir, name + ".npy"), embeddings)
+
+def read_segment(db_dir: str, name: str) -> np.ndarray:
+    return np.load(os.path.join(db_dir, SEGMENTS_DIR, name + ".npy"))
+
+def write_base(db_dir: str, generation: int, index: faiss.Index) -> None:
+    """Write a compacted base generation"""
+    atomic_write_index(os.path.join(db_dir, f"base-{generation:06d}.faiss"), index)
+
+def read_base(db_dir: str, generation: int, mmap: bool = False) -> faiss.Index:
+    """
+    Read a base generation. With mmap, its vectors or codes are mapped from the
+    file instead of copied, so processes reading the same generation share one
+    copy in the page cache; such an index is read-only.
+    """
+    return read_index(os.path.join(db_dir, f"base-{generation:06d}.faiss"), mmap)
+
+def read_index(path: str, mmap: bool = False) -> faiss.Index:
+    # Zero-copy mapping needs faiss >= 1.11; older versions read a private copy
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) if mmap else 0
+    return faiss.read_index(path, flags)
+
+def remove_segments(db_dir: str, names: List[str]) -> None:
+    """Delete segment files that have been merged into a base"""
+    for name in names:
+        path = os.path.join(db_dir, SEGMENTS_DIR, name + ".npy")
+        if os.path.exists(path):
+            os.unlink(path)
+
+def remove_base(db_dir: str, generation: int) -> None:
+    path = os.path.join(db_dir, f"base-{generation:06d}.faiss")
+    if os.path.exists(path):
+        os.unlink(path)
+
+def remove_unreferenced(db_dir: str, manifest: Dict) -> None:
+    """
+    Delete base and segment files, including temporaries, that the manifest does
+    not reference. Only safe while no writer is active, i.e. at load time.
+    """
+    live = set(manifest["segments"])
+    segments_dir = os.path.join(db_dir, SEGMENTS_DIR)
+    if os.path.isdir(segments_dir):
+        for filename in os.listdir(segments_dir):
+            if filename.split(".")[0] not in live:
+                os.unlink(os.path.join(segments_dir, filename))
+
+    base = f"base-{manifest['base']:06d}" if manifest["base"] is not None else None
+    for filename in os.listdir(db_dir):
+        path = os.path.join(db_dir, filename)
+        if filename.startswith("base-") and filename.split(".")[0] != base:
+            os.unlink(path)
+        elif filename.startswith("chunks") and filename != manifest["chunks_dir"] and os.path.isdir(path):
+            shutil.rmtree(path)
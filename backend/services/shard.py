@@ -0,0 +1,637 @@
+from typing import List, Dict, Tuple, Optional
+import numpy as np
+import faiss
+import os
+import json
+import logging
+import shutil
+import threading
+from backend import config
+from .index_factory import (
+    create_index, index_backend, needs_training, training_min, is_quantized,
+    adds_in_place, flat_vectors, all_vectors, build_index, rebuild_without, search_params, DeltaIndex
+)
+from . import segments
+from .chunk_store import ChunkStore
+from .lexical_index import LexicalIndex
+from .float_vectors import FloatVectors
+from .rwlock import ReadWriteLock
+
+logger = logging.getLogger(__name__)
+
+# Per-query search results: dense (scores, positions) and BM25 (scores, positions)
+ShardHits = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+class Shard:
+    """
+    One partition of the vector store, holding whole documents.
+
+    A shard is a complete store in its own directory (the layout described in
+    segments.py): FAISS index, chunk store, BM25 index, float vectors,
+    segments, tombstones and manifest. Positions are local to the shard.
+
+    Each shard has its own locks, so uploads and compactions on one shard never
+    block searches of the others. Blocking work runs on worker threads:
+      state_lock is a reader-writer lock over the in-memory indexes, tombstones
+        and doc_ranges. Searches share it, and each sees one consistent
+        generation of the shard from start to finish. Writers take it
+        exclusively only to publish what they prepared without it: vectors
+        appended to a flat or sq8 index or to the flat delta of an HNSW or IVF
+        one, encoded postings, or a compacted generation swapped in whole
+      write_lock serialises writers (uploads, migration, compaction) and the
+        manifest, so disk I/O and encoding happen without holding state_lock
+    """
+
+    def __init__(self, name: str, path: str, dim: int):
+        self.name = name
+        self.path = path
+        self.dim = dim
+
+        # FAISS index (inner product, i.e. cosine similarity after normalization).
+        # Backends that need training start out flat and are migrated once enough vectors exist.
+        if needs_training(config.INDEX_BACKEND):
+            self.index = faiss.IndexFlatIP(dim)
+        else:
+            self.index = create_index(config.INDEX_BACKEND, dim)
+
+        # Chunk texts and metadata, their BM25 inverted index and a memory-mapped
+        # float32 copy of the vectors (for re-ranking quantized search results)
+        chunks_dir = os.path.join(path, 'chunks')
+        self.chunks = ChunkStore(chunks_dir)
+        self.lexical = LexicalIndex(chunks_dir, config.BM25_K1, config.BM25_B)
+        self.floats = FloatVectors(chunks_dir, dim)
+
+        # Contiguous [start, end) index ranges occupied by each document, used to
+        # restrict filtered searches to that document's vectors
+        self.doc_ranges: Dict[str, List[Tuple[int, int]]] = {}
+
+        # Positions of deleted documents' vectors, skipped by searches until a compaction
+        # purges them. Kept as a little-endian bitmap that an IDSelectorBitmap reads directly.
+        self.tombstone_bits = np.zeros(0, dtype=np.uint8)
+        self.tombstone_count = 0
+        self.tombstone_selector = None
+
+        # On-disk manifest of the compacted base and the segments appended since
+        self.manifest = segments.empty_manifest()
+
+        # The shard's compaction thread, if one is running. Compactions requested
+        # while it runs set compaction_pending, so it runs another one before exiting.
+        self.compaction_thread = None
+        self.compaction_pending = False
+        self.compaction_lock = threading.Lock()
+
+        self.state_lock = ReadWriteLock()
+        self.write_lock = threading.Lock()
+
+    def rebuild_ranges(self) -> None:
+        """Rebuild doc_ranges from the chunk store's document column"""
+        self.doc_ranges.clear()
+        for document_id, start, end in self.chunks.document_runs():
+            self.doc_ranges.setdefault(document_id, []).append((start, end))
+
+    def record_ranges(self, metadatas_list: List[Dict], start: int) -> None:
+        """Extend doc_ranges with the vectors added at positions start.. onwards"""
+        for offset, meta in enumerate(metadatas_list):
+            position = start + offset
+            ranges = self.doc_ranges.setdefault(meta.get('document_id'), [])
+            if ranges and ranges[-1][1] == position:
+                ranges[-1] = (ranges[-1][0], position + 1)
+            else:
+                ranges.append((position, position + 1))
+
+    def tombstone_mask(self) -> np.ndarray:
+        """Boolean mask over the index marking tombstoned vectors. Callers must hold state_lock."""
+        mask = np.zeros(self.index.ntotal, dtype=bool)
+        bits = np.unpackbits(self.tombstone_bits, bitorder='little')[:self.index.ntotal]
+        mask[:len(bits)] = bits
+        return mask
+
+    def mark_tombstones(self, ranges: List[Tuple[int, int]]) -> None:
+        """Tombstone the vectors in ranges. Callers must hold state_lock for writing."""
+        mask = self.tombstone_mask()
+        for start, end in ranges:
+            mask[start:end] = True
+
+        self.tombstone_bits = np.packbits(mask, bitorder='little')
+        self.tombstone_count = int(mask.sum())
+        # Searches select every id not set in the bitmap; ids beyond it are live
+        self.tombstone_selector = faiss.IDSelectorNot(
+            faiss.IDSelectorBitmap(len(self.tombstone_bits), faiss.swig_ptr(self.tombstone_bits))
+        ) if self.tombstone_count else None
+
+    def clear_tombstones(self) -> None:
+        """Forget all tombstones. Callers must hold state_lock for writing."""
+        self.tombstone_bits = np.zeros(0, dtype=np.uint8)
+        self.tombstone_count = 0
+        self.tombstone_selector = None
+
+    def tombstone_ratio(self) -> float:
+        return self.tombstone_count / self.index.ntotal if self.index.ntotal else 0.0
+
+    def maybe_migrate_index(self) -> bool:
+        """
+        Move the vectors of a flat index into the configured backend once it can be built,
+        i.e. immediately for HNSW, after SQ_TRAIN_MIN vectors for sq8 and after
+        IVF_TRAIN_MIN vectors for the IVF backends (see training_min).
+        Returns True if the index was migrated. A migration that fails is logged
+        and the shard stays flat, to be retried on the next add or load.
+        Callers must hold write_lock.
+        """
+        if index_backend(self.index) == config.INDEX_BACKEND or not isinstance(self.index, faiss.IndexFlat):
+            return False
+        if needs_training(config.INDEX_BACKEND) and self.index.ntotal < training_min(config.INDEX_BACKEND):
+            return False
+
+        # Searches keep using the flat index while the new one is trained
+        try:
+            migrated = build_index(config.INDEX_BACKEND, flat_vectors(self.index))
+        except RuntimeError:
+            logger.exception("Migrating %s to %s failed, keeping the flat index", self.name, config.INDEX_BACKEND)
+            return False
+        with self.state_lock.write():
+            self.index = migrated
+        return True
+
+    def append_segment(self, embeddings: np.ndarray) -> None:
+        """
+        Persist newly added vectors as a new segment and commit it, with the chunks, to the manifest.
+        Callers must hold write_lock.
+        """
+        os.makedirs(self.path, exist_ok=True)
+
+        name = f"seg-{self.manifest['next_segment']:06d}"
+        segments.write_segment(self.path, name, embeddings)
+
+        self.manifest['next_segment'] += 1
+        self.manifest['segments'].append(name)
+        self.manifest['chunks'] = len(self.chunks)
+        segments.write_manifest(self.path, self.manifest)
+
+    def purge_tombstones(self) -> None:
+        """
+        Rewrite the index and chunk store without the tombstoned chunks, as a new base
+        generation. Positions are renumbered but chunk IDs are preserved. Holds
+        write_lock throughout, pausing uploads to this shard; searches use the old
+        generation until the swap.
+        """
+        with self.write_lock:
+            with self.state_lock.read():
+                keep = ~self.tombstone_mask()
+
+            generation = (self.manifest['base'] or 0) + 1
+            chunks_dir = f"chunks-{generation:06d}"
+            rebuilt = rebuild_without(self.index, keep)
+            purged_chunks = self.chunks.copy_to(os.path.join(self.path, chunks_dir), keep)
+            purged_lexical = self.lexical.copy_to(os.path.join(self.path, chunks_dir), keep)
+            purged_floats = self.floats.copy_to(os.path.join(self.path, chunks_dir), keep)
+            segments.write_base(self.path, generation, rebuilt)
+
+            old_base, old_segments, old_chunks_dir = self.manifest['base'], list(self.manifest['segments']), self.manifest['chunks_dir']
+            self.manifest.update(base=generation, segments=[], chunks=len(purged_chunks), chunks_dir=chunks_dir, deleted_documents=[])
+            segments.write_manifest(self.path, self.manifest)
+
+            with self.state_lock.write():
+                self.index = rebuilt
+                self.chunks = purged_chunks
+                self.lexical = purged_lexical
+                self.floats = purged_floats
+                self.clear_tombstones()
+                self.rebuild_ranges()
+
+        # Remove files superseded by the new generation. Searches still reading the
+        # old chunk store keep working, as the mapped files stay valid once unlinked.
+        segments.remove_segments(self.path, old_segments)
+        if old_base is not None:
+            segments.remove_base(self.path, old_base)
+        shutil.rmtree(os.path.join(self.path, old_chunks_dir), ignore_errors=True)
+
+    def compact(self) -> None:
+        """
+        Merge the base and all current segments into a new base generation, purging
+        deleted documents if there are any, and fold the flat delta of an HNSW or
+        IVF index into it.
+        The snapshot is taken under write_lock; the expensive inserts and writes
+        happen outside it so uploads can keep appending segments meanwhile.
+        """
+        if self.tombstone_count:
+            self.purge_tombstones()
+            return
+
+        with self.write_lock:
+            index = self.index
+            if isinstance(index, DeltaIndex):
+                # The base is no longer modified, so only the delta is copied
+                folded = np.array(index.delta_vectors())
+            else:
+                snapshot = faiss.clone_index(index)
+            merged = list(self.manifest['segments'])
+            old_base = self.manifest['base']
+
+        if isinstance(index, DeltaIndex):
+            snapshot = faiss.clone_index(index.base)
+            snapshot.add(folded)
+
+        generation = (old_base or 0) + 1
+        os.makedirs(self.path, exist_ok=True)
+        segments.write_base(self.path, generation, snapshot)
+
+        with self.write_lock:
+            if isinstance(index, DeltaIndex):
+                # Vectors added since the snapshot stay in a new delta
+                appended = self.index.delta_vectors()[len(folded):]
+                if len(appended):
+                    snapshot = DeltaIndex(snapshot, self.dim)
+                    snapshot.add(appended)
+                with self.state_lock.write():
+                    self.index = snapshot
+
+            self.manifest['base'] = generation
+            self.manifest['segments'] = [name for name in self.manifest['segments'] if name not in merged]
+            segments.write_manifest(self.path, self.manifest)
+
+        # Remove files superseded by the new base
+        segments.remove_segments(self.path, merged)
+        if old_base is not None:
+            segments.remove_base(self.path, old_base)
+        for legacy_file in ('vectors.faiss', 'metadata.json'):
+            legacy_path = os.path.join(self.path, legacy_file)
+            if os.path.exists(legacy_path):
+                os.unlink(legacy_path)
+
+    def compaction_due(self) -> bool:
+        """Whether enough segments or deletions have accumulated to compact"""
+        return len(self.manifest['segments']) >= config.COMPACT_SEGMENTS or self.tombstone_ratio() >= config.COMPACT_TOMBSTONE_RATIO
+
+    def run_compactions(self) -> None:
+        """
+        Compact until no further compaction was requested or is due. A request made
+        while compact runs, e.g. by deletions landing after the purge took its
+        snapshot, would otherwise be dropped until the next trigger or restart.
+        """
+        while True:
+            self.compact()
+            with self.compaction_lock:
+                pending, self.compaction_pending = self.compaction_pending, False
+                if not pending and not self.compaction_due():
+                    self.compaction_thread = None
+                    return
+
+    def schedule_compaction(self) -> None:
+        """
+        Run compactions on a background thread, or have the running one compact
+        again once it finishes
+        """
+        with self.compaction_lock:
+            if self.compaction_thread is not None and self.compaction_thread.is_alive():
+                self.compaction_pending = True
+                return
+            self.compaction_thread = threading.Thread(target=self.run_compactions, name=f"compaction-{self.name}", daemon=True)
+            self.compaction_thread.start()
+
+    def load(self) -> None:
+        """Load the base index, replay the segments appended since and open the chunk store"""
+        legacy_index = os.path.join(self.path, 'vectors.faiss')
+        legacy_metadata = os.path.join(self.path, 'metadata.json')
+
+        manifest = segments.read_manifest(self.path)
+
+        if manifest is None and os.path.exists(legacy_index) and os.path.exists(legacy_metadata):
+            # Single-file layout written before segments existed: import its chunks once.
+            # vectors.faiss serves as the base until the first compaction replaces it.
+            with open(legacy_metadata, 'r') as f:
+                data = json.load(f)
+            self.chunks.open(0)
+            self.chunks.append(data['documents'], data['metadata'])
+            manifest = segments.empty_manifest()
+            manifest['chunks'] = len(self.chunks)
+            segments.write_manifest(self.path, manifest)
+
+        self.manifest = {**segments.empty_manifest(), **(manifest or {}), 'dim': self.dim}
+        chunks_path = os.path.join(self.path, self.manifest['chunks_dir'])
+        self.chunks = ChunkStore(chunks_path)
+        self.chunks.open(self.manifest['chunks'])
+        self.lexical = LexicalIndex(chunks_path, config.BM25_K1, config.BM25_B)
+        self.lexical.open(self.manifest['chunks'])
+
+        # Index chunks stored before the inverted index existed
+        for start in range(len(self.lexical), len(self.chunks), config.INGEST_BATCH_CHUNKS):
+            end = min(start + config.INGEST_BATCH_CHUNKS, len(self.chunks))
+            block = self.lexical.prepare([self.chunks.text(i) for i in range(start, end)], start)
+            self.lexical.write(block)
+            self.lexical.apply(block)
+        if self.manifest['base'] is not None:
+            self.index = segments.read_base(self.path, self.manifest['base'])
+        elif os.path.exists(legacy_index):
+            self.index = faiss.read_index(legacy_index)
+
+        for name in self.manifest['segments']:
+            self.index.add(segments.read_segment(self.path, name))
+
+        # Keep float copies of vectors stored before the float file existed. Indexes
+        # that were already quantized can only provide their decoded approximations.
+        self.floats = FloatVectors(chunks_path, self.dim)
+        self.floats.open(self.manifest['chunks'])
+        if len(self.floats) < self.index.ntotal:
+            self.floats.append(all_vectors(self.index)[len(self.floats):])
+
+        if os.path.isdir(self.path):
+            segments.remove_unreferenced(self.path, self.manifest)
+
+        self.rebuild_ranges()
+
+        # Re-apply tombstones of documents deleted since the last purge
+        for document_id in self.manifest['deleted_documents']:
+            self.mark_tombstones(self.doc_ranges.pop(document_id, []))
+
+        # Rewrite the base if it is in the legacy layout, was migrated to the configured
+        # backend, or has accumulated segments or deletions
+        migrated = self.maybe_migrate_index()
+        if self.index.ntotal and (migrated or self.manifest['base'] is None or self.compaction_due()):
+            self.schedule_compaction()
+
+    def follow_manifest(self) -> bool:
+        """
+        Bring a reader process up to date with the manifest the writer last committed.
+        Appended segments, chunks and postings are read incrementally; a new base
+        generation is memory-mapped, and a new chunk store directory opened from
+        the start. All files are read before any state changes, so a read that
+        fails, e.g. because a compaction removed the files, leaves the shard on
+        its current generation and is simply retried.
+        Returns True if the manifest had changed.
+        """
+        latest = segments.read_manifest(self.path)
+        if latest is None:
+            return False
+        latest = {**segments.empty_manifest(), **latest}
+        if latest == self.manifest:
+            return False
+
+        with self.write_lock:
+            # Readers have no other writers; the lock serialises concurrent follows
+            loaded_segments = self.manifest['segments']
+            if isinstance(self.index, DeltaIndex) and latest['base'] == self.manifest['base'] and latest['segments'][:len(loaded_segments)] == loaded_segments:
+                index = self.index
+                appended = latest['segments'][len(loaded_segments):]
+            else:
+                legacy_index = os.path.join(self.path, 'vectors.faiss')
+                if latest['base'] is not None:
+                    base = segments.read_base(self.path, latest['base'], mmap=True)
+                elif os.path.exists(legacy_index):
+                    base = segments.read_index(legacy_index, mmap=True)
+                else:
+                    base = create_index("flat", self.dim)
+                index = DeltaIndex(base, self.dim)
+                appended = latest['segments']
+            vectors = [segments.read_segment(self.path, name) for name in appended]
+
+            chunks_path = os.path.join(self.path, latest['chunks_dir'])
+            if latest['chunks_dir'] == self.manifest['chunks_dir']:
+                chunks, lexical, floats = self.chunks, self.lexical, self.floats
+            else:
+                chunks = ChunkStore(chunks_path)
+                lexical = LexicalIndex(chunks_path, config.BM25_K1, config.BM25_B)
+                floats = FloatVectors(chunks_path, self.dim)
+            chunks.follow(latest['chunks'])
+            floats.follow(latest['chunks'])
+            blocks = lexical.follow(latest['chunks'])
+            if blocks is None:
+                lexical = LexicalIndex(chunks_path, config.BM25_K1, config.BM25_B)
+                blocks = lexical.follow(latest['chunks'])
+            streams = lexical.encode(blocks)
+
+            # A new generation is filled before it is published, the current one
+            # in place. Either only appends to the flat delta of a DeltaIndex.
+            if index is not self.index:
+                for embeddings in vectors:
+                    index.add(embeddings)
+
+            with self.state_lock.write():
+                if index is self.index:
+                    for embeddings in vectors:
+                        index.add(embeddings)
+                for block, block_streams in zip(blocks, streams):
+                    lexical.apply(block, block_streams)
+                self.index, self.chunks, self.lexical, self.floats = index, chunks, lexical, floats
+                self.manifest = latest
+
+                self.rebuild_ranges()
+                self.clear_tombstones()
+                deleted = [r for document_id in latest['deleted_documents'] for r in self.doc_ranges.pop(document_id, [])]
+                if deleted:
+                    self.mark_tombstones(deleted)
+        return True
+
+    def add_embeddings(self, embeddings: np.ndarray, texts: List[str], metadatas_list: List[Dict], ids: List[str]) -> bool:
+        """
+        Store chunks and make their vectors searchable, persisting only the new data.
+        Returns True if a compaction is due.
+        """
+        with self.write_lock:
+            # Chunks and their postings are stored before they become visible to searches
+            start = len(self.chunks)
+            self.chunks.append(texts, metadatas_list, ids)
+            self.floats.append(embeddings)
+            postings = self.lexical.prepare(texts, start)
+            self.lexical.write(postings)
+            streams = self.lexical.encode([postings])[0]
+
+            with self.state_lock.write():
+                # Add to FAISS and inverted indexes. HNSW and IVF inserts are too slow
+                # to make searches wait on, so those vectors go to a flat delta that
+                # the next compaction folds into the index.
+                if not adds_in_place(self.index):
+                    self.index = DeltaIndex(self.index, self.dim)
+                self.index.add(embeddings)
+                self.lexical.apply(postings, streams)
+                self.record_ranges(metadatas_list, start)
+
+            # Persist the new vectors only, committing them before any migration
+            # so the manifest always matches the chunks stored
+            self.append_segment(embeddings)
+
+            migrated = self.maybe_migrate_index()
+            return migrated or len(self.manifest['segments']) >= config.COMPACT_SEGMENTS
+
+    def delete_document(self, document_id: str) -> bool:
+        """
+        Tombstone a document's vectors so searches skip them from now on. The
+        deletion is recorded in the manifest, and the vectors and chunks are purged
+        by a later compaction. Returns whether compaction is due.
+        """
+        with self.write_lock:
+            with self.state_lock.write():
+                ranges = self.doc_ranges.pop(document_id, None)
+                if not ranges:
+                    return False
+                self.mark_tombstones(ranges)
+                ratio = self.tombstone_ratio()
+
+            self.manifest['deleted_documents'].append(document_id)
+            segments.write_manifest(self.path, self.manifest)
+
+        return ratio >= config.COMPACT_TOMBSTONE_RATIO
+
+    def indexed_progress(self, document_id: str) -> Tuple[int, int]:
+        """Return (last page number, chunk count) stored for document_id"""
+        with self.state_lock.read():
+            ranges = list(self.doc_ranges.get(document_id, []))
+            store = self.chunks
+        if not ranges:
+            return 0, 0
+        # A chunk can run over a page break, so the last page is where the last chunk ends
+        return store.end_page(ranges[-1][1] - 1), sum(end - start for start, end in ranges)
+
+    def search_flat_subset(self, query_embedding: np.ndarray, ranges: List[Tuple[int, int]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact top-k over a subset of a flat index, scoring only the vectors in ranges
+        instead of the whole index
+        """
+        xb = flat_vectors(self.index)
+        ids = np.concatenate([np.arange(start, end, dtype=np.int64) for start, end in ranges])
+        scores = np.concatenate([xb[start:end] @ query_embedding[0] for start, end in ranges])
+
+        if k < len(ids):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(ids))
+        top = top[np.argsort(-scores[top])]
+        return scores[top], ids[top]
+
+    def search_candidates(self, query_embedding: np.ndarray, n_results: int, ranges: List[Tuple[int, int]] = None, nprobe: int = None, ef_search: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search a bounded candidate set of k results, optionally restricted to ranges.
+        k starts at n_results and is only grown when the index returns fewer valid
+        hits than requested while more candidates remain.
+        nprobe and ef_search override the index's recall settings for this query.
+        """
+        if ranges is not None and isinstance(self.index, faiss.IndexFlat):
+            return self.search_flat_subset(query_embedding, ranges, n_results)
+
+        # Unfiltered searches skip tombstoned vectors; filtered ones never cover them
+        selector = self.tombstone_selector
+        limit = self.index.ntotal - self.tombstone_count
+        if ranges is not None:
+            limit = sum(end - start for start, end in ranges)
+            if len(ranges) == 1:
+                selector = faiss.IDSelectorRange(ranges[0][0], ranges[0][1])
+            else:
+                selector = faiss.IDSelectorBatch(
+                    np.concatenate([np.arange(start, end, dtype=np.int64) for start, end in ranges])
+                )
+        params = search_params(self.index, selector, nprobe, ef_search)
+
+        k = min(n_results, limit)
+        if k <= 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        while True:
+            scores, indices = self.index.search(query_embedding, k, params=params)
+            valid = indices[0] >= 0
+            if valid.sum() >= n_results or k >= limit:
+                return scores[0][valid], indices[0][valid]
+            k = min(k * 2, limit)
+
+    def live_positions(self, positions: np.ndarray, ranges: List[Tuple[int, int]] = None) -> np.ndarray:
+        """
+        Boolean mask of the positions that are not tombstoned and, when ranges is
+        given, fall inside them. Callers must hold state_lock.
+        """
+        mask = np.ones(len(positions), dtype=bool)
+        if self.tombstone_count:
+            in_bitmap = positions < len(self.tombstone_bits) * 8
+            tombstoned = positions[in_bitmap]
+            mask[in_bitmap] = ((self.tombstone_bits[tombstoned >> 3] >> (tombstoned & 7)) & 1) == 0
+        if ranges is not None:
+            starts = np.array([start for start, _ in ranges])
+            ends = np.array([end for _, end in ranges])
+            owner = np.searchsorted(starts, positions, side='right') - 1
+            mask &= (owner >= 0) & (positions < ends[np.maximum(owner, 0)])
+        return mask
+
+    def search(self, query_embeddings: np.ndarray, requests: List[Tuple[str, int, int]], depths: List[int], query_tokens: Optional[List[List[str]]]) -> Tuple[ChunkStore, FloatVectors, List[ShardHits]]:
+        """
+        Search this shard for a batch of queries. Unfiltered queries sharing the
+        same recall settings are answered by a single index.search.
+        Args:
+            query_embeddings: Normalized query embeddings, one row per request
+            requests: (document_id, nprobe, ef_search) per query; documents must be in this shard
+            depths: Candidates wanted from each ranker per query
+            query_tokens: Tokens of each query for BM25, or None without hybrid search
+        Returns the chunk store and float vectors the positions refer to, and per
+        query the dense hits, re-ranked exactly for quantized indexes, and the BM25 hits
+        """
+        empty = (np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64))
+        hits = [empty] * len(requests)
+        lexical_hits = [empty] * len(requests)
+        groups: Dict[Tuple[int, int], List[int]] = {}
+
+        with self.state_lock.read():
+            # Results are read from the chunk store matching this index generation,
+            # even if a compaction swaps in a new one once the lock is released
+            store = self.chunks
+            vectors = self.floats
+            live = self.index.ntotal - self.tombstone_count
+
+            # Quantized indexes fetch RERANK_FACTOR times more candidates, which are
+            # re-scored exactly against the float vectors once the lock is released
+            rerank = config.RERANK_FLOAT and is_quantized(self.index)
+            dense_depths = [depth * config.RERANK_FACTOR for depth in depths] if rerank else depths
+
+            for i, (document_id, nprobe, ef_search) in enumerate(requests):
+                if not document_id:
+                    groups.setdefault((nprobe, ef_search), []).append(i)
+                    if query_tokens is not None:
+                        lexical_hits[i] = self.lexical.search(query_tokens[i], depths[i], self.live_positions if self.tombstone_count else None)
+                    continue
+
+                # Filtered queries search only their document's candidate set
+                ranges = self.doc_ranges.get(document_id)
+                if ranges:
+                    hits[i] = self.search_candidates(query_embeddings[i:i + 1], dense_depths[i], ranges, nprobe, ef_search)
+                    if query_tokens is not None:
+                        lexical_hits[i] = self.lexical.search(query_tokens[i], depths[i], lambda positions: self.live_positions(positions, ranges))
+
+            for (nprobe, ef_search), members in groups.items() if live > 0 else ():
+                k = min(max(dense_depths[i] for i in members), live)
+                params = search_params(self.index, self.tombstone_selector, nprobe, ef_search)
+                scores, indices = self.index.search(query_embeddings[members], k, params=params)
+
+                for row, i in enumerate(members):
+                    valid = indices[row] >= 0
+                    if valid.sum() < min(dense_depths[i], live):
+                        # The index came up short for this query, retry it with a growing k
+                        hits[i] = self.search_candidates(query_embeddings[i:i + 1], dense_depths[i], None, nprobe, ef_search)
+                    else:
+                        hits[i] = (scores[row][valid][:dense_depths[i]], indices[row][valid][:dense_depths[i]])
+
+        results = []
+        for (scores, indices), (lexical_scores, lexical_indices), embedding, depth in zip(hits, lexical_hits, query_embeddings, depths):
+            if rerank and len(indices):
+                scores, indices = rerank_exact(vectors, embedding, indices, depth)
+            results.append((scores, indices, lexical_scores, lexical_indices))
+        return store, vectors, results
+
+def stored_dimension(path: str) -> Optional[int]:
+    """
+    Dimension of the vectors stored in a shard directory, read without loading
+    its index where possible. Returns None if the shard holds no vectors.
+    """
+    manifest = segments.read_manifest(path)
+    if manifest is None:
+        legacy_index = os.path.join(path, 'vectors.faiss')
+        return faiss.read_index(legacy_index).d if os.path.exists(legacy_index) else None
+    if manifest.get('dim'):
+        return manifest['dim']
+
+    # Manifests written before the dimension was recorded
+    if manifest['segments']:
+        return np.load(os.path.join(path, segments.SEGMENTS_DIR, manifest['segments'][0] + ".npy"), mmap_mode='r').shape[1]
+    if manifest['base'] is not None:
+        return segments.read_base(path, manifest['base']).d
+    legacy_index = os.path.join(path, 'vectors.faiss')
+    return faiss.read_index(legacy_index).d if os.path.exists(legacy_index) else None
+
+def rerank_exact(vectors: FloatVectors, query_embedding: np.ndarray, indices: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Re-score candidates from a quantized index with their float vectors and keep the top k"""
+    scores = vectors.rows(indices) @ query_embedding
+    top = np.argsort(-scores)[:k]
+    return scores[top], indices[top]
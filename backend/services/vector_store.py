@@ -1,123 +1,437 @@
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional
+from itertools import islice, repeat
+import heapq
 import numpy as np
-import faiss
 import os
-import json
+import threading
+import time
+import zlib
+from backend import config
+from . import segments
+from . import metrics
+from .shard import Shard
+from .lexical_index import tokenize
+from .workers import run_blocking, get_executor
+from .query_batcher import QueryBatcher
+from .embedding_cache import EmbeddingCache
+from .embedders import create_embedder
 
-# Initialize the embedding model
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# The model and stored index are loaded by initialize(), not on import, so
+# importing this module is cheap. Until then the following are None.
 
-# Get embedding dimension
-EMBEDDING_DIM = model.get_sentence_embedding_dimension()
+# Embedding model on the configured runtime, and its embedding dimension
+embedder = None
+EMBEDDING_DIM = None
 
-# Initialize FAISS index
-index = faiss.IndexFlatIP(EMBEDDING_DIM)  # Inner product index (cosine similarity after normalization)
+# Embeddings of every chunk text encoded so far
+embedding_cache = None
 
-# Initialize storage for metadata
-documents = []
-metadatas = []
+initialized = False
+init_lock = threading.Lock()
+
+# The index is partitioned into shards, each a complete store with its own
+# files under VECTOR_DB_DIR/shards/<name>/ and its own locks (see shard.py)
+SHARDS_DIR = "shards"
+shards: Dict[str, Shard] = {}
+
+# Shard holding each document, rebuilt from the shards' contents. New documents
+# are placed by a hash of their ID over the first INDEX_SHARDS shards; existing
+# ones are looked up here rather than rehashed, so shards can be added, or
+# documents moved between them, without relocating everything.
+placement: Dict[str, Shard] = {}
+
+WRITER_LOCK_FILE = "writer.lock"
+
+# "writer" or "reader", decided by claim_role. Outside MULTI_PROCESS mode every
+# process is a writer. In it, only the process holding the lock file changes the
+# store; readers memory-map what it writes and follow its manifests.
+role = None
+writer_lock_file = None
+follow_thread = None
+
+def claim_role() -> str:
+    """
+    Decide whether this process is the store's writer. In MULTI_PROCESS mode the
+    first process to lock WRITER_LOCK_FILE becomes the writer and holds the lock
+    until it exits; every other process is a reader. Decided once per process.
+    """
+    global role, writer_lock_file
+
+    if role is not None:
+        return role
+    if not config.MULTI_PROCESS:
+        role = "writer"
+        return role
+
+    import fcntl
+    os.makedirs(config.VECTOR_DB_DIR, exist_ok=True)
+    lock_file = open(os.path.join(config.VECTOR_DB_DIR, WRITER_LOCK_FILE), 'a')
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        role = "reader"
+        return role
+    writer_lock_file = lock_file
+    role = "writer"
+    return role
+
+def require_writer() -> None:
+    if claim_role() != "writer":
+        raise RuntimeError("Only the writer process can change the vector store")
 
 def normalize_vectors(vectors: np.ndarray) -> np.ndarray:
     """Normalize vectors to unit length for cosine similarity"""
     return vectors / np.linalg.norm(vectors, axis=1)[:, np.newaxis]
 
-def save_state():
-    """Save the index and documents to disk"""
-    if not os.path.exists('vector_db'):
-        os.makedirs('vector_db')
-    
-    # Save FAISS index
-    faiss.write_index(index, 'vector_db/vectors.faiss')
-    
-    # Save documents and metadata
-    with open('vector_db/metadata.json', 'w') as f:
-        json.dump({
-            'documents': documents,
-            'metadata': metadatas
-        }, f)
-
-def load_state():
-    """Load the index and documents from disk"""
-    global index, documents, metadatas
-    
-    if os.path.exists('vector_db/vectors.faiss') and os.path.exists('vector_db/metadata.json'):
-        # Load FAISS index
-        index = faiss.read_index('vector_db/vectors.faiss')
-        
-        # Load documents and metadata
-        with open('vector_db/metadata.json', 'r') as f:
-            data = json.load(f)
-            documents = data['documents']
-            metadatas = data['metadata']
-
-async def add_documents(texts: List[str], metadatas_list: List[Dict], ids: List[str]) -> None:
-    """
-    Add documents to the vector store with their embeddings
-    """
-    # Generate embeddings
-    embeddings = model.encode(texts)
-    
+def shard_name(number: int) -> str:
+    return f"shard-{number:03d}"
+
+def open_shards(names: List[str]) -> List[Shard]:
+    """Create the shards in names that are not open yet, and return them"""
+    opened = []
+    for name in names:
+        if name not in shards:
+            shards[name] = Shard(name, os.path.join(config.VECTOR_DB_DIR, SHARDS_DIR, name), EMBEDDING_DIM)
+            opened.append(shards[name])
+    return opened
+
+def stored_shard_names() -> List[str]:
+    shards_dir = os.path.join(config.VECTOR_DB_DIR, SHARDS_DIR)
+    if not os.path.isdir(shards_dir):
+        return []
+    return sorted(name for name in os.listdir(shards_dir) if os.path.isdir(os.path.join(shards_dir, name)))
+
+def rebuild_placement() -> None:
+    global placement
+    placement = {document_id: shard for shard in shards.values() for document_id in list(shard.doc_ranges)}
+
+def place(document_id: str) -> Shard:
+    """Return the shard holding document_id, or the one a new document goes to"""
+    shard = placement.get(document_id)
+    if shard is None:
+        shard = shards[shard_name(zlib.crc32(document_id.encode('utf-8')) % config.INDEX_SHARDS)]
+    return shard
+
+def migrate_single_store() -> None:
+    """
+    Move a store written before sharding, with its manifest (or the legacy
+    vectors.faiss) directly in VECTOR_DB_DIR, into the first shard. Files are
+    renamed rather than copied and the manifest moves last, so an interrupted
+    move just continues on the next start.
+    """
+    db_dir = config.VECTOR_DB_DIR
+    roots = [name for name in ('metadata.json', 'vectors.faiss', segments.MANIFEST_FILE) if os.path.exists(os.path.join(db_dir, name))]
+    if not roots:
+        return
+
+    target = os.path.join(db_dir, SHARDS_DIR, shard_name(0))
+    os.makedirs(target, exist_ok=True)
+    for filename in os.listdir(db_dir):
+        if filename.startswith(('base-', 'chunks')) or filename == segments.SEGMENTS_DIR:
+            os.replace(os.path.join(db_dir, filename), os.path.join(target, filename))
+    for filename in roots:
+        os.replace(os.path.join(db_dir, filename), os.path.join(target, filename))
+
+def follow_shards() -> None:
+    """
+    Reader processes: follow every shard's manifest, opening shards the writer
+    has created since the last call
+    """
+    open_shards(stored_shard_names())
+    for shard in list(shards.values()):
+        try:
+            shard.follow_manifest()
+        except Exception:
+            pass  # Retried on the next poll
+    rebuild_placement()
+
+def follow_writer() -> None:
+    """Reader processes: poll the manifests every RELOAD_INTERVAL_MS and follow the writer"""
+    while True:
+        time.sleep(config.RELOAD_INTERVAL_MS / 1000)
+        follow_shards()
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """Encode texts into normalized float32 vectors"""
+    with metrics.stage("embedding"):
+        embeddings = embedder.encode(texts)
+
     # Normalize vectors for cosine similarity
-    embeddings = normalize_vectors(embeddings)
-    
-    # Add to FAISS index
-    index.add(embeddings.astype(np.float32))
-    
-    # Add to storage
-    documents.extend(texts)
-    metadatas.extend(metadatas_list)
-    
-    # Save state
-    save_state()
-
-async def search_documents(query: str, n_results: int = 3, document_id: str = None) -> List[Tuple[str, Dict]]:
+    return normalize_vectors(embeddings).astype(np.float32)
+
+def embed_chunks(texts: List[str]) -> np.ndarray:
+    """
+    Encode chunk texts, reusing cached embeddings so only texts never seen
+    before (with this model) are encoded, each of them once
+    """
+    if not config.EMBEDDING_CACHE_ENABLED:
+        return embed_texts(texts)
+
+    keys = [embedding_cache.key(text) for text in texts]
+    cached = embedding_cache.get_many(list(set(keys)))
+
+    # Encode each missing text once, even if it repeats within the batch
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cached and key not in missing:
+            missing[key] = text
+    if missing:
+        encoded = dict(zip(missing, embed_texts(list(missing.values()))))
+        embedding_cache.put_many(encoded)
+        cached.update(encoded)
+
+    return np.stack([cached[key] for key in keys]).astype(np.float32)
+
+async def add_documents(texts: List[str], metadatas_list: List[Dict], ids: List[str], embeddings: Optional[np.ndarray] = None) -> None:
+    """
+    Add documents to the vector store with their embeddings.
+    Embedding and index writes run on the embed pool, off the event loop.
+    Each document's chunks are added to its shard, where only the new vectors
+    and chunks are written to disk, as a new segment.
+    embeddings are normalized vectors for the texts, computed here when omitted.
+    """
+    await ensure_ready()
+    require_writer()
+    if embeddings is None:
+        embeddings = await run_blocking("embed", embed_chunks, texts)
+
+    rows: Dict[str, List[int]] = {}
+    for i, meta in enumerate(metadatas_list):
+        rows.setdefault(meta.get('document_id'), []).append(i)
+
+    for document_id, members in rows.items():
+        shard = place(document_id)
+        compaction_due = await run_blocking(
+            "embed", metrics.timed("index_write", shard.add_embeddings), embeddings[members],
+            [texts[i] for i in members], [metadatas_list[i] for i in members], [ids[i] for i in members]
+        )
+        placement[document_id] = shard
+
+        if compaction_due:
+            shard.schedule_compaction()
+
+async def delete_document(document_id: str) -> None:
+    """
+    Remove a document from the vector store. Its vectors are tombstoned so
+    searches skip them at once, and purged by a later compaction of its shard.
+    Args:
+        document_id: ID of the document whose chunks are removed
+    """
+    await ensure_ready()
+    require_writer()
+    shard = placement.pop(document_id, None)
+    if shard is None:
+        return
+    compaction_due = await run_blocking("embed", shard.delete_document, document_id)
+
+    if compaction_due:
+        shard.schedule_compaction()
+
+def indexed_progress(document_id: str) -> Tuple[int, int]:
+    """
+    Return (last page number, chunk count) stored for document_id.
+    Chunks are added a batch of pages at a time, each batch committed atomically,
+    so this tells an interrupted ingestion where to resume.
+    """
+    shard = placement.get(document_id)
+    if shard is None:
+        return 0, 0
+    return shard.indexed_progress(document_id)
+
+def fuse_rankings(rankings: List[List], n_results: int) -> List:
+    """
+    Merge ranked lists of results with reciprocal-rank fusion: each result
+    scores the sum of 1 / (RRF_K + rank) over the lists it appears in
+    """
+    fused: Dict = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (config.RRF_K + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)[:n_results]
+
+def merge_hits(ranked: List[List[Tuple[float, str, int]]], k: int) -> List[Tuple[str, int]]:
+    """Merge per-shard lists of (score, shard, position), each sorted by score, into the top k (shard, position)"""
+    return [(name, position) for _, name, position in islice(heapq.merge(*ranked, reverse=True), k)]
+
+def search_batch_sync(requests: List[Tuple[str, int, str, int, int]]) -> List[Tuple[List[Tuple[str, Dict]], np.ndarray, np.ndarray]]:
+    """
+    Search several queries at once, run on the query pool.
+    All queries are embedded in one batch and scattered to the shards: queries
+    filtered to a document go to its shard only, the others to every shard, with
+    the shards searched in parallel on the shard pool. Each shard returns its own
+    top candidates, and a heap merges them into each query's global ranking.
+    With HYBRID_SEARCH, every query also runs BM25 over the inverted indexes
+    (scored with each shard's own term statistics) and the two rankings are
+    merged with reciprocal-rank fusion.
+    Args:
+        requests: (query, n_results, document_id, nprobe, ef_search) tuples
+    Returns per request the list of (text, metadata) tuples, the query embedding
+    and the stored vector of each result, read from its shard's float vectors
+    """
+    # Generate query embeddings and normalize
+    query_embeddings = embed_texts([query for query, *_ in requests])
+    search_start = time.perf_counter()
+
+    # Each ranker contributes HYBRID_CANDIDATES candidates to the fusion
+    if config.HYBRID_SEARCH:
+        depths = [max(n_results, config.HYBRID_CANDIDATES) for _, n_results, *_ in requests]
+        query_tokens = [tokenize(query) for query, *_ in requests]
+    else:
+        depths = [n_results for _, n_results, *_ in requests]
+        query_tokens = None
+
+    targets: Dict[str, List[int]] = {}
+    for i, (_, _, document_id, *_) in enumerate(requests):
+        if document_id:
+            shard = placement.get(document_id)
+            if shard is not None:
+                targets.setdefault(shard.name, []).append(i)
+        else:
+            for name in list(shards):
+                targets.setdefault(name, []).append(i)
+
+    def search_shard(name: str):
+        members = targets[name]
+        return shards[name].search(
+            query_embeddings[members],
+            [tuple(requests[i][2:]) for i in members],
+            [depths[i] for i in members],
+            [query_tokens[i] for i in members] if query_tokens is not None else None,
+        )
+
+    # Scatter, in parallel unless a single shard is involved
+    if len(targets) > 1:
+        answers = dict(zip(targets, get_executor("shard").map(search_shard, targets)))
+    else:
+        answers = {name: search_shard(name) for name in targets}
+
+    # Gather each query's hits per shard, sorted by score
+    stores = {}
+    floats = {}
+    dense_hits = [[] for _ in requests]
+    lexical_hits = [[] for _ in requests]
+    for name, members in targets.items():
+        store, shard_floats, shard_hits = answers[name]
+        stores[name] = store
+        floats[name] = shard_floats
+        for i, (scores, positions, lexical_scores, lexical_positions) in zip(members, shard_hits):
+            # Skip results with no similarity
+            relevant = scores > 0
+            dense_hits[i].append(list(zip(scores[relevant].tolist(), repeat(name), positions[relevant].tolist())))
+            lexical_hits[i].append(list(zip(lexical_scores.tolist(), repeat(name), lexical_positions.tolist())))
+
+    results = []
+    for i, ((_, n_results, *_), embedding) in enumerate(zip(requests, query_embeddings)):
+        dense = merge_hits(dense_hits[i], depths[i])
+        if config.HYBRID_SEARCH:
+            ranked = fuse_rankings([dense, merge_hits(lexical_hits[i], depths[i])], n_results)
+        else:
+            ranked = dense[:n_results]
+
+        # The vectors stored with the results, for re-ranking them without re-embedding
+        vectors = np.empty((len(ranked), query_embeddings.shape[1]), dtype=np.float32)
+        for name in {name for name, _ in ranked}:
+            rows = [j for j, (shard, _) in enumerate(ranked) if shard == name]
+            vectors[rows] = floats[name].rows(np.array([ranked[j][1] for j in rows], dtype=np.int64))
+        results.append(([stores[name].get(position) for name, position in ranked], embedding, vectors))
+
+    metrics.observe_stage("index_search", time.perf_counter() - search_start, search_start)
+    return results
+
+def search_sync(query: str, n_results: int, document_id: str = None, nprobe: int = None, ef_search: int = None) -> Tuple[List[Tuple[str, Dict]], np.ndarray, np.ndarray]:
+    """Blocking implementation of search_documents for a single query"""
+    return search_batch_sync([(query, n_results, document_id, nprobe, ef_search)])[0]
+
+# Coalesces concurrent search_documents calls into batched searches
+query_batcher = QueryBatcher(search_batch_sync, "query", config.QUERY_BATCH_WINDOW_MS, config.QUERY_BATCH_MAX)
+
+async def search_documents(query: str, n_results: int = 3, document_id: str = None, nprobe: int = None, ef_search: int = None, return_vectors: bool = False):
     """
     Search for relevant documents using the query
     Args:
         query: The search query
         n_results: Number of results to return
         document_id: Optional document ID to filter results
-    Returns list of (text, metadata) tuples
+        nprobe: Optional number of IVF lists to probe (IVF backends)
+        ef_search: Optional HNSW search depth (HNSW backend)
+        return_vectors: Also return the normalized query embedding and the
+            stored vector of each result
+    Returns list of (text, metadata) tuples, or a (results, embedding, vectors)
+    tuple when return_vectors is set
     """
-    if index.ntotal == 0:
-        return []
-    
-    # Generate query embedding and normalize
-    query_embedding = model.encode([query])[0]
-    query_embedding = normalize_vectors(query_embedding.reshape(1, -1))
-    
-    # Search in FAISS index
-    scores, indices = index.search(query_embedding.astype(np.float32), index.ntotal)
-    
-    # Get all results and filter by document_id if provided
-    results = []
-    seen_indices = set()
-    
-    for idx in indices[0]:
-        # Skip if we've seen this index or score is 0
-        if idx in seen_indices or scores[0][len(seen_indices)] <= 0:
-            continue
-            
-        # Get document and metadata
-        doc = documents[idx]
-        meta = metadatas[idx]
-        
-        # Filter by document_id if provided
-        if document_id and meta.get('document_id') != document_id:
-            continue
-            
-        results.append((doc, meta))
-        seen_indices.add(idx)
-        
-        # Break if we have enough results
-        if len(results) >= n_results:
-            break
-    
+    await ensure_ready()
+    # Retrieval as the caller sees it, including time spent waiting for a batch
+    with metrics.stage("retrieval"):
+        if config.QUERY_BATCH_WINDOW_MS <= 0:
+            results, embedding, vectors = await run_blocking("query", search_sync, query, n_results, document_id, nprobe, ef_search)
+        else:
+            results, embedding, vectors = await query_batcher.submit(query, n_results, document_id, nprobe, ef_search)
+
+    if return_vectors:
+        return results, embedding, vectors
     return results
 
-# Try to load existing state on module import
-try:
-    load_state()
-except:
-    pass  # If loading fails, we'll start with empty storage 
\ No newline at end of file
+# Index gauges, read from the loaded shards when metrics are collected
+metrics.Gauge(
+    "rag_index_vectors", "Vectors in each shard's index, deleted ones included until compacted",
+    lambda: {(name,): shard.index.ntotal for name, shard in list(shards.items())}, ("shard",),
+)
+metrics.Gauge(
+    "rag_index_deleted_vectors", "Tombstoned vectors in each shard's index, awaiting compaction",
+    lambda: {(name,): shard.tombstone_count for name, shard in list(shards.items())}, ("shard",),
+)
+metrics.Gauge(
+    "rag_chunks", "Chunks in each shard's chunk store",
+    lambda: {(name,): len(shard.chunks) for name, shard in list(shards.items())}, ("shard",),
+)
+metrics.Gauge("rag_documents_indexed", "Documents with chunks in the index", lambda: len(placement))
+
+def initialize(timings: Dict[str, float] = None) -> None:
+    """
+    Load the embedding model and the stored shards. Runs once, on first use or
+    when the service container warms up; later calls return immediately.
+    Args:
+        timings: Optional dict receiving the seconds spent on each step
+    """
+    global embedder, EMBEDDING_DIM, embedding_cache, initialized, follow_thread
+
+    if initialized:
+        return
+    with init_lock:
+        if initialized:
+            return
+        timings = timings if timings is not None else {}
+
+        start = time.perf_counter()
+        embedder = create_embedder(config.EMBEDDING_BACKEND, config.EMBEDDING_MODEL)
+        EMBEDDING_DIM = embedder.dimension
+        timings['embedding_model'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        os.makedirs(config.VECTOR_DB_DIR, exist_ok=True)
+        embedding_cache = EmbeddingCache(os.path.join(config.VECTOR_DB_DIR, 'embeddings.sqlite'), embedder.name)
+
+        if claim_role() == "writer":
+            migrate_single_store()
+            # Shards stored earlier stay searchable even if INDEX_SHARDS was lowered since
+            names = sorted(set(stored_shard_names()) | {shard_name(i) for i in range(config.INDEX_SHARDS)})
+            for shard in open_shards(names):
+                try:
+                    shard.load()
+                except:
+                    pass  # If loading fails, the shard starts with empty storage
+            rebuild_placement()
+        else:
+            # Readers map the writer's current generations, then keep following them
+            follow_shards()
+            follow_thread = threading.Thread(target=follow_writer, name="vector-store-follow", daemon=True)
+            follow_thread.start()
+        timings['index_load'] = time.perf_counter() - start
+
+        initialized = True
+
+async def ensure_ready() -> None:
+    """Initialize the vector store on a worker thread if that has not happened yet"""
+    if not initialized:
+        await run_blocking("embed", initialize)
@@ -0,0 +1,63 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, Dict, Any
+from backend import config
+
+# Pools for blocking work, created on first use:
+#   parse - PDF text extraction (thread or process pool, PARSE_POOL_KIND)
+#   embed - embedding and index writes during ingestion
+#   query - query embedding and index search
+#   shard - per-shard searches a query fans out to, from a query pool thread
+# Keeping ingestion and queries on separate pools means a long upload cannot
+# occupy the threads that serve searches.
+executors: Dict[str, Executor] = {}
+slots: Dict[str, asyncio.Semaphore] = {}
+
+def pool_sizes() -> Dict[str, int]:
+    return {
+        "parse": config.PARSE_POOL_SIZE,
+        "embed": config.EMBED_POOL_SIZE,
+        "query": config.QUERY_POOL_SIZE,
+        "shard": config.SHARD_POOL_SIZE,
+    }
+
+def get_executor(pool: str) -> Executor:
+    if pool not in executors:
+        size = pool_sizes()[pool]
+        if pool == "parse" and config.PARSE_POOL_KIND == "process":
+            # spawn rather than fork: the parent holds threads and the model
+            executors[pool] = ProcessPoolExecutor(max_workers=size, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            executors[pool] = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"{pool}-worker")
+    return executors[pool]
+
+def get_slots(pool: str) -> asyncio.Semaphore:
+    if pool not in slots:
+        slots[pool] = asyncio.Semaphore(pool_sizes()[pool] + config.POOL_MAX_PENDING)
+    return slots[pool]
+
+async def run_blocking(pool: str, fn: Callable, *args, **kwargs) -> Any:
+    """
+    Run fn(*args, **kwargs) on the named pool without blocking the event loop.
+    At most the pool size plus POOL_MAX_PENDING tasks are submitted at once;
+    further callers wait here, applying backpressure to uploads and queries.
+    For the process-backed parse pool, fn and its arguments must be picklable.
+    On thread pools fn sees the caller's context variables, e.g. its trace.
+    """
+    async with get_slots(pool):
+        loop = asyncio.get_running_loop()
+        executor = get_executor(pool)
+        call = functools.partial(fn, *args, **kwargs)
+        if not isinstance(executor, ProcessPoolExecutor):
+            call = functools.partial(contextvars.copy_context().run, call)
+        return await loop.run_in_executor(executor, call)
+
+def shutdown_pools() -> None:
+    """Stop all pools, waiting for running tasks to finish"""
+    for executor in executors.values():
+        executor.shutdown(wait=True)
+    executors.clear()
+    slots.clear()
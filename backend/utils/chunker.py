@@ -1,48 +1,191 @@
-from typing import List
+from dataclasses import dataclass
+from typing import List, Tuple
 import re
+import numpy as np
 
-def chunk_text(text: str, target_size: int = 500, overlap: int = 50) -> List[str]:
+# Where a sentence or paragraph ends: the next sentence starts at the end of the match
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+|\n\s*\n')
+
+# Without a model tokenizer, tokens are runs of word characters (ASCII letters,
+# digits and underscores, or any non-ASCII character) and single punctuation marks
+ASCII_WORD = np.array([chr(code).isalnum() or chr(code) == '_' for code in range(128)])
+SPACE_CODES = np.array([ord(c) for c in " \t\n\r\x0b\x0c\x85\xa0\u2028\u2029\u3000"], dtype=np.uint32)
+
+# Pages are chunked as one stream, joined by a space: a page break only ends a
+# chunk where a sentence ends, so sentences running over it stay whole
+PAGE_SEPARATOR = " "
+
+@dataclass
+class Chunk:
+    """
+    A chunk of page text. It covers the text of page_number from start_char up
+    to end_char of end_page, so a chunk running over a page break ends on a
+    later page than it starts; text is exactly that slice of the pages.
+    """
+    text: str
+    page_number: int
+    start_char: int
+    end_page: int
+    end_char: int
+    tokens: int
+
+class Chunker:
     """
-    Split text into chunks of approximately target_size tokens with overlap.
-    Uses sentence boundaries where possible to create more natural chunks.
+    Splits a stream of page texts into chunks of at most max_tokens tokens,
+    counted with the embedding model's tokenizer, so no chunk is cut short by
+    the model's sequence limit.
+
+    Each text is tokenized once, with token character offsets. Chunks end on
+    the last sentence boundary that fits (or the last word that fits, for a
+    sentence longer than max_tokens), and the next chunk starts on the first
+    sentence boundary within the last overlap_tokens tokens of the previous
+    one. Boundaries are found by binary search over token offsets, so the work
+    is linear in the text.
+
+    Pages are fed in order and may be chunked together: a chunk can run over
+    a page break. The unfinished end of the stream is kept until more pages are
+    fed or finish is called.
+    Kept free of service imports so it can run in a separate worker process.
     """
-    # Clean and normalize text
-    text = text.replace('\n', ' ').strip()
-    text = re.sub(r'\s+', ' ', text)
-    
-    # Split into sentences
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    
-    chunks = []
-    current_chunk = []
-    current_size = 0
-    
-    for sentence in sentences:
-        # Rough token count (words + punctuation)
-        sentence_size = len(sentence.split())
-        
-        # If adding this sentence would exceed target size, save current chunk
-        if current_size + sentence_size > target_size and current_chunk:
-            chunks.append(' '.join(current_chunk))
-            
-            # Keep last few sentences for overlap
-            overlap_tokens = 0
-            overlap_chunk = []
-            
-            for s in reversed(current_chunk):
-                overlap_tokens += len(s.split())
-                if overlap_tokens >= overlap:
+
+    def __init__(self, tokenizer=None, max_tokens: int = 256, overlap_tokens: int = 0):
+        """
+        Args:
+            tokenizer: A tokenizers.Tokenizer without truncation, or None to
+                count words and punctuation marks instead. Its pre-tokenizer
+                must split on whitespace, as BERT-style tokenizers do, since
+                pages are encoded separately
+            max_tokens: Largest chunk, in tokens
+            overlap_tokens: Tokens the next chunk may repeat from the end of the previous one
+        """
+        if max_tokens < 1:
+            raise ValueError("max_tokens must be at least 1")
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = max(overlap_tokens, 0)
+        # Text not chunked yet: (page number, offset of the text in its page, text)
+        self.pending: List[Tuple[int, int, str]] = []
+
+    def token_spans(self, texts: List[str], text_starts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Start and end character offsets of each token of texts, which start at
+        text_starts in the stream. The model tokenizer encodes the texts in one
+        batch, in parallel.
+        """
+        if self.tokenizer is None:
+            text = PAGE_SEPARATOR.join(texts)
+            codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+            space = np.isin(codes, SPACE_CODES)
+            word = np.where(codes < 128, ASCII_WORD[np.minimum(codes, 127)], ~space)
+            punctuation = ~space & ~word
+            starts = np.flatnonzero(punctuation | (word & ~np.concatenate(([False], word[:-1]))))
+            ends = np.flatnonzero(punctuation | (word & ~np.concatenate((word[1:], [False])))) + 1
+            return starts.astype(np.int64), ends.astype(np.int64)
+
+        encodings = self.tokenizer.encode_batch(texts, add_special_tokens=False)
+        spans = [np.array(encoding.offsets, dtype=np.int64).reshape(-1, 2) + start for encoding, start in zip(encodings, text_starts)]
+        spans = np.concatenate(spans)
+        return spans[:, 0], spans[:, 1]
+
+    def feed(self, pages: List[Tuple[int, str]]) -> List[Chunk]:
+        """
+        Add page texts, in page order, and return the chunks completed so far
+        Args:
+            pages: [(page_number, text), ...]
+        """
+        self.pending.extend((page_number, 0, text) for page_number, text in pages)
+        return self.split(final=False)
+
+    def finish(self) -> List[Chunk]:
+        """Return the chunks of the text fed but not chunked yet, ending the stream"""
+        return self.split(final=True)
+
+    def split(self, final: bool) -> List[Chunk]:
+        if not self.pending:
+            return []
+        texts = [page_text for _, _, page_text in self.pending]
+        text = PAGE_SEPARATOR.join(texts)
+        page_starts = np.cumsum([0] + [len(page_text) + len(PAGE_SEPARATOR) for page_text in texts[:-1]])
+
+        starts, ends = self.token_spans(texts, page_starts)
+        n = len(starts)
+        # Token index at which each sentence starts
+        boundaries = np.unique(np.searchsorted(starts, [match.end() for match in SENTENCE_END.finditer(text)]))
+        boundaries = boundaries[(boundaries > 0) & (boundaries < n)]
+        if final:
+            boundaries = np.append(boundaries, n)
+        # Tokens starting a word, where a sentence longer than max_tokens is cut
+        # rather than between the pieces of a word
+        word_starts = np.flatnonzero(starts[1:] > ends[:-1]) + 1
+
+        def locate(char: int) -> Tuple[int, int]:
+            # (pending index, offset in that page's text) of a stream character
+            page = int(np.searchsorted(page_starts, char, side='right')) - 1
+            return page, int(char - page_starts[page]) + self.pending[page][1]
+
+        chunks = []
+        start = 0
+        while start < n:
+            limit = start + self.max_tokens
+            if limit >= n:
+                if not final:
+                    # More text may still join this chunk
                     break
-                overlap_chunk.insert(0, s)
-            
-            current_chunk = overlap_chunk
-            current_size = sum(len(s.split()) for s in current_chunk)
-        
-        current_chunk.append(sentence)
-        current_size += sentence_size
-    
-    # Add the last chunk if it's not empty
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
-    
-    return chunks 
\ No newline at end of file
+                end = n
+            else:
+                fitting = int(np.searchsorted(boundaries, limit, side='right')) - 1
+                if fitting >= 0 and boundaries[fitting] > start:
+                    end = int(boundaries[fitting])
+                else:
+                    fitting = int(np.searchsorted(word_starts, limit, side='right')) - 1
+                    end = int(word_starts[fitting]) if fitting >= 0 and word_starts[fitting] > start else limit
+
+            first_char = int(starts[start])
+            last_char = int(ends[end - 1])
+            first_page, start_char = locate(first_char)
+            last_page, end_char = locate(last_char - 1)
+            chunks.append(Chunk(
+                text=text[first_char:last_char],
+                page_number=self.pending[first_page][0],
+                start_char=start_char,
+                end_page=self.pending[last_page][0],
+                end_char=end_char + 1,
+                tokens=end - start,
+            ))
+            if end >= n:
+                start = n
+                break
+
+            # Overlap from the first sentence boundary within the last overlap_tokens
+            next_start = end
+            if self.overlap_tokens:
+                candidate = int(np.searchsorted(boundaries, end - self.overlap_tokens, side='left'))
+                if candidate < len(boundaries) and start < boundaries[candidate] < end:
+                    next_start = int(boundaries[candidate])
+            start = next_start
+
+        # Keep the unfinished text, from the first token not yet chunked
+        if start >= n:
+            self.pending = []
+        else:
+            page, offset = locate(int(starts[start]))
+            page_number, page_offset, page_text = self.pending[page]
+            self.pending = [(page_number, offset, page_text[offset - page_offset:])] + self.pending[page + 1:]
+        return chunks
+
+def chunk_pages(pages: List[Tuple[int, str]], tokenizer=None, max_tokens: int = 256, overlap_tokens: int = 0) -> List[Chunk]:
+    """
+    Split page texts into token-sized chunks in one pass (see Chunker)
+    Args:
+        pages: [(page_number, text), ...] in page order
+        tokenizer: A tokenizers.Tokenizer without truncation, or None to count words
+        max_tokens: Largest chunk, in tokens
+        overlap_tokens: Tokens a chunk may repeat from the end of the previous one
+    Returns the chunks in text order
+    """
+    chunker = Chunker(tokenizer, max_tokens, overlap_tokens)
+    return chunker.feed(pages) + chunker.finish()
+
+def chunk_text(text: str, tokenizer=None, max_tokens: int = 256, overlap_tokens: int = 0) -> List[str]:
+    """Split a single text into chunks of at most max_tokens tokens"""
+    return [chunk.text for chunk in chunk_pages([(1, text)], tokenizer, max_tokens, overlap_tokens)]
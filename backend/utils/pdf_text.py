@@ -0,0 +1,36 @@
+from typing import List, Tuple
+import time
+import fitz  # PyMuPDF
+
+def extract_page_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """
+    Extract the text of pages [start, end) of a PDF (0-based), so large files
+    can be parsed a batch of pages at a time.
+    Kept free of service imports so it can run in a separate worker process.
+    Returns [(page_number, text), ...] with 1-based page numbers, skipping
+    pages without text
+    """
+    doc = fitz.open(file_path)
+    try:
+        pages = []
+        for page_num in range(start, min(end, len(doc))):
+            text = doc[page_num].get_text()
+            if text.strip():
+                pages.append((page_num + 1, text))
+        return pages
+    finally:
+        doc.close()
+
+def extract_page_range_timed(file_path: str, start: int, end: int) -> Tuple[List[Tuple[int, str]], float]:
+    """extract_page_range, also returning the seconds it took in the worker"""
+    started = time.perf_counter()
+    pages = extract_page_range(file_path, start, end)
+    return pages, time.perf_counter() - started
+
+def count_pages(file_path: str) -> int:
+    """Return the number of pages in a PDF"""
+    doc = fitz.open(file_path)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
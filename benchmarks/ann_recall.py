@@ -0,0 +1,119 @@
+"""
+Recall@k, latency and memory report for the vector index backends.
+
+Every backend is compared against the exact flat index on a synthetic,
+clustered set of normalized vectors shaped like MiniLM embeddings. Memory is
+the serialized index size, reported per million chunks. Quantized backends
+are also measured with exact float re-ranking of RERANK_FACTOR * k candidates.
+
+Usage:
+    python -m benchmarks.ann_recall --vectors 200000 --queries 500 --k 10
+"""
+import argparse
+import json
+import time
+import numpy as np
+import faiss
+from backend import config
+from backend.services.index_factory import INDEX_BACKENDS, build_index, search_params, is_quantized
+
+def synthetic_vectors(n: int, dim: int, n_clusters: int, rng: np.random.Generator) -> np.ndarray:
+    """Normalized vectors drawn around random cluster centres"""
+    centres = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, n_clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1)[:, np.newaxis]
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    """Fraction of the true top-k neighbours present in the returned top-k"""
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+def measure(index: faiss.Index, queries: np.ndarray, k: int, params, rerank_vectors: np.ndarray = None, rerank_factor: int = 1) -> tuple:
+    """
+    Search the queries one at a time, as the API does, returning (ids, mean ms).
+    With rerank_vectors, rerank_factor * k candidates are re-scored exactly.
+    """
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    start = time.perf_counter()
+    for i, query in enumerate(queries):
+        if rerank_vectors is None:
+            _, ids[i] = index.search(query.reshape(1, -1), k, params=params)
+        else:
+            _, candidates = index.search(query.reshape(1, -1), k * rerank_factor, params=params)
+            candidates = candidates[0][candidates[0] >= 0]
+            ids[i] = candidates[np.argsort(-(rerank_vectors[candidates] @ query))[:k]]
+    elapsed = time.perf_counter() - start
+    return ids, elapsed * 1000 / len(queries)
+
+def bytes_per_vector(index: faiss.Index) -> float:
+    return len(faiss.serialize_index(index)) / index.ntotal
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--rerank-factor", type=int, default=config.RERANK_FACTOR)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    vectors = synthetic_vectors(args.vectors, args.dim, 256, rng)
+    queries = synthetic_vectors(args.queries, args.dim, 256, rng)
+
+    # Keep the IVF list count sensible for small benchmark corpora
+    config.IVF_NLIST = min(config.IVF_NLIST, max(1, args.vectors // 39))
+
+    results = []
+    truth = None
+    for backend in INDEX_BACKENDS:
+        start = time.perf_counter()
+        index = build_index(backend, vectors)
+        build_s = time.perf_counter() - start
+        mb_per_million = bytes_per_vector(index) * 1_000_000 / 2 ** 20
+
+        if backend in ("flat", "sq8"):
+            knobs = [None]
+        elif backend == "hnsw":
+            knobs = args.ef_search
+        else:
+            knobs = args.nprobe
+
+        for knob in knobs:
+            if backend == "hnsw":
+                params = search_params(index, ef_search=knob)
+            else:
+                params = search_params(index, nprobe=knob)
+            # Quantized backends are measured as stored and with float re-ranking
+            variants = [(backend, None)]
+            if is_quantized(index):
+                variants.append((backend + "+rerank", vectors))
+
+            for name, rerank_vectors in variants:
+                ids, latency_ms = measure(index, queries, args.k, params, rerank_vectors, args.rerank_factor)
+                if truth is None:
+                    truth = ids
+                results.append({
+                    "backend": name,
+                    "knob": knob,
+                    "recall": round(recall_at_k(ids, truth), 4),
+                    "latency_ms": round(latency_ms, 4),
+                    "build_s": round(build_s, 2),
+                    "mb_per_million": round(mb_per_million, 1),
+                })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.vectors} vectors, {args.queries} queries, recall@{args.k} vs flat")
+    print(f"{'backend':<16}{'knob':>8}{'recall':>10}{'ms/query':>12}{'build s':>10}{'MB/1M':>10}")
+    for row in results:
+        knob = "-" if row["knob"] is None else row["knob"]
+        print(f"{row['backend']:<16}{knob:>8}{row['recall']:>10.4f}{row['latency_ms']:>12.4f}{row['build_s']:>10.2f}{row['mb_per_million']:>10.1f}")
+
+if __name__ == "__main__":
+    main()
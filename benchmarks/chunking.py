@@ -0,0 +1,162 @@
+"""
+Chunking throughput and chunk sizes: the token-sized chunker against the two
+chunkers it replaced, on a synthetic corpus of PDF-like pages.
+
+    ingestion_chunk_text  per page, up to 500 words, split on '.', no overlap
+    overlap_chunk_text    per page, up to 500 words on sentence boundaries,
+                          with 50 words of overlap
+    chunker_words         one stream of pages, sized in words and punctuation
+    chunker_model         one stream of pages, sized in the embedding model's tokens
+
+Chunk sizes are measured in model tokens; chunks longer than the model's
+sequence length are truncated when embedded, losing their tail.
+
+Usage:
+    python -m benchmarks.chunking --pages 500 2000 --json
+"""
+import argparse
+import json
+import re
+import time
+from typing import List
+import numpy as np
+from backend import config
+from backend.services.embedders import create_embedder
+from backend.utils.chunker import chunk_pages
+
+def ingestion_chunk_text(text: str, max_chunk_size: int = 500) -> List[str]:
+    """The chunker document ingestion used before, kept as a baseline"""
+    sentences = text.replace('\n', ' ').split('.')
+    sentences = [s.strip() + '.' for s in sentences if s.strip()]
+
+    chunks = []
+    current_chunk = []
+    current_size = 0
+    for sentence in sentences:
+        sentence_size = len(sentence.split())
+        if current_size + sentence_size > max_chunk_size:
+            if current_chunk:
+                chunks.append(' '.join(current_chunk))
+            current_chunk = [sentence]
+            current_size = sentence_size
+        else:
+            current_chunk.append(sentence)
+            current_size += sentence_size
+    if current_chunk:
+        chunks.append(' '.join(current_chunk))
+    return chunks
+
+def overlap_chunk_text(text: str, target_size: int = 500, overlap: int = 50) -> List[str]:
+    """The overlapping chunker in utils/chunker.py before, kept as a baseline"""
+    text = text.replace('\n', ' ').strip()
+    text = re.sub(r'\s+', ' ', text)
+    sentences = re.split(r'(?<=[.!?])\s+', text)
+
+    chunks = []
+    current_chunk = []
+    current_size = 0
+    for sentence in sentences:
+        sentence_size = len(sentence.split())
+        if current_size + sentence_size > target_size and current_chunk:
+            chunks.append(' '.join(current_chunk))
+            overlap_tokens = 0
+            overlap_chunk = []
+            for s in reversed(current_chunk):
+                overlap_tokens += len(s.split())
+                if overlap_tokens >= overlap:
+                    break
+                overlap_chunk.insert(0, s)
+            current_chunk = overlap_chunk
+            current_size = sum(len(s.split()) for s in current_chunk)
+        current_chunk.append(sentence)
+        current_size += sentence_size
+    if current_chunk:
+        chunks.append(' '.join(current_chunk))
+    return chunks
+
+def synthetic_pages(n: int, rng: np.random.Generator) -> list:
+    """
+    Pages of about 400 words in lines of up to 12 words, like PDF text: prose
+    sentences with a few long unpunctuated runs (tables, lists), and sentences
+    running over page breaks
+    """
+    vocabulary = (
+        "the system reports pressure temperature and flow for each unit during "
+        "normal operation while maintenance records list the replaced parts and "
+        "their serial numbers together with inspection notes and test results "
+        "AB-1234 12.5% kPa 2024-03-01 (see section 4.2)"
+    ).split()
+    pages = []
+    for page_number in range(1, n + 1):
+        words = []
+        while len(words) < 400:
+            length = rng.integers(150, 300) if rng.random() < 0.05 else rng.integers(5, 40)
+            sentence = list(rng.choice(vocabulary, length))
+            sentence[-1] += rng.choice([".", ".", ".", "?", ";"])
+            words.extend(sentence)
+        lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+        pages.append((page_number, "\n".join(lines)))
+    return pages
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[500, 2000], help="Corpus sizes, in pages")
+    parser.add_argument("--max-tokens", type=int, default=config.CHUNK_MAX_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=config.CHUNK_OVERLAP_TOKENS)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    config.EMBEDDING_CHECK = False
+    embedder = create_embedder(config.EMBEDDING_BACKEND, config.EMBEDDING_MODEL)
+    tokenizer = embedder.tokenizer
+    window = embedder.max_seq_length
+    special_tokens = tokenizer.num_special_tokens_to_add(False) if tokenizer is not None else 2
+    max_tokens = min(args.max_tokens, window - special_tokens)
+
+    def model_tokens(texts: List[str]) -> np.ndarray:
+        # Special tokens included, as the model sees each chunk
+        if tokenizer is None:
+            return np.array([len(text.split()) for text in texts]) + special_tokens
+        return np.array([len(encoding.ids) for encoding in tokenizer.encode_batch(texts)])
+
+    chunkers = {
+        "ingestion_chunk_text": lambda pages: [chunk for _, text in pages for chunk in ingestion_chunk_text(text)],
+        "overlap_chunk_text": lambda pages: [chunk for _, text in pages for chunk in overlap_chunk_text(text)],
+        "chunker_words": lambda pages: [chunk.text for chunk in chunk_pages(pages, None, max_tokens, args.overlap_tokens)],
+    }
+    if tokenizer is not None:
+        chunkers["chunker_model"] = lambda pages: [chunk.text for chunk in chunk_pages(pages, tokenizer, max_tokens, args.overlap_tokens)]
+
+    results = []
+    for page_count in args.pages:
+        pages = synthetic_pages(page_count, np.random.default_rng(42))
+        megabytes = sum(len(text.encode('utf-8')) for _, text in pages) / 1e6
+        for name, chunker in chunkers.items():
+            start = time.perf_counter()
+            chunks = chunker(pages)
+            elapsed = time.perf_counter() - start
+
+            tokens = model_tokens(chunks)
+            results.append({
+                "chunker": name,
+                "pages": page_count,
+                "mb": round(megabytes, 2),
+                "seconds": round(elapsed, 4),
+                "mb_per_s": round(megabytes / elapsed, 2),
+                "chunks": len(chunks),
+                "mean_tokens": round(float(tokens.mean()), 1),
+                "max_tokens": int(tokens.max()),
+                "truncated": round(float((tokens > window).mean()), 4),
+            })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"Chunk sizes in {'model' if tokenizer is not None else 'word'} tokens; the model reads {window}")
+    print(f"{'chunker':<24}{'pages':>8}{'MB/s':>10}{'chunks':>9}{'mean tok':>10}{'max tok':>9}{'truncated':>11}")
+    for row in results:
+        print(f"{row['chunker']:<24}{row['pages']:>8}{row['mb_per_s']:>10.2f}{row['chunks']:>9}{row['mean_tokens']:>10.1f}{row['max_tokens']:>9}{row['truncated']:>11.1%}")
+
+if __name__ == "__main__":
+    main()
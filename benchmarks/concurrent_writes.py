@@ -0,0 +1,244 @@
+"""
+Consistency and search latency of the index shards under concurrent writes.
+
+Writer threads add synthetic documents to the shards, delete some of them and
+trigger compactions (including purges of deleted chunks), while reader threads
+keep searching every shard. Each chunk's vector is derived from its text, and
+each text holds a term unique to the chunk, so every search result can be
+checked against the shard generation it was read from:
+
+    dense    every hit's score is its query's similarity to the vector derived
+             from the hit's text: the vector and text at a position belong
+             together, and the text is readable
+    lexical  every BM25 hit for a chunk's unique term holds that term
+    visible  a chunk committed before a search started is found by its vector
+             and by its unique term
+    deleted  no hit belongs to a document whose deletion finished before the
+             search started
+
+Any violation is a bug, and makes the exit status 1. Search latency is
+reported with and without the writers, showing how long searches wait on
+writes. The visible check expects exact search, so it runs on the flat backend.
+
+Usage:
+    python -m benchmarks.concurrent_writes --seconds 20 --writers 2 --readers 4 --json
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+import numpy as np
+
+# Few segments and deletions trigger a compaction, so searches often cross a
+# generation swap; set before the store reads its config
+os.environ.setdefault("INDEX_BACKEND", "flat")
+os.environ.setdefault("COMPACT_SEGMENTS", "8")
+os.environ.setdefault("COMPACT_TOMBSTONE_RATIO", "0.1")
+os.environ["VECTOR_DB_DIR"] = tempfile.mkdtemp(prefix="bench-concurrent-writes-")
+
+from backend import config
+from backend.services.shard import Shard
+
+VOCABULARY = np.array([f"word{i}" for i in range(2000)])
+
+def chunk_vector(text: str, dim: int) -> np.ndarray:
+    """The unit vector of a chunk, derived from its text"""
+    vector = np.random.default_rng(zlib.crc32(text.encode('utf-8'))).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+def chunk_term(document_id: str, i: int) -> str:
+    return f"{document_id.replace('-', '')}c{i}"
+
+class Store:
+    """The shards under test and what writers have committed to them"""
+
+    def __init__(self, n_shards: int, dim: int):
+        self.dim = dim
+        self.shards = []
+        for number in range(n_shards):
+            shard = Shard(f"shard-{number:03d}", os.path.join(config.VECTOR_DB_DIR, f"shard-{number:03d}"), dim)
+            shard.load()
+            self.shards.append(shard)
+        self.lock = threading.Lock()
+        # (document_id, chunk text, unique term) of every chunk committed
+        self.committed = []
+        # Documents whose deletion has started, and those whose deletion finished
+        self.deleting = set()
+        self.deleted = set()
+        self.documents_added = 0
+        self.chunks_added = 0
+        # Exceptions that ended a writer or compaction thread
+        self.thread_errors = []
+        threading.excepthook = lambda hook: self.thread_errors.append(f"{hook.exc_type.__name__} in {hook.thread.name}: {hook.exc_value}")
+
+    def shard_of(self, document_id: str) -> Shard:
+        return self.shards[zlib.crc32(document_id.encode('utf-8')) % len(self.shards)]
+
+    def add_document(self, document_id: str, n_chunks: int, rng: random.Random) -> None:
+        terms = [chunk_term(document_id, i) for i in range(n_chunks)]
+        texts = [f"{term} " + " ".join(rng.choices(VOCABULARY, k=30)) for term in terms]
+        vectors = np.stack([chunk_vector(text, self.dim) for text in texts])
+        metadatas = [{"page_number": 1, "document_id": document_id} for _ in texts]
+
+        shard = self.shard_of(document_id)
+        if shard.add_embeddings(vectors, texts, metadatas, [str(uuid.uuid4()) for _ in texts]):
+            shard.schedule_compaction()
+        with self.lock:
+            self.committed.extend(zip([document_id] * n_chunks, texts, terms))
+            self.documents_added += 1
+            self.chunks_added += n_chunks
+
+    def delete_document(self, document_id: str) -> None:
+        with self.lock:
+            self.deleting.add(document_id)
+        shard = self.shard_of(document_id)
+        if shard.delete_document(document_id):
+            shard.schedule_compaction()
+        with self.lock:
+            self.deleted.add(document_id)
+
+    def generations(self) -> int:
+        return sum(shard.manifest['base'] or 0 for shard in self.shards)
+
+def writer(store: Store, number: int, max_chunks: int, delete_ratio: float, stop: threading.Event) -> None:
+    rng = random.Random(number)
+    owned = []
+    added = 0
+    while not stop.is_set():
+        document_id = f"w{number}-{added}"
+        added += 1
+        store.add_document(document_id, rng.randint(1, max_chunks), rng)
+        owned.append(document_id)
+        if rng.random() < delete_ratio:
+            store.delete_document(owned.pop(rng.randrange(len(owned) - 1)) if len(owned) > 1 else owned.pop())
+
+def reader(store: Store, number: int, batch: int, k: int, stop: threading.Event, latencies: list, violations: Counter, examples: list) -> None:
+    rng = random.Random(1000 + number)
+
+    def violation(kind: str, detail: str) -> None:
+        violations[kind] += 1
+        if len(examples) < 10:
+            examples.append(f"{kind}: {detail}")
+
+    while not stop.is_set():
+        with store.lock:
+            targets = rng.sample(store.committed, min(batch, len(store.committed)))
+            deleted_before = set(store.deleted)
+        if not targets:
+            continue
+        queries = np.stack([chunk_vector(text, store.dim) for _, text, _ in targets])
+        tokens = [[term.lower()] for _, _, term in targets]
+
+        found_dense = [False] * len(targets)
+        found_lexical = [False] * len(targets)
+        for shard in store.shards:
+            try:
+                start = time.perf_counter()
+                chunks, _, hits = shard.search(queries, [(None, None, None)] * len(targets), [k] * len(targets), tokens)
+                latencies.append(time.perf_counter() - start)
+
+                for i, (scores, positions, lexical_scores, lexical_positions) in enumerate(hits):
+                    target_text = targets[i][1]
+                    for score, position in zip(scores.tolist(), positions.tolist()):
+                        text, meta = chunks.get(position)
+                        if meta['document_id'] in deleted_before:
+                            violation("deleted", f"{meta['document_id']} returned by {shard.name}")
+                        if abs(float(chunk_vector(text, store.dim) @ queries[i]) - score) > 1e-3:
+                            violation("dense", f"position {position} of {shard.name} scored {score:.4f} against another text")
+                        found_dense[i] |= text == target_text
+                    for position in lexical_positions.tolist():
+                        text, meta = chunks.get(position)
+                        if meta['document_id'] in deleted_before:
+                            violation("deleted", f"{meta['document_id']} returned by BM25 on {shard.name}")
+                        if tokens[i][0] not in text.lower().split():
+                            violation("lexical", f"position {position} of {shard.name} lacks {tokens[i][0]}")
+                        found_lexical[i] |= text == target_text
+            except Exception as e:
+                # A result pointing past the chunks stored, for instance
+                violation("error", f"{type(e).__name__} searching {shard.name}: {e}")
+
+        with store.lock:
+            deleting = set(store.deleting)
+        for i, (document_id, _, term) in enumerate(targets):
+            if document_id in deleting:
+                continue
+            if not found_dense[i]:
+                violation("visible", f"{term} not found by its vector")
+            if not found_lexical[i]:
+                violation("visible", f"{term} not found by BM25")
+
+def run_phase(store: Store, args, writers: int) -> dict:
+    stop = threading.Event()
+    latencies, violations, examples = [], Counter(), []
+    documents, chunks, generations = store.documents_added, store.chunks_added, store.generations()
+
+    threads = [threading.Thread(target=reader, args=(store, i, args.batch, args.k, stop, latencies, violations, examples)) for i in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(store, i, args.max_chunks, args.delete_ratio, stop)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    for error in store.thread_errors:
+        violations["thread"] += 1
+        examples.append(f"thread: {error}")
+    store.thread_errors.clear()
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "writers": writers,
+        "shard_searches": len(latencies),
+        "searches_per_s": round(len(latencies) / args.seconds, 1),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "max_ms": round(float(latencies_ms.max()), 3),
+        "documents_added": store.documents_added - documents,
+        "chunks_added": store.chunks_added - chunks,
+        "generations": store.generations() - generations,
+        "violations": dict(violations),
+        "examples": examples,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10.0, help="Duration of each phase")
+    parser.add_argument("--shards", type=int, default=2)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--initial-documents", type=int, default=200)
+    parser.add_argument("--max-chunks", type=int, default=256, help="Largest document, in chunks")
+    parser.add_argument("--delete-ratio", type=float, default=0.2, help="Chance a writer deletes a document after each add")
+    parser.add_argument("--batch", type=int, default=4, help="Queries per search")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    store = Store(args.shards, args.dim)
+    rng = random.Random(0)
+    for i in range(args.initial_documents):
+        store.add_document(f"initial-{i}", rng.randint(1, args.max_chunks), rng)
+
+    results = [run_phase(store, args, 0), run_phase(store, args, args.writers)]
+    failed = any(row["violations"] for row in results)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{args.shards} shards, {args.readers} readers, {args.seconds:.0f} s per phase")
+        print(f"{'writers':>8}{'searches/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'docs added':>12}{'generations':>13}  violations")
+        for row in results:
+            print(f"{row['writers']:>8}{row['searches_per_s']:>12.1f}{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}{row['max_ms']:>10.3f}{row['documents_added']:>12}{row['generations']:>13}  {row['violations'] or 'none'}")
+            for example in row["examples"]:
+                print(f"    {example}")
+    raise SystemExit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Embedding throughput (chunks/sec) for each embedding backend.
+
+Synthetic chunks of varied length are encoded in ingestion-sized calls. Each
+backend is also compared with sentence-transformers, reporting the lowest and
+mean cosine similarity between their embeddings.
+
+Usage:
+    python -m benchmarks.embedding_throughput --chunks 2000 --threads 4
+"""
+import argparse
+import json
+import time
+import numpy as np
+from backend import config
+from backend.services.embedders import EMBEDDING_BACKENDS, create_embedder
+
+def synthetic_chunks(n: int, rng: np.random.Generator) -> list:
+    """Chunks of 20 to 400 words, like pages split by chunk_text"""
+    vocabulary = (
+        "the system reports pressure temperature and flow for each unit during "
+        "normal operation while maintenance records list the replaced parts and "
+        "their serial numbers together with inspection notes and test results"
+    ).split()
+    return [" ".join(rng.choice(vocabulary, rng.integers(20, 400))) for _ in range(n)]
+
+def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--backends", nargs="+", choices=EMBEDDING_BACKENDS, default=list(EMBEDDING_BACKENDS))
+    parser.add_argument("--threads", type=int, default=config.EMBEDDING_THREADS, help="Inference threads, 0 for the runtime default")
+    parser.add_argument("--batch-size", type=int, default=config.EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--call-size", type=int, default=config.INGEST_BATCH_CHUNKS, help="Chunks per encode call")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    # Equivalence is measured below instead of checked at creation
+    config.EMBEDDING_CHECK = False
+    config.EMBEDDING_THREADS = args.threads
+    config.EMBEDDING_BATCH_SIZE = args.batch_size
+
+    texts = synthetic_chunks(args.chunks, np.random.default_rng(42))
+    reference = None
+    results = []
+    for backend in ["sentence_transformers"] + [b for b in args.backends if b != "sentence_transformers"]:
+        embedder = create_embedder(backend, config.EMBEDDING_MODEL)
+        embedder.encode(texts[:args.batch_size])  # warm up
+
+        start = time.perf_counter()
+        embeddings = np.concatenate([
+            embedder.encode(texts[i:i + args.call_size]) for i in range(0, len(texts), args.call_size)
+        ])
+        elapsed = time.perf_counter() - start
+
+        if reference is None:
+            reference = embeddings
+        similarity = cosine(embeddings, reference)
+        if backend in args.backends:
+            results.append({
+                "backend": backend,
+                "chunks_per_s": round(len(texts) / elapsed, 1),
+                "min_cosine": round(float(similarity.min()), 5),
+                "mean_cosine": round(float(similarity.mean()), 5),
+            })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.chunks} chunks, {args.threads or 'default'} threads, batch size {args.batch_size}, similarity vs sentence_transformers")
+    print(f"{'backend':<24}{'chunks/s':>12}{'min cos':>10}{'mean cos':>10}")
+    for row in results:
+        print(f"{row['backend']:<24}{row['chunks_per_s']:>12.1f}{row['min_cosine']:>10.5f}{row['mean_cosine']:>10.5f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""
+End-to-end benchmark of the whole app, reproducible on a laptop or in CI.
+
+Runs in a throwaway directory (vector store, uploads and database) and answers
+with a local stand-in for Gemini that replies after a fixed latency, so no API
+key or network is needed and results depend only on this code and machine.
+
+    corpus      synthetic chunks with random unit vectors, added through
+                vector_store.add_documents, to give queries an index of a
+                realistic size (10k to 10M chunks) without embedding it
+    index_load  opening the store in a fresh process, as a restarted server does
+    ingestion   synthetic PDFs uploaded through POST /api/upload and polled
+                through GET /api/jobs until indexed: parsing, chunking,
+                embedding and index writes
+    queries     POST /api/query from a fixed number of concurrent clients at
+                each concurrency level: retrieval, context assembly and the
+                stand-in LLM
+
+Each phase also reports the time spent in each stage, from the metrics the app
+records for /metrics. Results are written as JSON, with the commit and settings
+they were measured with; --compare prints the change of every number against a
+file saved from another commit.
+
+Usage:
+    python -m benchmarks.end_to_end --corpus-chunks 100000 --pdfs 20 --pages 50 --output results.json
+    python -m benchmarks.end_to_end --corpus-chunks 100000 --pdfs 20 --pages 50 --compare results.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+import numpy as np
+
+VOCABULARY = np.array([f"term{i}" for i in range(5000)])
+
+STUB_ANSWER = (
+    "Based on the provided context, the documents describe the requested terms "
+    "in several places; see the cited pages for the details."
+)
+
+class StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class StubModels:
+    """The async models API of the Gemini client, answering after latency seconds"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def generate_content(self, model, contents, config=None) -> StubResponse:
+        await asyncio.sleep(self.latency)
+        return StubResponse(STUB_ANSWER)
+
+    async def generate_content_stream(self, model, contents, config=None):
+        # The answer word by word, spread over the latency
+        words = STUB_ANSWER.split()
+
+        async def stream():
+            for word in words:
+                await asyncio.sleep(self.latency / len(words))
+                yield StubResponse(word + " ")
+        return stream()
+
+def stub_llm(latency: float) -> SimpleNamespace:
+    """A local stand-in for genai.Client"""
+    return SimpleNamespace(aio=SimpleNamespace(models=StubModels(latency)))
+
+def synthetic_sentences(n_words: int, rng: np.random.Generator) -> str:
+    """Sentences of 5 to 30 words drawn from VOCABULARY"""
+    words = []
+    while len(words) < n_words:
+        sentence = list(rng.choice(VOCABULARY, rng.integers(5, 31)))
+        sentence[-1] += "."
+        words.extend(sentence)
+    return " ".join(words[:n_words])
+
+def synthetic_pdf(pages: int, words_per_page: int, rng: np.random.Generator) -> bytes:
+    """A PDF of pages of text, different on every call"""
+    import fitz
+    document = fitz.open()
+    for _ in range(pages):
+        page = document.new_page()
+        page.insert_textbox(page.rect + (36, 36, -36, -36), synthetic_sentences(words_per_page, rng), fontsize=8)
+    data = document.tobytes()
+    document.close()
+    return data
+
+def memory_mb() -> dict:
+    """Current and peak resident set size of this process, in MiB"""
+    sizes = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "VmHWM"):
+                sizes["rss_mb" if name == "VmRSS" else "peak_rss_mb"] = round(int(value.split()[0]) / 1024, 1)
+    return sizes
+
+def git_commit() -> dict:
+    """The commit being measured, and whether the tree has uncommitted changes"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+def stage_totals(metrics) -> dict:
+    return {stage: totals for (stage,), totals in metrics.STAGE_SECONDS.totals().items()}
+
+def stage_summary(before: dict, after: dict) -> dict:
+    """Calls and mean milliseconds of each stage observed between two stage_totals"""
+    summary = {}
+    for stage, (count, seconds) in sorted(after.items()):
+        count -= before.get(stage, (0, 0.0))[0]
+        seconds -= before.get(stage, (0, 0.0))[1]
+        if count:
+            summary[stage] = {"count": count, "mean_ms": round(seconds / count * 1000, 3)}
+    return summary
+
+def latency_summary(latencies: list, elapsed: float) -> dict:
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "qps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2),
+    }
+
+def load_index(environment: dict) -> dict:
+    """Open the store in a fresh process and report how long it took"""
+    os.environ.update(environment)
+    from backend.services import vector_store
+    timings = {}
+    vector_store.initialize(timings)
+    return {
+        "seconds": round(timings["index_load"], 3),
+        "embedding_model_s": round(timings["embedding_model"], 3),
+        "chunks": sum(shard.index.ntotal for shard in vector_store.shards.values()),
+        **memory_mb(),
+    }
+
+async def build_corpus(vector_store, chunks: int, document_chunks: int, rng: np.random.Generator, batch_size: int = 10000) -> dict:
+    """Add synthetic chunks of document_chunks per document, with random unit vectors as embeddings"""
+    await vector_store.ensure_ready()
+    start = time.perf_counter()
+    for offset in range(0, chunks, batch_size):
+        count = min(batch_size, chunks - offset)
+        texts = [synthetic_sentences(60, rng) for _ in range(count)]
+        metadatas = [{"page_number": 1, "document_id": f"corpus-{(offset + i) // document_chunks}"} for i in range(count)]
+        embeddings = vector_store.normalize_vectors(rng.standard_normal((count, vector_store.EMBEDDING_DIM), dtype=np.float32))
+        await vector_store.add_documents(texts, metadatas, [str(uuid.uuid4()) for _ in range(count)], embeddings=embeddings)
+    elapsed = time.perf_counter() - start
+
+    # Let background compactions finish, so the index is loaded as it settles
+    for shard in vector_store.shards.values():
+        if shard.compaction_thread is not None:
+            shard.compaction_thread.join()
+    return {"chunks": chunks, "seconds": round(elapsed, 3), "chunks_per_s": round(chunks / elapsed, 1) if elapsed else None}
+
+async def ingest(client, pdfs: list, pages: int, metrics) -> dict:
+    """Upload the PDFs, 20 per request as the API allows, and wait until all are indexed"""
+    before = stage_totals(metrics)
+    start = time.perf_counter()
+    job_ids = []
+    for offset in range(0, len(pdfs), 20):
+        files = [("files", (f"synthetic-{offset + i}.pdf", data, "application/pdf")) for i, data in enumerate(pdfs[offset:offset + 20])]
+        response = await client.post("/api/upload", files=files)
+        response.raise_for_status()
+        job_ids.append(response.json()["job_id"])
+
+    jobs = []
+    for job_id in job_ids:
+        while True:
+            job = (await client.get(f"/api/jobs/{job_id}")).json()
+            if job["status"] in ("completed", "failed"):
+                jobs.append(job)
+                break
+            await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    total_pages = len(pdfs) * pages
+    failed = sum(document["status"] == "failed" for job in jobs for document in job["documents"])
+    return {
+        "pdfs": len(pdfs),
+        "pages": total_pages,
+        "chunks": sum(job["chunks_embedded"] for job in jobs),
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "pages_per_s": round(total_pages / elapsed, 1),
+        "stages": stage_summary(before, stage_totals(metrics)),
+    }
+
+async def run_level(client, queries: list, concurrency: int, metrics) -> dict:
+    """Run all queries from `concurrency` clients issuing one query at a time"""
+    before = stage_totals(metrics)
+    latencies = []
+    errors = 0
+    position = iter(range(len(queries)))
+
+    async def query_client():
+        nonlocal errors
+        for i in position:
+            start = time.perf_counter()
+            response = await client.post("/api/query", json={"query": queries[i]})
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*[query_client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "queries": len(queries),
+        "errors": errors,
+        **latency_summary(latencies, elapsed),
+        "stages": stage_summary(before, stage_totals(metrics)),
+    }
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    """Numbers of nested results, keyed by their dotted path"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def compare(baseline: dict, results: dict) -> None:
+    """Print every number measured in both runs, with its relative change"""
+    before = flatten({key: value for key, value in baseline.items() if key != "meta"})
+    after = flatten({key: value for key, value in results.items() if key != "meta"})
+    print(f"Baseline {baseline['meta']['commit']} against {results['meta']['commit']}")
+    settings, baseline_settings = results["meta"]["settings"], baseline["meta"]["settings"]
+    changed = sorted(key for key in settings.keys() | baseline_settings.keys() if settings.get(key) != baseline_settings.get(key))
+    if changed:
+        print(f"Settings differ, so the numbers may not be comparable: {', '.join(changed)}")
+    print(f"{'metric':<52}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name in sorted(before.keys() & after.keys()):
+        change = f"{(after[name] - before[name]) / before[name]:+.1%}" if before[name] else ""
+        print(f"{name:<52}{before[name]:>12g}{after[name]:>12g}{change:>10}")
+
+async def run(args, environment: dict) -> dict:
+    import httpx
+    from backend.main import app
+    from backend.services import metrics, vector_store
+    from backend.services.container import services
+
+    rng = np.random.default_rng(args.seed)
+    results = {}
+
+    if args.corpus_chunks:
+        results["corpus"] = await build_corpus(vector_store, args.corpus_chunks, args.corpus_document_chunks, rng)
+        # A fresh process, so the load is measured from disk rather than this one's state
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            results["index_load"] = pool.apply(load_index, (environment,))
+
+    services.use_genai_client(stub_llm(args.llm_latency_ms / 1000))
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            while (await client.get("/health/ready")).status_code != 200:
+                await asyncio.sleep(0.05)
+
+            if args.pdfs:
+                pdfs = [synthetic_pdf(args.pages, args.words_per_page, rng) for _ in range(args.pdfs)]
+                results["ingestion"] = await ingest(client, pdfs, args.pages, metrics)
+
+            results["queries"] = {}
+            for concurrency in args.concurrency:
+                queries = [synthetic_sentences(8, rng) for _ in range(args.queries)]
+                results["queries"][str(concurrency)] = await run_level(client, queries, concurrency, metrics)
+
+    results["memory"] = memory_mb()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus-chunks", type=int, default=10000, help="Synthetic chunks indexed before the other phases")
+    parser.add_argument("--corpus-document-chunks", type=int, default=1000, help="Chunks per synthetic corpus document; each document is written as one segment")
+    parser.add_argument("--pdfs", type=int, default=10, help="Synthetic PDFs uploaded and ingested")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per PDF (at most 1000)")
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--queries", type=int, default=200, help="Queries per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0, help="Latency of the stand-in LLM")
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the answer cache enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Results JSON of another run to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary directory")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    # A throwaway store, upload directory and database, so the benchmark never
+    # touches vector_db/ or documents.db; set before the app reads its config
+    workdir = tempfile.mkdtemp(prefix="bench-end-to-end-")
+    environment = {
+        "VECTOR_DB_DIR": os.path.join(workdir, "vector_db"),
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'documents.db')}",
+        "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY") or "benchmark-stand-in",
+        "ANSWER_CACHE_ENABLED": "true" if args.answer_cache else "false",
+        "MULTI_PROCESS": "false",
+    }
+    os.environ.update(environment)
+
+    try:
+        results = asyncio.run(run(args, environment))
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    from backend import config
+    settings = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "keep", "json")}
+    settings.update({
+        "index_backend": config.INDEX_BACKEND,
+        "index_shards": config.INDEX_SHARDS,
+        "embedding_backend": config.EMBEDDING_BACKEND,
+        "embedding_model": config.EMBEDDING_MODEL,
+        "query_batch_window_ms": config.QUERY_BATCH_WINDOW_MS,
+        "hybrid_search": config.HYBRID_SEARCH,
+        "context_reranker": config.CONTEXT_RERANKER,
+    })
+    results = {
+        "meta": {
+            **git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "settings": settings,
+        },
+        **results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+        return
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"Commit {results['meta']['commit']}, stand-in LLM latency {args.llm_latency_ms} ms")
+    if "corpus" in results:
+        corpus, load = results["corpus"], results["index_load"]
+        print(f"corpus      {corpus['chunks']} chunks in {corpus['seconds']:.2f} s ({corpus['chunks_per_s']:.0f} chunks/s)")
+        print(f"index_load  {load['seconds']:.3f} s, {load['rss_mb']:.0f} MiB resident after loading")
+    if "ingestion" in results:
+        ingestion = results["ingestion"]
+        print(f"ingestion   {ingestion['pages']} pages, {ingestion['chunks']} chunks in {ingestion['seconds']:.2f} s ({ingestion['pages_per_s']:.1f} pages/s)")
+    print(f"{'clients':>8}{'QPS':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for concurrency, row in results["queries"].items():
+        print(f"{concurrency:>8}{row['qps']:>10.1f}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['errors']:>8}")
+    print(f"memory      {results['memory']['rss_mb']:.0f} MiB resident, {results['memory']['peak_rss_mb']:.0f} MiB peak")
+
+if __name__ == "__main__":
+    main()
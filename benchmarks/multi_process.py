@@ -0,0 +1,108 @@
+"""
+Query throughput and memory per process when several worker processes search
+the same index, as with uvicorn --workers N.
+
+A synthetic index is written once as a base generation. Each worker process
+then either memory-maps it, as MULTI_PROCESS readers do, or reads a private
+copy, and runs single-query searches for a fixed time. Reported per worker
+count: total queries/s and the mean resident (RSS) and proportional (PSS)
+memory per process. PSS divides shared pages between the processes mapping
+them, so it shows what each extra worker really costs. Linux only.
+
+Usage:
+    python -m benchmarks.multi_process --vectors 200000 --workers 1 2 4 --backend flat
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import numpy as np
+import faiss
+from backend.services import segments
+from backend.services.index_factory import INDEX_BACKENDS, build_index
+from benchmarks.ann_recall import synthetic_vectors
+
+def memory_mb() -> dict:
+    """Resident and proportional set size of this process, in MiB"""
+    sizes = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("Rss", "Pss"):
+                sizes[name.lower()] = int(value.split()[0]) / 1024
+    return sizes
+
+def worker(db_dir: str, mmap: bool, queries: np.ndarray, k: int, seconds: float, barrier, results) -> None:
+    # One search thread per process, so throughput scales with processes only
+    faiss.omp_set_num_threads(1)
+    index = segments.read_base(db_dir, 1, mmap=mmap)
+    index.search(queries[:1], k)  # fault in the mapping before timing
+    barrier.wait()
+
+    done = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        index.search(queries[done % len(queries)].reshape(1, -1), k)
+        done += 1
+    results.put({"queries": done, **memory_mb()})
+    barrier.wait()  # Measure memory while every worker still maps the index
+
+def run(db_dir: str, mmap: bool, workers: int, queries: np.ndarray, k: int, seconds: float) -> dict:
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(db_dir, mmap, queries, k, seconds, barrier, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    return {
+        "mode": "mmap" if mmap else "copy",
+        "workers": workers,
+        "queries_per_s": round(sum(report["queries"] for report in reports) / seconds, 1),
+        "rss_mb": round(float(np.mean([report["rss"] for report in reports])), 1),
+        "pss_mb": round(float(np.mean([report["pss"] for report in reports])), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--backend", choices=INDEX_BACKENDS, default="flat")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    results = []
+    with tempfile.TemporaryDirectory() as db_dir:
+        index = build_index(args.backend, synthetic_vectors(args.vectors, args.dim, 100, rng))
+        segments.write_base(db_dir, 1, index)
+        index_mb = os.path.getsize(os.path.join(db_dir, "base-000001.faiss")) / 2**20
+        del index
+        queries = synthetic_vectors(1000, args.dim, 100, rng)
+
+        for mmap in (False, True):
+            for workers in args.workers:
+                results.append(run(db_dir, mmap, workers, queries, args.k, args.seconds))
+
+    if args.json:
+        print(json.dumps({"backend": args.backend, "index_mb": round(index_mb, 1), "results": results}, indent=2))
+        return
+
+    print(f"{args.backend} index of {args.vectors} vectors, {index_mb:.1f} MiB, {args.seconds:.0f}s per run")
+    print(f"{'mode':<8}{'workers':>8}{'queries/s':>12}{'RSS MiB':>10}{'PSS MiB':>10}")
+    for row in results:
+        print(f"{row['mode']:<8}{row['workers']:>8}{row['queries_per_s']:>12.1f}{row['rss_mb']:>10.1f}{row['pss_mb']:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Query latency and throughput with and without micro-batching.
+
+Builds a temporary vector store of synthetic chunks, then issues queries
+through search_documents from a fixed number of concurrent clients and
+reports p50/p99 latency and QPS for each concurrency level.
+
+Usage:
+    python -m benchmarks.query_batching --chunks 20000 --queries 500 --concurrency 1 4 16 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import uuid
+import numpy as np
+
+def synthetic_texts(n: int, rng: np.random.Generator, words_per_text: int = 60) -> list:
+    vocabulary = [f"term{i}" for i in range(5000)]
+    return [" ".join(rng.choice(vocabulary, words_per_text)) for _ in range(n)]
+
+async def run_level(vector_store, queries: list, concurrency: int) -> dict:
+    """Run all queries from `concurrency` clients issuing one query at a time"""
+    latencies = []
+    position = iter(range(len(queries)))
+
+    async def client():
+        for i in position:
+            start = time.perf_counter()
+            await vector_store.search_documents(queries[i], 3)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "concurrency": concurrency,
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2),
+        "qps": round(len(queries) / elapsed, 1),
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--window-ms", type=float, default=2.0)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    # Use a throwaway store so the benchmark never touches vector_db/
+    os.environ["VECTOR_DB_DIR"] = tempfile.mkdtemp(prefix="bench-vector-db-")
+    from backend import config
+    from backend.services import vector_store
+
+    rng = np.random.default_rng(0)
+    texts = synthetic_texts(args.chunks, rng)
+    for start in range(0, len(texts), 1000):
+        batch = texts[start:start + 1000]
+        metadatas = [{"page_number": 1, "document_id": f"doc-{(start + i) // 100}"} for i in range(len(batch))]
+        await vector_store.add_documents(batch, metadatas, [str(uuid.uuid4()) for _ in batch])
+    queries = synthetic_texts(args.queries, rng, words_per_text=8)
+
+    results = []
+    for mode, window_ms in (("unbatched", 0), ("batched", args.window_ms)):
+        config.QUERY_BATCH_WINDOW_MS = window_ms
+        for concurrency in args.concurrency:
+            row = await run_level(vector_store, queries, concurrency)
+            row["mode"] = mode
+            results.append(row)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.chunks} chunks, {args.queries} queries per level, batch window {args.window_ms} ms")
+    print(f"{'mode':<11}{'clients':>8}{'p50 ms':>10}{'p99 ms':>10}{'QPS':>10}")
+    for row in results:
+        print(f"{row['mode']:<11}{row['concurrency']:>8}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['qps']:>10.1f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
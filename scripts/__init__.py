@@ -0,0 +1 @@
+# Initialize scripts package
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""
+Convert an existing vector store to another index backend in place, e.g. to
+store vectors as int8 (sq8) or PQ codes (ivf_pq).
+
+Each shard's index is rebuilt from its full-precision vectors and written as
+a new base generation. A store still in the single-file layout (vectors.faiss and
+metadata.json) is imported and rewritten in the current layout on the way.
+Set INDEX_BACKEND to the same backend afterwards so the server keeps it.
+Shards are opened with the dimension of their stored vectors, so no embedding
+model is loaded.
+
+Usage:
+    python -m scripts.convert_index --backend sq8 --db-dir vector_db
+"""
+import argparse
+import os
+import numpy as np
+from backend import config
+from backend.services.index_factory import INDEX_BACKENDS, index_backend, build_index
+from backend.services.shard import Shard, stored_dimension
+
+def file_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=INDEX_BACKENDS, required=True)
+    parser.add_argument("--db-dir", default=config.VECTOR_DB_DIR)
+    args = parser.parse_args()
+
+    db_dir = args.db_dir
+    legacy_size = file_size(os.path.join(db_dir, "vectors.faiss"))
+
+    # Configure the store before it is loaded
+    config.VECTOR_DB_DIR = db_dir
+    config.INDEX_BACKEND = args.backend
+    from backend.services import vector_store
+    if vector_store.claim_role() != "writer":
+        print(f"Another process is writing to {db_dir}, stop the server first")
+        return
+    vector_store.migrate_single_store()
+
+    total = 0
+    base_size = 0
+    for name in vector_store.stored_shard_names():
+        path = os.path.join(db_dir, vector_store.SHARDS_DIR, name)
+        dim = stored_dimension(path)
+        if dim is None:
+            continue
+        shard = Shard(name, path, dim)
+        shard.load()
+
+        # Loading migrates flat indexes to the configured backend by itself; let a
+        # compaction it started finish before rewriting the base
+        if shard.compaction_thread is not None:
+            shard.compaction_thread.join()
+
+        count = shard.index.ntotal
+        if count == 0:
+            continue
+
+        if index_backend(shard.index) != args.backend:
+            with shard.write_lock:
+                vectors = shard.floats.rows(np.arange(count))
+                converted = build_index(args.backend, vectors)
+                with shard.state_lock.write():
+                    shard.index = converted
+        shard.compact()
+
+        total += count
+        base_size += file_size(os.path.join(shard.path, f"base-{shard.manifest['base']:06d}.faiss"))
+        print(f"{shard.name}: converted {count} vectors to {index_backend(shard.index)}")
+
+    if total == 0:
+        print(f"No vectors in {db_dir}, nothing to convert")
+        return
+    if legacy_size:
+        print(f"vectors.faiss: {legacy_size / total:.1f} bytes per vector")
+    print(f"{args.backend} bases: {base_size / total:.1f} bytes per vector")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Run from any directory, importing backend, scripts and benchmarks from the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the database the models create on import out of the working directory
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='rag-tests-')}/documents.db")
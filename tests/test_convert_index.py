@@ -0,0 +1,57 @@
+"""Smoke tests running scripts/convert_index.py on a small store"""
+import os
+import subprocess
+import sys
+import uuid
+import numpy as np
+import pytest
+from backend import config
+from backend.services.index_factory import index_backend
+from backend.services.shard import Shard
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIM = 32
+VECTORS = 50
+
+def open_shard(db_dir: str) -> Shard:
+    shard = Shard("shard-000", os.path.join(db_dir, "shards", "shard-000"), DIM)
+    shard.load()
+    return shard
+
+@pytest.mark.parametrize("source, target", [
+    # Fewer than SQ_TRAIN_MIN vectors, so loading does not migrate them itself
+    ("flat", "sq8"),
+    ("hnsw", "flat"),
+    ("hnsw", "ivf_flat"),
+    ("flat", "hnsw"),
+])
+def test_convert_index(tmp_path, monkeypatch, source, target):
+    db_dir = str(tmp_path / "vector_db")
+    vectors = np.random.default_rng(0).standard_normal((VECTORS, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    monkeypatch.setattr(config, "INDEX_BACKEND", source)
+    shard = open_shard(db_dir)
+    shard.add_embeddings(
+        vectors, [f"chunk {i}" for i in range(VECTORS)],
+        [{"page_number": 1, "document_id": "doc"}] * VECTORS, [str(uuid.uuid4()) for _ in range(VECTORS)],
+    )
+    # Write the index as a base, so the store is reopened with the source backend
+    shard.compact()
+    assert index_backend(shard.index) == source
+
+    env = {**os.environ, "IVF_NLIST": "4", "IVF_TRAIN_MIN": "8", "MULTI_PROCESS": "false"}
+    result = subprocess.run(
+        [sys.executable, "-m", "scripts.convert_index", "--backend", target, "--db-dir", db_dir],
+        cwd=REPO_DIR, env=env, capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    assert f"converted {VECTORS} vectors to {target}" in result.stdout
+
+    monkeypatch.setattr(config, "INDEX_BACKEND", target)
+    converted = open_shard(db_dir)
+    assert index_backend(converted.index) == target
+    assert converted.index.ntotal == VECTORS
+    assert len(converted.chunks) == VECTORS
+    _, positions = converted.index.search(vectors[:1], 1)
+    assert converted.chunks.get(int(positions[0][0]))[0] == "chunk 0"
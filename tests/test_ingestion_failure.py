@@ -0,0 +1,81 @@
+"""A document whose ingestion fails part-way leaves no chunks in the vector store"""
+import asyncio
+import zlib
+from types import SimpleNamespace
+from typing import List
+import fitz
+import numpy as np
+import pytest
+from backend import config
+from backend.services import document_ingestion, vector_store
+from backend.services.embedders import Embedder
+
+DIM = 32
+
+class HashEmbedder(Embedder):
+    """Deterministic vectors derived from each text, standing in for a model"""
+    name = "hash"
+    dimension = DIM
+    max_seq_length = 128
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return np.stack([np.random.default_rng(zlib.crc32(text.encode('utf-8'))).standard_normal(DIM) for text in texts]).astype(np.float32)
+
+class Session:
+    async def commit(self) -> None:
+        pass
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """An empty vector store under tmp_path, with small ingestion batches"""
+    monkeypatch.setattr(config, "VECTOR_DB_DIR", str(tmp_path / "vector_db"))
+    monkeypatch.setattr(config, "INDEX_BACKEND", "flat")
+    monkeypatch.setattr(config, "MULTI_PROCESS", False)
+    monkeypatch.setattr(config, "INGEST_BATCH_PAGES", 1)
+    monkeypatch.setattr(config, "INGEST_BATCH_CHUNKS", 1)
+    monkeypatch.setattr(vector_store, "create_embedder", lambda backend, model: HashEmbedder())
+    for name, value in (("initialized", False), ("shards", {}), ("placement", {}), ("role", None)):
+        monkeypatch.setattr(vector_store, name, value)
+    return tmp_path
+
+def write_pdf(path: str, pages: int) -> None:
+    pdf = fitz.open()
+    for number in range(pages):
+        # Longer than a chunk, so every page batch yields chunks
+        words = " ".join([f"topic{number}"] * 150)
+        pdf.new_page().insert_textbox(fitz.Rect(36, 36, 576, 806), words, fontsize=8)
+    pdf.save(path)
+    pdf.close()
+
+def test_failed_ingestion_removes_committed_chunks(store, monkeypatch):
+    file_path = str(store / "doc.pdf")
+    write_pdf(file_path, 4)
+    document = SimpleNamespace(
+        id="doc", file_path=file_path, total_pages=4, status="queued", error=None,
+        pages_processed=0, chunks_embedded=0, total_chunks=0,
+    )
+
+    # The third batch fails, after two were committed to the vector store
+    add_documents = document_ingestion.add_documents
+    calls = []
+
+    async def failing_add_documents(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 3:
+            raise RuntimeError("embedding failed")
+        await add_documents(*args, **kwargs)
+
+    monkeypatch.setattr(document_ingestion, "add_documents", failing_add_documents)
+
+    async def ingest():
+        with pytest.raises(RuntimeError, match="embedding failed"):
+            await document_ingestion.process_pdf(document, Session())
+        assert vector_store.indexed_progress("doc") == (0, 0)
+        return await vector_store.search_documents("topic0", 5)
+
+    results = asyncio.run(ingest())
+    assert len(calls) == 3
+    assert document.status == "failed"
+    assert document.error == "embedding failed"
+    assert (document.pages_processed, document.chunks_embedded) == (0, 0)
+    assert results == []